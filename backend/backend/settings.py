@@ -64,6 +64,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'triplog.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -112,6 +113,29 @@ DATABASES = {
 }
 
 
+# Caches
+# "responses" holds serialized read responses (see triplog.response_cache). Writes
+# invalidate them through the cache itself, so every worker must share it: the
+# default directory is shared by the workers of one host. Across hosts, point it
+# at Redis (RESPONSE_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache,
+# RESPONSE_CACHE_LOCATION=redis://...), or turn it off with
+# RESPONSE_CACHE_BACKEND=django.core.cache.backends.dummy.DummyCache.
+# Never use LocMemCache here with more than one worker.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': os.environ.get("RESPONSE_CACHE_BACKEND", 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get("RESPONSE_CACHE_LOCATION", BASE_DIR / "response_cache"),
+        'TIMEOUT': int(os.environ.get("RESPONSE_CACHE_TTL", 300)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 5000)),
+        },
+    },
+}
+
+
 # Models
 AUTH_USER_MODEL = 'triplog.CustomUser'
 
@@ -161,10 +185,15 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'triplog.authentication.CachedJWTAuthentication',
     ),
 }
 
+# Default and upper bound for ?page_size= on the paginated (whole-table) list endpoints.
+# Kept out of REST_FRAMEWORK since no paginator is installed globally.
+API_PAGE_SIZE = int(os.environ.get("API_PAGE_SIZE", 100))
+API_MAX_PAGE_SIZE = int(os.environ.get("API_MAX_PAGE_SIZE", 500))
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),  # Access token validity
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),     # Refresh token validity
@@ -173,5 +202,72 @@ SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),               # Use Bearer scheme
 }
 
+# Users behind valid access tokens are reused for this many seconds per
+# process instead of being loaded on every request; 0 loads them every time
+AUTH_USER_CACHE = {
+    "SECONDS": int(os.environ.get("AUTH_USER_CACHE_SECONDS", 0)),
+    "SIZE": 10000,
+}
+
+# Road distance lookups (see triplog.distance for all options)
+# DISTANCE_MODE: "routed" (route every ping), "local" (great-circle only) or
+# "reconciled" (great-circle per ping, one routed request per closed entry)
+DISTANCE_SERVICE = {
+    "MODE": os.environ.get("DISTANCE_MODE", "routed"),
+    "OSRM_URL": os.environ.get("OSRM_URL", "http://router.project-osrm.org"),
+    "CONNECT_TIMEOUT": 0.5,
+    "READ_TIMEOUT": 1.5,
+    "CACHE_SIZE": 10000,
+    "PERSISTENT_CACHE": os.environ.get("DISTANCE_CACHE_PATH"),
+    "LOCAL_ROAD_FACTOR": float(os.environ.get("DISTANCE_LOCAL_ROAD_FACTOR", 1.0)),
+    # DISTANCE_ROUTER=graph answers in-process from ROAD_GRAPH_PATH instead of OSRM
+    "ROUTER": os.environ.get("DISTANCE_ROUTER", "osrm"),
+    "GRAPH_PATH": os.environ.get("ROAD_GRAPH_PATH"),
+}
+
+# Stop schedules served by /api/trips/<id>/plan/
+TRIP_PLANNER = {
+    "AVERAGE_SPEED_MPH": 55,
+    "FUEL_EVERY_MILES": 1000,
+    "FUEL_STOP_MINUTES": 30,
+    "HOURS_RESOLUTION_MINUTES": 15,
+}
+
+# Rendered daily log sheets, stored under a hash of the rows they are drawn from
+LOG_SHEETS = {
+    "CACHE_DIR": os.environ.get("LOG_SHEET_CACHE_DIR", BASE_DIR / "log_sheets"),
+    "PNG_SCALE": 2.0,
+}
+
+# Change events pushed to /api/trips/<id>/events/, /api/logs/<id>/events/ and
+# the /ws/ WebSocket routes (ASGI only). The broker is in-process, so run a
+# single ASGI worker, or clients only see writes handled by their own worker.
+EVENTS = {
+    "QUEUE_SIZE": 100,
+    "KEEPALIVE_SECONDS": 15,
+    "RETRY_MS": 3000,
+}
+
+# Ping ingestion: "sync" persists inside the request, "queued" acknowledges
+# after appending to the local queue drained by `manage.py drain_ingest_queue`
+INGEST_QUEUE = {
+    "MODE": os.environ.get("INGEST_MODE", "sync"),
+    "PATH": os.environ.get("INGEST_QUEUE_PATH", BASE_DIR / "ingest_queue.sqlite3"),
+    "LEASE_SECONDS": 60,
+    "MAX_ATTEMPTS": 5,
+}
+
+
+# Per-endpoint metrics served on /api/metrics/. Point METRICS_DIR at a
+# directory shared by the workers of a host to aggregate across processes.
+# The endpoint answers only requests with "Authorization: Bearer $METRICS_TOKEN",
+# and is off while no token is set
+METRICS = {
+    "DIRECTORY": os.environ.get("METRICS_DIR"),
+    "FLUSH_SECONDS": 1.0,
+    "TOKEN": os.environ.get("METRICS_TOKEN"),
+}
+
 
 SITE_ID = 1
+
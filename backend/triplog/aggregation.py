@@ -0,0 +1,210 @@
+from datetime import timedelta
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+from django.db import IntegrityError, transaction
+from django.db.models import Sum, F, Q, ExpressionWrapper, fields
+from django.utils import timezone
+from .models import TripLog, LogEntry, DailyDutyRollup
+from .compliance import cycle_hours_left
+from .response_cache import invalidate
+from .events import notify
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# LogEntry.status -> TripLog total hours column
+STATUS_HOUR_FIELDS = {
+    "off_duty": "total_off_duty_hours",
+    "sleeper": "total_sleeper_hours",
+    "driving": "total_driving_hours",
+    "on_duty": "total_on_duty_hours",
+}
+
+# TripLog total hours column -> DailyDutyRollup column
+ROLLUP_FIELDS = {
+    "total_off_duty_hours": "off_duty_hours",
+    "total_sleeper_hours": "sleeper_hours",
+    "total_driving_hours": "driving_hours",
+    "total_on_duty_hours": "on_duty_hours",
+}
+
+# Rolling TripLog column -> days back from the log date
+ROLLING_WINDOWS = {
+    "total_on_duty_hours_last_6_days": 6,
+    "total_on_duty_hours_last_7_days": 7,
+    "total_on_duty_hours_last_8_days": 8,
+    "total_on_duty_hours_last_7_days_60": 7,
+}
+
+def timedelta_to_decimal(td):
+    """Converts timedelta to total hours as Decimal (5,2 format)"""
+
+
+    total_seconds = td.total_seconds()  # Convert timedelta to seconds
+    total_hours = total_seconds / 3600  # Convert seconds to hours
+    return Decimal(total_hours).quantize(Decimal("0.00"), rounding=ROUND_DOWN)
+
+
+def miles_to_decimal(miles):
+    """Converts a float mileage to the Decimal (10,2) format used on TripLog"""
+    return Decimal(str(miles or 0)).quantize(Decimal("0.00"), rounding=ROUND_HALF_UP)
+
+
+def log_total_aggregates():
+    """Aggregate expressions for the per-status durations and mileages of LogEntries"""
+    duration_expr = ExpressionWrapper(
+        F("end_time") - F("start_time"), output_field=fields.DurationField()
+    )
+
+    aggregates = {
+        field: Sum(duration_expr, filter=Q(status=status))
+        for status, field in STATUS_HOUR_FIELDS.items()
+    }
+    aggregates["total_miles_driving_today"] = Sum("mileage", filter=Q(status="driving"))
+    aggregates["total_miles_today"] = Sum("mileage")
+    return aggregates
+
+
+def log_totals_from_row(row):
+    """TripLog total columns from a row of log_total_aggregates() results"""
+    totals = {
+        field: timedelta_to_decimal(row.get(field) or timedelta())
+        for field in STATUS_HOUR_FIELDS.values()
+    }
+    totals["total_miles_driving_today"] = miles_to_decimal(row.get("total_miles_driving_today"))
+    totals["total_miles_today"] = miles_to_decimal(row.get("total_miles_today"))
+    return totals
+
+
+def compute_log_totals(log_id):
+    """Per-status durations and mileages for one TripLog in a single aggregate query"""
+    return log_totals_from_row(LogEntry.objects.filter(log=log_id).aggregate(**log_total_aggregates()))
+
+
+def apply_rollup_delta(driver_id, day, deltas):
+    """Add per-status hour deltas (keyed by rollup field) to a driver's day row"""
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    updated = DailyDutyRollup.objects.filter(driver_id=driver_id, day=day).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+    if updated:
+        return
+
+    try:
+        with transaction.atomic():
+            DailyDutyRollup.objects.create(driver_id=driver_id, day=day, **deltas)
+    except IntegrityError:
+        # Created concurrently, fall back to the increment
+        DailyDutyRollup.objects.filter(driver_id=driver_id, day=day).update(
+            **{field: F(field) + delta for field, delta in deltas.items()}
+        )
+
+
+def rebuild_driver_days(driver_id, days):
+    """Recompute a driver's rollup rows for the given days straight from TripLog"""
+    days = set(days)
+    if not days:
+        return
+
+    rows = (
+        TripLog.objects
+        .filter(trip__driver_id=driver_id, log_date__in=days)
+        .values("log_date")
+        .annotate(**{rollup: Sum(field) for field, rollup in ROLLUP_FIELDS.items()})
+    )
+    found = set()
+    for row in rows:
+        found.add(row["log_date"])
+        DailyDutyRollup.objects.update_or_create(
+            driver_id=driver_id,
+            day=row["log_date"],
+            defaults={rollup: row[rollup] or Decimal("0.00") for rollup in ROLLUP_FIELDS.values()},
+        )
+
+    # Days whose logs are all gone
+    DailyDutyRollup.objects.filter(driver_id=driver_id, day__in=days - found).delete()
+
+
+def rolling_totals(on_duty_by_day, day):
+    """On-duty totals for the 6/7/8 day windows ending on day, from a {day: on-duty hours} mapping"""
+    return {
+        field: sum(
+            (on_duty_by_day.get(day - timedelta(days=back), Decimal("0.00")) for back in range(span + 1)),
+            Decimal("0.00"),
+        )
+        for field, span in ROLLING_WINDOWS.items()
+    }
+
+
+def recent_duty_days(driver_id, day):
+    """{day: (on-duty hours, driving hours)} of the rollup rows the windows ending on day need, at most nine"""
+    rows = DailyDutyRollup.objects.filter(
+        driver_id=driver_id, day__gte=day - timedelta(days=max(ROLLING_WINDOWS.values())), day__lte=day
+    ).values_list("day", "on_duty_hours", "driving_hours")
+    return {row_day: (on_duty, driving) for row_day, on_duty, driving in rows}
+
+
+def update_trip_log(log_id):
+    """Recompute every TripLog aggregate from its LogEntries and write them in one UPDATE"""
+    with transaction.atomic():
+        log = (
+            TripLog.objects
+            .select_for_update()
+            .select_related("trip")
+            .only("id", "log_date", "trip__driver_id", "trip__cycle_type", *STATUS_HOUR_FIELDS.values())
+            .filter(id=log_id)
+            .first()
+        )
+        if log is None:
+            logger.warning(f"update_trip_log: TripLog {log_id} not found")
+            return
+
+        values = compute_log_totals(log_id)
+
+        # Fold the change in this log's hours into the driver's day before reading the windows
+        driver_id = log.trip.driver_id
+        apply_rollup_delta(driver_id, log.log_date, {
+            rollup: values[field] - getattr(log, field)
+            for field, rollup in ROLLUP_FIELDS.items()
+        })
+        duty_days = recent_duty_days(driver_id, log.log_date)
+        values.update(rolling_totals({day: on_duty for day, (on_duty, _) in duty_days.items()}, log.log_date))
+
+        #  Available Hours Tomorrow under the trip's 60/7 or 70/8 rule, from the same rows
+        values["available_hours_tomorrow"] = cycle_hours_left(
+            log.trip.cycle_type, {day: on_duty + driving for day, (on_duty, driving) in duty_days.items()}, log.log_date,
+        )
+
+        values["updated_at"] = timezone.now()
+        TripLog.objects.filter(id=log_id).update(**values)
+        invalidate(trip_ids=[log.trip_id], log_ids=[log_id])
+        notify("totals", log.trip_id, log_id, **values)
+
+
+def remove_log_from_rollup(log):
+    """Subtract a TripLog's hours from its driver's day, e.g. before deleting it"""
+    apply_rollup_delta(log.trip.driver_id, log.log_date, {
+        rollup: -getattr(log, field) for field, rollup in ROLLUP_FIELDS.items()
+    })
+
+
+def apply_open_entry_delta(log_id, status, mileage_delta):
+    """Refresh the mileage of a log after pings on its still-open entry, without recomputing the log
+
+    Closed-entry durations are unaffected by such a ping (the open entry has no
+    end_time yet), so only the mileage columns move. They are re-summed in one
+    aggregate rather than incremented, since adding each ping's miles rounded
+    to cents would drift from what update_trip_log computes.
+    """
+    if not mileage_delta:
+        return
+
+    aggregates = log_total_aggregates()
+    fields = ["total_miles_today"] + (["total_miles_driving_today"] if status == "driving" else [])
+    row = LogEntry.objects.filter(log=log_id).aggregate(**{field: aggregates[field] for field in fields})
+    values = {field: miles_to_decimal(row[field]) for field in fields}
+    values["updated_at"] = timezone.now()
+    TripLog.objects.filter(id=log_id).update(**values)
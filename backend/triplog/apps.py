@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class TriplogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'triplog'
+
+    def ready(self):
+        from .metrics import install_query_counter
+        connection_created.connect(install_query_counter, dispatch_uid="triplog-query-counter")
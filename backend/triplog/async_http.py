@@ -0,0 +1,125 @@
+from urllib.parse import urlencode, urlsplit
+import asyncio
+import json
+import ssl
+import weakref
+
+
+class HTTPError(Exception):
+    """Non-2xx answer from the backend"""
+
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+class AsyncHTTPPool:
+    """Keep-alive HTTP/1.1 connections to one backend, for JSON GETs from async code
+
+    Just enough HTTP for the routing backend (GET, Content-Length or chunked
+    bodies) on asyncio streams, so no async client library is needed.
+    Connections belong to an event loop, so idle connections and the limit
+    of `size` concurrent requests are kept per loop. Redirects are not
+    followed (a 3xx raises HTTPError) and no proxy is used, so `base_url`
+    must reach the backend directly.
+    """
+
+    def __init__(self, base_url, size=10):
+        parts = urlsplit(base_url)
+        self.secure = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.secure else 80)
+        self.host_header = parts.netloc
+        self.base_path = parts.path.rstrip("/")
+        self.size = size
+        self._loops = weakref.WeakKeyDictionary()  # loop -> (semaphore, idle connections)
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._loops:
+            self._loops[loop] = (asyncio.Semaphore(self.size), [])
+        return self._loops[loop]
+
+    async def _connect(self, timeout):
+        context = ssl.create_default_context() if self.secure else None
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context, server_hostname=self.host if context else None),
+            timeout,
+        )
+
+    async def get_json(self, path, params=None, connect_timeout=0.5, read_timeout=1.5):
+        """Decoded JSON body of GET base_url + path; raises OSError, EOFError, TimeoutError, HTTPError or ValueError"""
+        target = self.base_path + path + (f"?{urlencode(params)}" if params else "")
+        limit, idle = self._state()
+        async with limit:
+            while True:
+                reused = bool(idle)
+                reader, writer = idle.pop() if reused else await self._connect(connect_timeout)
+                try:
+                    status, body, keep_alive = await asyncio.wait_for(self._exchange(reader, writer, target), read_timeout)
+                except BaseException as e:
+                    writer.close()
+                    if reused and isinstance(e, (ConnectionError, EOFError)):
+                        continue  # The server dropped the idle connection; retry on a fresh one
+                    raise
+                break
+            if keep_alive:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+
+        if not 200 <= status < 300:
+            raise HTTPError(status)
+        return json.loads(body)
+
+    async def _exchange(self, reader, writer, target):
+        writer.write(
+            f"GET {target} HTTP/1.1\r\nHost: {self.host_header}\r\nAccept: application/json\r\n"
+            f"Connection: keep-alive\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+
+        while True:
+            status_line = await reader.readline()
+            if not status_line:
+                raise EOFError("Connection closed before the response")
+            version, status = status_line.split(b" ", 2)[:2]
+            status = int(status)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if not 100 <= status < 200:
+                break  # 1xx responses are interim, the final one follows
+
+        keep_alive = version == b"HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if status in (204, 304):
+            body = b""  # Never carry a body, whatever the headers say
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0], 16)
+                if size == 0:
+                    await reader.readline()  # No trailers are expected
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            # Delimited by the server closing the connection, which then cannot be reused
+            body = await reader.read()
+            keep_alive = False
+        return status, body, keep_alive
+
+    async def aclose(self):
+        """Close the idle connections of the running loop"""
+        _, idle = self._state()
+        while idle:
+            _, writer = idle.pop()
+            writer.close()
+            await writer.wait_closed()
@@ -0,0 +1,69 @@
+from copy import copy
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from .distance import LRUCache
+import time
+
+
+DEFAULTS = {
+    "SECONDS": 0,       # how long a loaded user is trusted; 0 loads it on every request
+    "SIZE": 10000,      # users kept per process
+}
+
+
+def auth_cache_options():
+    return {**DEFAULTS, **getattr(settings, "AUTH_USER_CACHE", {})}
+
+
+# user id -> (monotonic expiry, user)
+user_cache = LRUCache(auth_cache_options()["SIZE"])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def forget_user(sender, instance, **kwargs):
+    # Only reaches this process; other workers catch up within SECONDS
+    user_cache.delete(instance.pk)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that takes the user from the verified token and a short-lived per-process cache
+
+    The token's signature and expiry are checked as usual; its user id claim
+    then selects a user loaded at most once per AUTH_USER_CACHE["SECONDS"],
+    so a driver pinging every few seconds costs no user query. Deactivating
+    or deleting a user takes effect at once in the process that saved it and
+    within SECONDS elsewhere; a password change still revokes tokens at once
+    when CHECK_REVOKE_TOKEN is on.
+    """
+
+    def get_user(self, validated_token):
+        seconds = auth_cache_options()["SECONDS"]
+        if not seconds:
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        cached = user_cache.get(user_id)
+        if cached is None or cached[0] <= time.monotonic():
+            # Raises for missing and inactive users, which are therefore never cached
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, (time.monotonic() + seconds, user))
+        else:
+            user = cached[1]
+            if api_settings.CHECK_REVOKE_TOKEN and (
+                validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)
+            ):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        # Requests never share one instance
+        return copy(user)
@@ -0,0 +1,329 @@
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from .aggregation import update_trip_log
+from .distance import DistanceService, set_distance_service
+from .models import Trip, TripLog, LogEntry
+from .response_cache import response_cache
+from .scripts import advance
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+
+class StubDistanceService(DistanceService):
+    """Routing backend replaced by the local estimate plus a fixed simulated latency"""
+
+    def __init__(self, latency_ms=0, **options):
+        super().__init__(**options)
+        self.latency = latency_ms / 1000
+
+    def route(self, *coordinates):
+        if self.latency:
+            time.sleep(self.latency)
+        return sum(self.estimate(start, end) for start, end in zip(coordinates, coordinates[1:]))
+
+
+class QueryCounter:
+    """connection.execute_wrapper hook counting queries and their time"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+@contextmanager
+def throwaway_database():
+    """Point the default connection at a copy of its database, dropped on exit
+
+    Cases commit for real there, so commit cost and on_commit work are
+    measured while the original rows stay untouched. SQLite is copied with
+    the backup API, PostgreSQL with CREATE DATABASE ... TEMPLATE (which
+    needs no other sessions on the source database).
+    """
+    if connection.in_atomic_block:
+        raise ValueError("The benchmark cannot run inside a transaction")
+
+    original = connection.settings_dict
+    kept = None
+    if connection.vendor == "sqlite":
+        directory = None if connection.is_in_memory_db() else os.path.dirname(os.path.abspath(original["NAME"]))
+        fd, name = tempfile.mkstemp(prefix="benchmark-", suffix=".sqlite3", dir=directory)
+        os.close(fd)
+        connection.ensure_connection()
+        target = sqlite3.connect(name)
+        try:
+            connection.connection.backup(target)
+        finally:
+            target.close()
+        if connection.is_in_memory_db():
+            kept, connection.connection = connection.connection, None  # Closing would drop the database
+        else:
+            connection.close()
+    elif connection.vendor == "postgresql":
+        name = f"{original['NAME']}_benchmark_{os.getpid()}"
+        connection.close()
+        with connection._nodb_cursor() as cursor:
+            quote = connection.ops.quote_name
+            cursor.execute(f"CREATE DATABASE {quote(name)} TEMPLATE {quote(original['NAME'])}")
+    else:
+        raise ValueError(f"Cannot copy a {connection.vendor} database to benchmark against")
+
+    connection.settings_dict = {**original, "NAME": name}
+    try:
+        yield
+    finally:
+        connection.close()
+        connection.settings_dict = original
+        connection.connection = kept
+        if connection.vendor == "sqlite":
+            os.remove(name)
+        else:
+            with connection._nodb_cursor() as cursor:
+                cursor.execute(f"DROP DATABASE {connection.ops.quote_name(name)}")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(durations, queries, query_seconds, wall_seconds, errors):
+    ordered = sorted(durations)
+    calls = len(ordered)
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        "calls": calls,
+        "errors": errors,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "mean_ms": ms(sum(ordered) / calls) if calls else None,
+        "max_ms": ms(ordered[-1]) if calls else None,
+        "throughput_rps": round(calls / wall_seconds, 1) if wall_seconds else None,
+        "queries_per_call": round(queries / calls, 2) if calls else None,
+        "db_ms_per_call": ms(query_seconds / calls) if calls else None,
+    }
+
+
+class Benchmark:
+    """Runs the ingest and read hot paths against the configured database
+
+    Targets are drawn from the existing rows with a seeded RNG, so two runs
+    over the same seeded database exercise the same ids. Cases run against a
+    throwaway_database() copy, committing like the live write paths, and
+    with a private response cache, so neither the data nor the cache shared
+    by running workers change.
+    """
+
+    def __init__(self, iterations=200, warmup=10, seed=0, routing_latency_ms=0, warm_cache=False,
+                 distance_mode="routed"):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.rng = random.Random(seed)
+        self.routing_latency_ms = routing_latency_ms
+        self.warm_cache = warm_cache
+        self.distance_mode = distance_mode
+        self.client = Client()
+
+        self.trip_ids = list(Trip.objects.order_by("id").values_list("id", flat=True))
+        self.log_ids = list(TripLog.objects.order_by("id").values_list("id", flat=True))
+        if not self.trip_ids or not self.log_ids:
+            raise ValueError("The database has no trips to benchmark, seed it with generate_fleet first")
+
+        self.cases = {
+            "update-log-entry": self.update_log_entry_case(change_status=False),
+            "update-log-entry-status-change": self.update_log_entry_case(change_status=True),
+            "update-trip-log": self.update_trip_log_case(),
+            "trip-list": self.get_case(lambda: "/api/trips/"),
+            "trip-log-list": self.get_case(lambda: "/api/logs/"),
+            "log-entry-list": self.get_case(lambda: "/api/log-entries/"),
+            "trip-detail": self.get_case(lambda: f"/api/trips/{self.pick(self.trip_ids)}/"),
+            "trip-tree": self.get_case(lambda: f"/api/trips/{self.pick(self.trip_ids)}/tree/"),
+            "trip-logs-by-trip": self.get_case(lambda: f"/api/trip/logs/{self.pick(self.trip_ids)}/"),
+            "log-entries-by-log": self.get_case(lambda: f"/api/logs/log-entries/{self.pick(self.log_ids)}/"),
+        }
+
+    def pick(self, ids):
+        return ids[self.rng.randrange(len(ids))]
+
+    def get_case(self, make_path):
+        def setup():
+            def call():
+                return self.client.get(make_path()).status_code == 200
+            return call
+        return setup
+
+    def update_trip_log_case(self):
+        def setup():
+            def call():
+                update_trip_log(self.pick(self.log_ids))
+                return True
+            return call
+        return setup
+
+    def new_day_logs(self, count):
+        """A fresh TripLog on the day after the latest log of `count` ongoing trips
+
+        Pings then hit realistic drivers (with rollup history behind them)
+        without colliding with the timestamps of generated entries.
+        """
+        trips = list(
+            Trip.objects.filter(is_completed=False)
+            .annotate(last_day=Max("logs__log_date"))
+            .exclude(last_day=None)
+            .order_by("id")[:count]
+        ) or list(Trip.objects.annotate(last_day=Max("logs__log_date")).exclude(last_day=None)[:count])
+
+        targets = []
+        for trip in trips:
+            day = trip.last_day + timedelta(days=1)
+            log = TripLog.objects.create(trip=trip, log_date=day)
+            last_gps = (
+                LogEntry.objects.filter(log__trip=trip).order_by("-id")
+                .values_list("end_gps", flat=True).first()
+            ) or {}
+            position = (last_gps.get("latitude", 40.0), last_gps.get("longitude", -90.0))
+            start = timezone.make_aware(datetime.combine(day, dt_time.min))
+            targets.append({"log_id": log.id, "time": start, "position": position, "status": "driving"})
+        return targets
+
+    def update_log_entry_case(self, change_status):
+        def setup():
+            targets = self.new_day_logs(20)
+
+            def call():
+                target = targets[self.rng.randrange(len(targets))]
+                target["time"] += timedelta(seconds=60)
+                target["position"] = advance(target["position"], self.rng.uniform(0, 360), 1.0)
+                if change_status:
+                    target["status"] = "on_duty" if target["status"] == "driving" else "driving"
+                ping = {
+                    "logId": target["log_id"],
+                    "status": target["status"],
+                    "timestamp": target["time"].isoformat(),
+                    "gps": {"latitude": target["position"][0], "longitude": target["position"][1]},
+                }
+                response = self.client.post("/api/update-log-entry/", ping, content_type="application/json")
+                return response.status_code in (200, 202)
+            return call
+        return setup
+
+    def run_case(self, name):
+        counter = QueryCounter()
+        durations = []
+        errors = 0
+        call = self.cases[name]()
+        for _ in range(self.warmup):
+            call()
+
+        wall_seconds = 0.0
+        with connection.execute_wrapper(counter):
+            for _ in range(self.iterations):
+                if not self.warm_cache:
+                    response_cache().clear()  # Outside the timed region
+                started = time.perf_counter()
+                try:
+                    ok = call()
+                except Exception:
+                    ok = False
+                elapsed = time.perf_counter() - started
+                durations.append(elapsed)
+                wall_seconds += elapsed
+                errors += not ok
+                connection.queries_log.clear()
+        return summarize(durations, counter.count, counter.seconds, wall_seconds, errors)
+
+    def run(self, names=None, progress=None):
+        names = names or list(self.cases)
+        previous_service = set_distance_service(
+            StubDistanceService(self.routing_latency_ms, MODE=self.distance_mode)
+        )
+        previous_disable = logging.root.manager.disable
+        logging.disable(logging.INFO)  # DEBUG request/SQL logging would dominate the timings
+        private_cache = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "triplog-benchmark"}
+        try:
+            results = {}
+            with override_settings(CACHES={**settings.CACHES, "responses": private_cache}), throwaway_database():
+                for name in names:
+                    results[name] = self.run_case(name)
+                    if progress:
+                        progress(name, results[name])
+        finally:
+            logging.disable(previous_disable)
+            set_distance_service(previous_service)
+        return {"meta": self.meta(), "results": results}
+
+    def meta(self):
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        return {
+            "commit": commit,
+            "timestamp": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "database": connection.vendor,
+            "iterations": self.iterations,
+            "warmup": self.warmup,
+            "routing_latency_ms": self.routing_latency_ms,
+            "distance_mode": self.distance_mode,
+            "warm_cache": self.warm_cache,
+            "rows": {
+                "trips": len(self.trip_ids),
+                "logs": len(self.log_ids),
+                "entries": LogEntry.objects.count(),
+            },
+        }
+
+
+COMPARED = ("p50_ms", "p95_ms", "p99_ms", "queries_per_call")
+
+
+def compare(baseline, current):
+    """Rows of (case, metric, before, after, change %) for cases present in both runs"""
+    rows = []
+    for name, stats in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        for metric in COMPARED:
+            old, new = before.get(metric), stats.get(metric)
+            change = round((new - old) / old * 100, 1) if old and new is not None else None
+            rows.append((name, metric, old, new, change))
+    return rows
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def save_results(path, results):
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2)
@@ -0,0 +1,481 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from .models import Trip, TripLog, LogEntry, HosViolation, TripCompletion
+from .response_cache import invalidate
+import logging
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Property-carrying driver limits (49 CFR 395.3), in seconds
+DRIVING_LIMIT = 11 * HOUR
+WINDOW_LIMIT = 14 * HOUR
+BREAK_AFTER_DRIVING = 8 * HOUR
+BREAK_MIN = 30 * 60
+SHIFT_RESET_REST = 10 * HOUR
+CYCLE_RESTART_REST = 34 * HOUR
+
+# Trip.cycle_type -> (on-duty hour limit, days in the cycle)
+CYCLES = {"70/8": (70, 8), "60/7": (60, 7)}
+DEFAULT_CYCLE = "70/8"
+
+STATUS_CODES = {"off_duty": 0, "sleeper": 1, "driving": 2, "on_duty": 3}
+OFF_DUTY, SLEEPER, DRIVING, ON_DUTY = range(4)
+
+RULES = [rule for rule, _ in HosViolation.RULE_CHOICES]
+
+# History read before the checked range: a full 8-day cycle plus a 34-hour restart
+LOOKBACK = timedelta(days=8, hours=CYCLE_RESTART_REST // HOUR)
+
+# Drivers are laid end to end on one time axis, each shifted by this many
+# seconds (past any epoch timestamp), so one sorted array serves them all
+DRIVER_SPAN = 10 ** 11
+
+# Synthetic rows (gaps between entries) carry this instead of ids
+NO_ID = -1
+
+COLUMNS = ("driver", "start", "end", "status", "entry", "log", "trip", "limit", "days")
+
+
+def _first_of_driver(driver):
+    first = np.ones(len(driver), dtype=bool)
+    first[1:] = driver[1:] != driver[:-1]
+    return first
+
+
+def _runs(driver, flag):
+    """(run id per interval, index of each run's first interval) for runs of equal `flag` per driver"""
+    boundary = _first_of_driver(driver)
+    boundary[1:] |= flag[1:] != flag[:-1]
+    return np.cumsum(boundary) - 1, np.flatnonzero(boundary)
+
+
+def _sum_before(values, segment_start):
+    """Sum of `values` over the earlier elements of each element's segment"""
+    before = np.cumsum(values) - values
+    return before - before[np.flatnonzero(segment_start)][np.cumsum(segment_start) - 1]
+
+
+def _fill_gaps(a):
+    """Unlogged time between two of a driver's entries becomes an off-duty row"""
+    same_driver = a["driver"][1:] == a["driver"][:-1]
+    gap = np.flatnonzero(same_driver & (a["start"][1:] > a["end"][:-1]))
+    if not len(gap):
+        return a
+
+    filler = {name: values[gap] for name, values in a.items()}
+    filler["start"] = a["end"][gap]
+    filler["end"] = a["start"][gap + 1]
+    filler["status"] = np.full(len(gap), OFF_DUTY, dtype=a["status"].dtype)
+    for name in ("entry", "log", "trip"):
+        filler[name] = np.full(len(gap), NO_ID, dtype=a[name].dtype)
+
+    merged = {name: np.concatenate((values, filler[name])) for name, values in a.items()}
+    order = np.argsort(merged["start"], kind="stable")
+    return {name: values[order] for name, values in merged.items()}
+
+
+class Evaluation:
+    """HOS state of many drivers' duty intervals, computed with whole-array operations
+
+    Built from equal-length arrays (see COLUMNS) sorted by (driver, start),
+    with times in epoch seconds, an end of -1 for open entries and ids of -1
+    for rows that are not entries. Every rule is evaluated for all drivers
+    at once: intervals are shifted onto one time axis per driver, runs of
+    rest are grouped with cumulative sums and reduceat, and the trailing
+    cycle hours come from a cumulative on-duty curve read with searchsorted.
+    """
+
+    def __init__(self, arrays, as_of):
+        a = {name: np.asarray(arrays[name], dtype=np.int64) for name in COLUMNS}
+        self.as_of = int(as_of)
+        offset = a["driver"] * DRIVER_SPAN
+        a["start"] = a["start"] + offset
+        a["end"] = a["end"] + offset
+
+        # Open entries run until the driver's next entry, or until now
+        first = _first_of_driver(a["driver"])
+        has_next = np.append(~first[1:], False)
+        next_start = np.append(a["start"][1:], 0)
+        a["end"] = np.where(a["end"] < offset, np.where(has_next, next_start, self.as_of + offset), a["end"])
+
+        # Overlaps are clipped to the latest earlier end; earlier drivers' ends all sort below this offset
+        latest_end = np.maximum.accumulate(a["end"])
+        a["start"][1:] = np.maximum(a["start"][1:], latest_end[:-1])
+        a = {name: values[a["end"] > a["start"]] for name, values in a.items()}
+        self.a = a = _fill_gaps(a)
+
+        self.driver, self.start, self.end = a["driver"], a["start"], a["end"]
+        self.offset = self.driver * DRIVER_SPAN
+        self.duration = self.end - self.start
+        status = a["status"]
+        self.resting = status <= SLEEPER
+        self.driving = status == DRIVING
+        self.working = ~self.resting
+        self.first = _first_of_driver(self.driver)
+        self._evaluate()
+
+    def _evaluate(self):
+        driver, start, end, duration = self.driver, self.start, self.end, self.duration
+        resting, driving, working, first = self.resting, self.driving, self.working, self.first
+
+        # Rest runs: 10 hours end a shift, 34 hours restart the cycle
+        run, run_first = _runs(driver, resting)
+        self.run_start = start[run_first][run]
+        self.run_end = (start[run_first] + np.add.reduceat(duration, run_first))[run]
+        rest_before = np.zeros(len(driver), dtype=np.int64)
+        rest_before[1:] = np.where(resting[:-1], (self.run_end - self.run_start)[:-1], 0)
+        after_rest = working & ~first & (rest_before > 0)
+
+        shift_start = first | (after_rest & (rest_before >= SHIFT_RESET_REST))
+        self.restart = after_rest & (rest_before >= CYCLE_RESTART_REST)
+
+        # A break is any non-driving run of at least 30 minutes
+        run, run_first = _runs(driver, driving)
+        run_length = np.add.reduceat(duration, run_first)[run]
+        self.drive_run_start = start[run_first][run]
+        pause_before = np.zeros(len(driver), dtype=np.int64)
+        pause_before[1:] = np.where(~driving[:-1], run_length[:-1], 0)
+        break_start = shift_start | (driving & (pause_before >= BREAK_MIN))
+
+        drive_seconds = np.where(driving, duration, 0)
+        self.driven_in_shift = _sum_before(drive_seconds, shift_start)
+        self.driven_since_break = _sum_before(drive_seconds, break_start)
+
+        # The 14-hour window opens with the first on-duty time of the shift
+        work_start = np.where(working, start, np.iinfo(np.int64).max // 2)
+        self.window_open = np.minimum.reduceat(work_start, np.flatnonzero(shift_start))[np.cumsum(shift_start) - 1]
+
+        work_seconds = np.where(working, duration, 0)
+        self.work_before = np.cumsum(work_seconds) - work_seconds
+        self.restarts = start[self.restart]
+        self.driver_first_start = start[np.flatnonzero(first)][np.cumsum(first) - 1]
+
+    def worked_until(self, t):
+        """Cumulative on-duty seconds of the interval's driver up to axis time t"""
+        index = np.clip(np.searchsorted(self.start, t, side="right") - 1, 0, len(self.start) - 1)
+        inside = np.clip(t - self.start[index], 0, self.duration[index])
+        return self.work_before[index] + np.where(self.working[index], inside, 0)
+
+    def last_restart(self, t, offset):
+        """Axis time of the latest 34-hour restart at or before t, `offset` if none"""
+        index = np.searchsorted(self.restarts, t, side="right") - 1
+        found = self.restarts[np.maximum(index, 0)] if len(self.restarts) else offset
+        return np.where((index >= 0) & (found >= offset), found, offset)
+
+    def cycle_seconds(self, t, days, offset, floor):
+        """On-duty seconds in the `days` before axis time t, since the last restart"""
+        low = np.maximum(np.maximum(t - days * DAY, self.last_restart(t, offset)), floor)
+        return self.worked_until(t) - self.worked_until(np.minimum(low, t))
+
+    def violations(self):
+        """Arrays of rule index, entry, log, driver index, occurred_at and excess seconds"""
+        driving, start, end, duration = self.driving, self.start, self.end, self.duration
+        found = defaultdict(list)
+
+        def add(rule, mask, crossed, excess):
+            found["rule"].append(np.full(int(mask.sum()), RULES.index(rule)))
+            found["entry"].append(self.a["entry"][mask])
+            found["log"].append(self.a["log"][mask])
+            found["driver"].append(self.driver[mask])
+            found["at"].append((crossed - self.offset)[mask])
+            found["excess"].append(excess[mask])
+
+        for rule, done, limit in (
+            ("driving_11", self.driven_in_shift, DRIVING_LIMIT),
+            ("break_30", self.driven_since_break, BREAK_AFTER_DRIVING),
+        ):
+            over = done + duration - limit
+            add(rule, driving & (over > 0), start + np.maximum(limit - done, 0), np.minimum(over, duration))
+
+        window_close = self.window_open + WINDOW_LIMIT
+        crossed = np.maximum(start, window_close)
+        add("window_14", driving & (end > crossed), crossed, end - crossed)
+
+        over = self.cycle_seconds(end, self.a["days"], self.offset, self.driver_first_start) - self.a["limit"] * HOUR
+        excess = np.minimum(over, duration)
+        add("cycle", driving & (over > 0), end - excess, excess)
+
+        return {name: np.concatenate(parts) for name, parts in found.items()}
+
+    def _locate(self, driver, t):
+        """Axis times and interval indexes for (driver index, epoch second) queries"""
+        offset = np.asarray(driver, dtype=np.int64) * DRIVER_SPAN
+        t = np.asarray(t, dtype=np.int64) + offset
+        index = np.clip(np.searchsorted(self.start, t, side="right") - 1, 0, len(self.start) - 1)
+        return offset, t, index
+
+    def available_seconds(self, driver, t, limit, days):
+        """On-duty seconds a driver may still work in the day starting at epoch second t"""
+        offset, t, index = self._locate(driver, t)
+        limit, days = np.asarray(limit) * HOUR, np.asarray(days)
+        floor = self.driver_first_start[index]
+        used = self.cycle_seconds(t, days - 1, offset, floor)
+        # A rest still running at t counts as a restart once it reaches 34 hours
+        resting = (self.driver[index] * DRIVER_SPAN == offset) & self.resting[index] & (t >= self.run_start[index])
+        restarted = resting & (np.minimum(t, self.run_end[index]) - self.run_start[index] >= CYCLE_RESTART_REST)
+        return np.where(restarted, limit, np.maximum(limit - used, 0))
+
+    def recap(self, driver, t, days):
+        """(on-duty seconds in the cycle, length of the rest period around t) at the end t of a trip"""
+        offset, t, index = self._locate(driver, t)
+        floor = self.driver_first_start[index]
+        on_duty = self.cycle_seconds(t, np.asarray(days), offset, floor)
+        # The rest run holding the trip's final off-duty time, or the one starting right after it
+        _, _, before = self._locate(driver, np.asarray(t) - offset - 1)
+        rest = np.zeros(len(index), dtype=np.int64)
+        for i in (index, before):
+            run = np.where(
+                (self.driver[i] * DRIVER_SPAN == offset) & self.resting[i], self.run_end[i] - self.run_start[i], 0
+            )
+            rest = np.maximum(rest, run)
+        return on_duty, rest
+
+
+def driver_state(driver_id, cycle_type=DEFAULT_CYCLE, as_of=None):
+    """Seconds the driver has left at `as_of` before each limit binds
+
+    Returns drive, window, break and cycle seconds, plus how long the
+    driver has been resting. Time after the last entry counts as off duty.
+    The cycle is the trip's `cycle_type`; hours rolling out of the cycle
+    later are not credited.
+    """
+    as_of = as_of or timezone.now()
+    limit, days = CYCLES.get(cycle_type, CYCLES[DEFAULT_CYCLE])
+    state = {
+        "drive": DRIVING_LIMIT, "window": WINDOW_LIMIT, "break": BREAK_AFTER_DRIVING,
+        "cycle": limit * HOUR, "rest": 0,
+    }
+    arrays, drivers, _ = load_intervals([driver_id], as_of, as_of)
+    if not drivers:
+        return state
+
+    now = _epoch(as_of)
+    arrays["end"] = np.minimum(arrays["end"], now)  # Open entries stay -1 and close at now
+    if arrays["end"][-1] >= 0 and arrays["end"].max() < now:
+        # Off duty since the last entry closed
+        arrays = {name: np.append(values, values[-1]) for name, values in arrays.items()}
+        arrays["start"][-1], arrays["end"][-1], arrays["status"][-1] = arrays["end"].max(), now, OFF_DUTY
+
+    evaluation = Evaluation(arrays, now)
+    last = len(evaluation.start) - 1
+    duration = int(evaluation.duration[last])
+    driving = bool(evaluation.driving[last])
+    rest = int(evaluation.end[last] - evaluation.run_start[last]) if evaluation.resting[last] else 0
+    state["rest"] = rest
+
+    if rest < SHIFT_RESET_REST:
+        driven = int(evaluation.driven_in_shift[last]) + (duration if driving else 0)
+        state["drive"] = DRIVING_LIMIT - driven
+        if evaluation.window_open[last] < evaluation.end[last]:
+            state["window"] = int(evaluation.window_open[last] + WINDOW_LIMIT - evaluation.end[last])
+        pause = 0 if driving else int(evaluation.end[last] - evaluation.drive_run_start[last])
+        if pause < BREAK_MIN:
+            state["break"] = BREAK_AFTER_DRIVING - int(evaluation.driven_since_break[last]) - (duration if driving else 0)
+    if rest < CYCLE_RESTART_REST:
+        offset = evaluation.offset[last:]
+        used = evaluation.cycle_seconds(evaluation.end[last:], days, offset, evaluation.driver_first_start[last:])
+        state["cycle"] = limit * HOUR - int(used[0])
+    return {name: max(value, 0) for name, value in state.items()}
+
+
+def _epoch(value):
+    return int(value.timestamp())
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_default_timezone())
+
+
+def _hours(seconds):
+    return (Decimal(int(seconds)) / HOUR).quantize(Decimal("0.00"), rounding=ROUND_HALF_UP)
+
+
+def load_intervals(driver_ids, start, end):
+    """Entries of the drivers overlapping [start - LOOKBACK, end) as evaluation arrays
+
+    Returns (arrays, driver id per index, cycle type per trip id).
+    """
+    rows = (
+        LogEntry.objects
+        .filter(log__trip__driver_id__in=driver_ids, start_time__lt=end)
+        .filter(Q(end_time__isnull=True) | Q(end_time__gt=start - LOOKBACK))
+        .order_by("log__trip__driver_id", "start_time", "id")
+        .values_list(
+            "log__trip__driver_id", "start_time", "end_time", "status", "id", "log_id", "log__trip_id",
+            "log__trip__cycle_type",
+        )
+    )
+
+    drivers = []
+    cycle_types = {}
+    columns = {name: [] for name in COLUMNS}
+    for driver_id, start_time, end_time, status, entry_id, log_id, trip_id, cycle_type in rows.iterator():
+        if start_time is None:
+            continue
+        if not drivers or drivers[-1] != driver_id:
+            drivers.append(driver_id)
+        cycle_types[trip_id] = cycle_type if cycle_type in CYCLES else DEFAULT_CYCLE
+        limit, days = CYCLES[cycle_types[trip_id]]
+        columns["driver"].append(len(drivers) - 1)
+        columns["start"].append(_epoch(start_time))
+        columns["end"].append(_epoch(end_time) if end_time else -1)
+        columns["status"].append(STATUS_CODES.get(status, ON_DUTY))
+        columns["entry"].append(entry_id)
+        columns["log"].append(log_id)
+        columns["trip"].append(trip_id)
+        columns["limit"].append(limit)
+        columns["days"].append(days)
+
+    return {name: np.array(values, dtype=np.int64) for name, values in columns.items()}, drivers, cycle_types
+
+
+def _available_hours(evaluation, index_of, logs):
+    """Hours left the day after each log, from an evaluation holding its driver's intervals"""
+    if not logs:
+        return []
+    cycles = [CYCLES.get(log.trip.cycle_type, CYCLES[DEFAULT_CYCLE]) for log in logs]
+    if not len(evaluation.start):
+        # Only zero-length entries, nothing worked yet
+        return [_hours(limit * HOUR) for limit, _ in cycles]
+    available = evaluation.available_seconds(
+        [index_of[log.trip.driver_id] for log in logs],
+        [_epoch(_day_start(log.log_date + timedelta(days=1))) for log in logs],
+        [limit for limit, _ in cycles],
+        [days for _, days in cycles],
+    )
+    return [_hours(seconds) for seconds in available.tolist()]
+
+
+def cycle_hours_left(cycle_type, worked_by_day, day):
+    """On-duty hours left the day after `day`, from {day: on-duty + driving hours}, ignoring restarts
+
+    What update_trip_log writes from the DailyDutyRollup rows it already
+    reads; check_compliance and recompute_aggregates replace it with the
+    restart-aware value.
+    """
+    limit, days = CYCLES.get(cycle_type, CYCLES[DEFAULT_CYCLE])
+    used = sum(
+        (worked_by_day.get(day - timedelta(days=back), Decimal("0.00")) for back in range(days - 1)),
+        Decimal("0.00"),
+    )
+    return max(Decimal("0.00"), limit - used)
+
+
+def check_drivers(driver_ids, first_day, last_day, as_of):
+    """check_compliance for one batch of drivers, returns (violations, logs, recaps) written"""
+    range_start = _day_start(first_day)
+    range_end = _day_start(last_day + timedelta(days=1))
+    arrays, drivers, cycle_types = load_intervals(driver_ids, range_start, min(range_end, as_of))
+
+    violations = []
+    logs = []
+    recaps = []
+    if drivers:
+        evaluation = Evaluation(arrays, _epoch(as_of))
+        index_of = {driver_id: i for i, driver_id in enumerate(drivers)}
+        trip_of_log = dict(zip(arrays["log"].tolist(), arrays["trip"].tolist()))
+
+        found = evaluation.violations()
+        occurred = found["at"]
+        in_range = (occurred >= _epoch(range_start)) & (occurred < _epoch(range_end))
+        for rule, entry_id, log_id, driver, at, excess in zip(*(found[name][in_range].tolist() for name in (
+            "rule", "entry", "log", "driver", "at", "excess",
+        ))):
+            violations.append(HosViolation(
+                driver_id=drivers[driver],
+                log_id=log_id,
+                entry_id=entry_id,
+                rule=RULES[rule],
+                occurred_at=datetime.fromtimestamp(at, tz=dt_timezone.utc),
+                excess_hours=_hours(excess),
+                cycle_type=cycle_types[trip_of_log[log_id]],
+            ))
+
+        # Available hours for the day after each log, under the log's trip cycle
+        logs = list(
+            TripLog.objects
+            .filter(trip__driver_id__in=drivers, log_date__gte=first_day, log_date__lte=last_day)
+            .only("id", "trip_id", "log_date", "trip__driver_id", "trip__cycle_type")
+            .select_related("trip")
+        )
+        for log, hours in zip(logs, _available_hours(evaluation, index_of, logs)):
+            log.available_hours_tomorrow = hours
+
+        # Recaps of trips completed in the range, as of their last entry
+        trip_ends = (
+            LogEntry.objects
+            .filter(log__trip__driver_id__in=drivers, log__trip__status="completed")
+            .values("log__trip_id", "log__trip__driver_id", "log__trip__cycle_type")
+            .annotate(last_start=Max("start_time"), last_end=Max("end_time"))
+            .filter(last_end__gte=range_start, last_end__lt=range_end)
+        )
+        # Skip trips whose last entry is still open
+        trip_ends = [row for row in trip_ends if row["last_start"] is None or row["last_end"] >= row["last_start"]]
+        if trip_ends:
+            cycles = [CYCLES.get(row["log__trip__cycle_type"], CYCLES[DEFAULT_CYCLE]) for row in trip_ends]
+            drivers_ = [index_of[row["log__trip__driver_id"]] for row in trip_ends]
+            ends = [_epoch(row["last_end"]) for row in trip_ends]
+            on_duty, rest = evaluation.recap(drivers_, ends, [days for _, days in cycles])
+            available = evaluation.available_seconds(
+                drivers_, ends, [limit for limit, _ in cycles], [days for _, days in cycles],
+            )
+            for row, on_duty_seconds, rest_seconds, available_seconds in zip(
+                trip_ends, on_duty.tolist(), rest.tolist(), available.tolist()
+            ):
+                recaps.append((row["log__trip_id"], {
+                    "total_on_duty_last_period": round(on_duty_seconds / HOUR, 2),
+                    "available_hours_tomorrow": round(available_seconds / HOUR, 2),
+                    "consecutive_hours_off": round(rest_seconds / HOUR, 2),
+                    "reset_applied": rest_seconds >= CYCLE_RESTART_REST,
+                }))
+
+    with transaction.atomic():
+        HosViolation.objects.filter(
+            driver_id__in=driver_ids, occurred_at__gte=range_start, occurred_at__lt=range_end
+        ).delete()
+        HosViolation.objects.bulk_create(violations)
+        if logs:
+            now = timezone.now()
+            for log in logs:
+                log.updated_at = now
+            TripLog.objects.bulk_update(logs, ["available_hours_tomorrow", "updated_at"])
+            invalidate(trip_ids={log.trip_id for log in logs}, log_ids=[log.id for log in logs])
+        for trip_id, values in recaps:
+            TripCompletion.objects.update_or_create(trip_id=trip_id, defaults=values)
+
+    return len(violations), len(logs), len(recaps)
+
+
+def check_compliance(first_day, last_day, driver_ids=None, batch_size=500, as_of=None, progress=None):
+    """Evaluate HOS rules for the drivers' days first_day..last_day and store the results
+
+    Replaces the HosViolation rows of the range, sets available_hours_tomorrow
+    on the range's TripLogs (restart aware, under each trip's cycle) and
+    writes the TripCompletion recap of trips completed in the range. Drivers
+    are evaluated `batch_size` at a time, so memory stays bounded on a large
+    fleet. Gaps between entries count as off duty; split sleeper berth
+    periods are not paired.
+    """
+    as_of = as_of or timezone.now()
+    if driver_ids is None:
+        driver_ids = Trip.objects.order_by("driver_id").values_list("driver_id", flat=True).distinct()
+    driver_ids = sorted(set(driver_ids))
+
+    totals = {"drivers": len(driver_ids), "violations": 0, "logs": 0, "recaps": 0}
+    for offset in range(0, len(driver_ids), batch_size):
+        violations, logs, recaps = check_drivers(driver_ids[offset:offset + batch_size], first_day, last_day, as_of)
+        totals["violations"] += violations
+        totals["logs"] += logs
+        totals["recaps"] += recaps
+        if progress:
+            progress(min(offset + batch_size, len(driver_ids)), len(driver_ids))
+    return totals
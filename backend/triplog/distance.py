@@ -0,0 +1,378 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from requests.adapters import HTTPAdapter
+from .async_http import AsyncHTTPPool, HTTPError
+from .metrics import record_routing_call
+import asyncio
+import logging
+import math
+import numpy as np
+import sqlite3
+import threading
+import time
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+METERS_PER_MILE = 1609.34
+EARTH_RADIUS_MILES = 3958.8
+
+# "routed": every ping is routed (cached); "local": great-circle distance
+# for every ping, never routed; "reconciled": local per ping, then one routed
+# request per closed LogEntry along its track replaces the estimate
+MODES = ("routed", "local", "reconciled")
+
+DEFAULTS = {
+    "MODE": "routed",
+    "OSRM_URL": "http://router.project-osrm.org",
+    "CONNECT_TIMEOUT": 0.5,         # seconds
+    "READ_TIMEOUT": 1.5,            # seconds
+    "POOL_SIZE": 10,                # keep-alive connections per worker
+    "CACHE_SIZE": 10000,            # in-memory LRU entries
+    "CACHE_PRECISION": 4,           # decimal places kept from coordinates (~11 m)
+    "PERSISTENT_CACHE": None,       # path to a SQLite file, or None
+    "FALLBACK_ROAD_FACTOR": 1.2,    # great-circle -> road distance estimate
+    "BACKOFF_SECONDS": 30,          # skip the backend this long after a failure
+    "LOCAL_ROAD_FACTOR": 1.0,       # great-circle -> road distance in local/reconciled mode
+    "ROUTER": "osrm",               # "osrm" over HTTP, or "graph" for an in-process RoadGraph
+    "GRAPH_PATH": None,             # .npz written by `manage.py build_road_graph`
+    "SNAP_MAX_METERS": 500,         # farther from any road node than this -> estimate
+    "MAX_WAYPOINTS": 100,           # per reconciliation request
+}
+
+
+def gps_coordinates(gps):
+    """Returns (lat, lon) from a GPS dict using either naming scheme, or None"""
+    if not gps:
+        return None
+    lat = gps.get("latitude", gps.get("lat"))
+    lon = gps.get("longitude", gps.get("lon"))
+    if lat is None or lon is None:
+        return None
+    return float(lat), float(lon)
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """Great-circle distance in miles"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(min(1.0, a)))
+
+
+def haversine_miles_array(lat1, lon1, lat2, lon2):
+    """Vectorized haversine_miles over NumPy arrays of degrees"""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+
+
+class LRUCache:
+    """Thread-safe fixed-size LRU mapping"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class PersistentCache:
+    """SQLite-backed key -> miles store shared by all workers on a host"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS road_distance (key TEXT PRIMARY KEY, miles REAL NOT NULL)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        try:
+            row = self._connection().execute(
+                "SELECT miles FROM road_distance WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Distance cache read failed: {e}")
+            return None
+        return row[0] if row else None
+
+    def set(self, key, value):
+        try:
+            with self._connection() as conn:
+                conn.execute("INSERT OR REPLACE INTO road_distance (key, miles) VALUES (?, ?)", (key, value))
+        except sqlite3.Error as e:
+            logger.warning(f"Distance cache write failed: {e}")
+
+
+class DistanceService:
+    """Road distance between two GPS points via OSRM, with caching and a local fallback"""
+
+    def __init__(self, **options):
+        self.options = {**DEFAULTS, **options}
+        if self.options["MODE"] not in MODES:
+            raise ImproperlyConfigured(f"DISTANCE_SERVICE MODE must be one of {', '.join(MODES)}")
+        self.graph = self._load_graph() if self.options["ROUTER"] == "graph" else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.options["POOL_SIZE"])
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.cache = LRUCache(self.options["CACHE_SIZE"])
+        self.persistent = (
+            PersistentCache(self.options["PERSISTENT_CACHE"]) if self.options["PERSISTENT_CACHE"] else None
+        )
+        self._backoff_until = 0.0
+        self._async_pool = None
+
+    @property
+    def async_pool(self):
+        """Keep-alive connections for the a* methods, created on first async use"""
+        if self._async_pool is None:
+            self._async_pool = AsyncHTTPPool(self.options["OSRM_URL"], size=self.options["POOL_SIZE"])
+        return self._async_pool
+
+    def quantize(self, lat, lon):
+        precision = self.options["CACHE_PRECISION"]
+        return round(lat, precision), round(lon, precision)
+
+    def cache_key(self, start, end):
+        return f"{start[1]},{start[0]};{end[1]},{end[0]}"
+
+    def estimate(self, start, end):
+        """Local great-circle estimate scaled to approximate road distance"""
+        return haversine_miles(*start, *end) * self.options["FALLBACK_ROAD_FACTOR"]
+
+    def fetch(self, start, end):
+        """Routed distance in miles from the backend, or None on any failure"""
+        return self.route(start, end)
+
+    def _load_graph(self):
+        from .routing import RoadGraph  # routing builds on this module's helpers
+
+        if not self.options["GRAPH_PATH"]:
+            raise ImproperlyConfigured("DISTANCE_SERVICE ROUTER 'graph' needs a GRAPH_PATH")
+        started = time.perf_counter()
+        graph = RoadGraph.load(self.options["GRAPH_PATH"], snap_max_meters=self.options["SNAP_MAX_METERS"])
+        logger.info(f"Loaded road graph with {len(graph)} nodes in {time.perf_counter() - started:.2f}s")
+        return graph
+
+    def route(self, *coordinates):
+        """Routed distance in miles through (lat, lon) waypoints in order, or None on any failure"""
+        if self.graph is not None:
+            return self._route_graph(coordinates)
+
+        started = time.perf_counter()
+        try:
+            response = self.session.get(
+                f"{self.options['OSRM_URL'].rstrip('/')}{self._route_path(coordinates)}",
+                params={"overview": "false"},
+                timeout=(self.options["CONNECT_TIMEOUT"], self.options["READ_TIMEOUT"]),
+            )
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            return self._route_failed(e)
+        finally:
+            record_routing_call(time.perf_counter() - started)
+        return self._route_miles(data)
+
+    async def aroute(self, *coordinates):
+        """route() for async callers: the event loop is never blocked on the backend"""
+        if self.graph is not None:
+            # In-process and CPU-bound; there is nothing to wait on
+            return self._route_graph(coordinates)
+
+        started = time.perf_counter()
+        try:
+            data = await self.async_pool.get_json(
+                self._route_path(coordinates), {"overview": "false"},
+                connect_timeout=self.options["CONNECT_TIMEOUT"], read_timeout=self.options["READ_TIMEOUT"],
+            )
+        except (OSError, EOFError, asyncio.TimeoutError, HTTPError, ValueError) as e:
+            return self._route_failed(e)
+        finally:
+            record_routing_call(time.perf_counter() - started)
+        return self._route_miles(data)
+
+    def _route_graph(self, coordinates):
+        started = time.perf_counter()
+        try:
+            return self.graph.route_miles(*coordinates)
+        finally:
+            record_routing_call(time.perf_counter() - started)
+
+    def _route_path(self, coordinates):
+        waypoints = ";".join(f"{lon},{lat}" for lat, lon in coordinates)
+        return f"/route/v1/driving/{waypoints}"
+
+    def _route_failed(self, error):
+        logger.warning(f"Routing backend unavailable, using estimate: {error}")
+        self._backoff_until = time.monotonic() + self.options["BACKOFF_SECONDS"]
+        return None
+
+    def _route_miles(self, data):
+        if "routes" in data and data["routes"]:
+            return data["routes"][0]["distance"] / METERS_PER_MILE
+        return 0
+
+    @property
+    def routes_pings(self):
+        return self.options["MODE"] == "routed"
+
+    @property
+    def reconciles(self):
+        return self.options["MODE"] == "reconciled"
+
+    def local_distances(self, pairs):
+        """Great-circle miles for many (start_gps, end_gps) pairs in one NumPy pass, 0 where GPS is missing"""
+        coordinates = [(gps_coordinates(start), gps_coordinates(end)) for start, end in pairs]
+        valid = [i for i, (start, end) in enumerate(coordinates) if start and end]
+        miles = np.zeros(len(pairs))
+        if valid:
+            points = np.array([(*coordinates[i][0], *coordinates[i][1]) for i in valid])
+            miles[valid] = haversine_miles_array(*points.T) * self.options["LOCAL_ROAD_FACTOR"]
+        return miles.tolist()
+
+    def distances(self, pairs):
+        """Miles for (start_gps, end_gps) pairs: routed one by one, or locally in a batch"""
+        if self.routes_pings:
+            return [self.distance(start, end) for start, end in pairs]
+        return self.local_distances(pairs)
+
+    async def adistances(self, pairs):
+        """distances() for async callers; routed pairs are fetched concurrently, up to POOL_SIZE at a time"""
+        if self.routes_pings:
+            return list(await asyncio.gather(*(self.adistance(start, end) for start, end in pairs)))
+        return self.local_distances(pairs)
+
+    def _thin_track(self, points):
+        limit = self.options["MAX_WAYPOINTS"]
+        if len(points) > limit:
+            step = (len(points) - 1) / (limit - 1)
+            points = [points[round(i * step)] for i in range(limit)]
+        return points
+
+    def route_track(self, points):
+        """Routed miles along [(lat, lon), ...], thinned to MAX_WAYPOINTS, or None if unavailable"""
+        if len(points) < 2 or time.monotonic() < self._backoff_until:
+            return None
+        return self.route(*self._thin_track(points))
+
+    async def aroute_track(self, points):
+        if len(points) < 2 or time.monotonic() < self._backoff_until:
+            return None
+        return await self.aroute(*self._thin_track(points))
+
+    def _lookup(self, start_gps, end_gps):
+        """(miles, None) when answered without the backend, else (None, (start, end, key)) to fetch"""
+        start = gps_coordinates(start_gps)
+        end = gps_coordinates(end_gps)
+        if not start or not end:
+            return 0, None
+
+        start, end = self.quantize(*start), self.quantize(*end)
+        if start == end:
+            return 0, None
+
+        key = self.cache_key(start, end)
+        miles = self.cache.get(key)
+        if miles is not None:
+            return miles, None
+
+        if self.persistent:
+            miles = self.persistent.get(key)
+            if miles is not None:
+                self.cache.set(key, miles)
+                return miles, None
+
+        if time.monotonic() < self._backoff_until:
+            return self.estimate(start, end), None
+        return None, (start, end, key)
+
+    def _store(self, pending, miles):
+        start, end, key = pending
+        if miles is None:
+            # Estimates are not cached so the routed value replaces them once the backend recovers
+            return self.estimate(start, end)
+
+        self.cache.set(key, miles)
+        if self.persistent:
+            self.persistent.set(key, miles)
+        return miles
+
+    def distance(self, start_gps, end_gps):
+        """Road distance in miles between two GPS dicts, 0 if either is missing"""
+        miles, pending = self._lookup(start_gps, end_gps)
+        if pending is None:
+            return miles
+        return self._store(pending, self.fetch(*pending[:2]))
+
+    async def adistance(self, start_gps, end_gps):
+        """distance() for async callers"""
+        miles, pending = self._lookup(start_gps, end_gps)
+        if pending is None:
+            return miles
+        return self._store(pending, await self.aroute(*pending[:2]))
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_distance_service():
+    """Process-wide DistanceService configured from settings.DISTANCE_SERVICE"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = DistanceService(**getattr(settings, "DISTANCE_SERVICE", {}))
+    return _service
+
+
+def reset_distance_service():
+    """Drop the shared service so the next call picks up changed settings"""
+    global _service
+    with _service_lock:
+        _service = None
+
+
+def set_distance_service(service):
+    """Install a specific service (e.g. a stub for benchmarks), returning the previous one"""
+    global _service
+    with _service_lock:
+        previous, _service = _service, service
+    return previous
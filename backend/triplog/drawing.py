@@ -0,0 +1,211 @@
+from xml.sax.saxutils import escape
+import math
+import struct
+import zlib
+import numpy as np
+
+
+# 5x7 glyphs, five column bytes each with bit 0 at the top (the classic
+# HD44780 / GLCD layout). Lowercase draws as uppercase, anything else as "?".
+GLYPHS = {
+    " ": "0000000000", "!": "00005f0000", '"': "0007000700", "#": "147f147f14", "$": "242a7f2a12",
+    "%": "2313086462", "&": "3649552250", "'": "0005030000", "(": "001c224100", ")": "0041221c00",
+    "*": "082a1c2a08", "+": "08083e0808", ",": "0050300000", "-": "0808080808", ".": "0060600000",
+    "/": "2010080402", "0": "3e5149453e", "1": "00427f4000", "2": "4261514946", "3": "2141454b31",
+    "4": "1814127f10", "5": "2745454539", "6": "3c4a494930", "7": "0171090503", "8": "3649494936",
+    "9": "064949291e", ":": "0036360000", ";": "0056360000", "<": "0814224100", "=": "1414141414",
+    ">": "0041221408", "?": "0201510906", "@": "324979413e", "A": "7e1111117e", "B": "7f49494936",
+    "C": "3e41414122", "D": "7f4141221c", "E": "7f49494941", "F": "7f09090101", "G": "3e41415132",
+    "H": "7f0808087f", "I": "00417f4100", "J": "2040413f01", "K": "7f08142241", "L": "7f40404040",
+    "M": "7f0204027f", "N": "7f0408107f", "O": "3e4141413e", "P": "7f09090906", "Q": "3e4151215e",
+    "R": "7f09192946", "S": "4649494931", "T": "01017f0101", "U": "3f4040403f", "V": "1f2040201f",
+    "W": "7f2018207f", "X": "6314081463", "Y": "0304780403", "Z": "6151494543", "_": "4040404040",
+}
+GLYPH_MASKS = {
+    char: np.array([[(byte >> row) & 1 for byte in bytes.fromhex(columns)] for row in range(7)], dtype=bool)
+    for char, columns in GLYPHS.items()
+}
+
+# Average Helvetica advance as a fraction of the font size, for anchoring text in PDFs
+HELVETICA_ADVANCE = 0.52
+
+
+class Drawing:
+    """Vector page in points with a top-left origin, written out by the render_* functions
+
+    Holds only what a log sheet needs: lines, rectangles and single-line
+    text, so every backend stays a short loop over the same items.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.items = []
+
+    def line(self, x1, y1, x2, y2, width=0.5):
+        self.items.append(("line", x1, y1, x2, y2, width))
+
+    def rect(self, x, y, w, h, fill=None, stroke=0.5):
+        """`fill` is a gray level from 0 (black) to 1 (white), None for no fill"""
+        self.items.append(("rect", x, y, w, h, fill, stroke))
+
+    def text(self, x, y, value, size=8, anchor="start", bold=False):
+        """Text with its baseline at y, anchored at its start, middle or end"""
+        self.items.append(("text", x, y, str(value), size, anchor, bold))
+
+
+def _gray(level):
+    value = round(level * 255)
+    return f"#{value:02x}{value:02x}{value:02x}"
+
+
+def render_svg(drawing):
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{drawing.width}pt" height="{drawing.height}pt" '
+        f'viewBox="0 0 {drawing.width} {drawing.height}" font-family="Helvetica, Arial, sans-serif">',
+        f'<rect width="{drawing.width}" height="{drawing.height}" fill="#fff"/>',
+    ]
+    for kind, *args in drawing.items:
+        if kind == "line":
+            x1, y1, x2, y2, width = args
+            parts.append(f'<line x1="{x1:g}" y1="{y1:g}" x2="{x2:g}" y2="{y2:g}" stroke="#000" stroke-width="{width:g}"/>')
+        elif kind == "rect":
+            x, y, w, h, fill, stroke = args
+            paint = f'fill="{_gray(fill)}"' if fill is not None else 'fill="none"'
+            outline = f' stroke="#000" stroke-width="{stroke:g}"' if stroke else ""
+            parts.append(f'<rect x="{x:g}" y="{y:g}" width="{w:g}" height="{h:g}" {paint}{outline}/>')
+        else:
+            x, y, value, size, anchor, bold = args
+            weight = ' font-weight="bold"' if bold else ""
+            parts.append(
+                f'<text x="{x:g}" y="{y:g}" font-size="{size:g}" text-anchor="{anchor}"{weight}>{escape(value)}</text>'
+            )
+    parts.append("</svg>")
+    return "\n".join(parts).encode("utf-8")
+
+
+def _pdf_string(value):
+    data = value.encode("latin-1", "replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def _pdf_content(drawing):
+    height = drawing.height
+    ops = []
+    for kind, *args in drawing.items:
+        if kind == "line":
+            x1, y1, x2, y2, width = args
+            ops.append(f"{width:g} w {x1:g} {height - y1:g} m {x2:g} {height - y2:g} l S".encode())
+        elif kind == "rect":
+            x, y, w, h, fill, stroke = args
+            path = f"{x:g} {height - y - h:g} {w:g} {h:g} re"
+            if fill is not None:
+                ops.append(f"{fill:g} g {path} f 0 g".encode())
+            if stroke:
+                ops.append(f"{stroke:g} w {path} S".encode())
+        else:
+            x, y, value, size, anchor, bold = args
+            advance = len(value) * size * HELVETICA_ADVANCE
+            x -= {"start": 0, "middle": advance / 2, "end": advance}[anchor]
+            font = "/F2" if bold else "/F1"
+            ops.append(b"BT " + f"{font} {size:g} Tf {x:g} {height - y:g} Td ".encode() + _pdf_string(value) + b" Tj ET")
+    return b"\n".join(ops)
+
+
+def render_pdf(drawing):
+    """Single-page PDF 1.4 using the built-in Helvetica fonts, so nothing is embedded"""
+    content = _pdf_content(drawing)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {drawing.width:g} {drawing.height:g}] "
+        f"/Resources << /Font << /F1 4 0 R /F2 5 0 R >> >> /Contents 6 0 R >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+        f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def _png(pixels):
+    """8-bit grayscale PNG from a 2D uint8 array"""
+    height, width = pixels.shape
+    raw = np.zeros((height, width + 1), dtype=np.uint8)  # Filter type 0 per row
+    raw[:, 1:] = pixels
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)),
+        chunk(b"IEND", b""),
+    ))
+
+
+def render_png(drawing, scale=2.0):
+    """Rasterizes the drawing with NumPy; text uses the built-in 5x7 bitmap font"""
+    width, height = math.ceil(drawing.width * scale), math.ceil(drawing.height * scale)
+    canvas = np.full((height, width), 255, dtype=np.uint8)
+
+    def fill(x0, y0, x1, y1, value):
+        x0, x1 = sorted((int(round(x0)), int(round(x1))))
+        y0, y1 = sorted((int(round(y0)), int(round(y1))))
+        canvas[max(y0, 0):max(min(y1, height), 0), max(x0, 0):max(min(x1, width), 0)] = value
+
+    for kind, *args in drawing.items:
+        if kind == "line":
+            x1, y1, x2, y2, line_width = (value * scale for value in args)
+            half = max(line_width, 1) / 2
+            if x1 == x2 or y1 == y2:
+                fill(min(x1, x2) - half, min(y1, y2) - half, max(x1, x2) + half, max(y1, y2) + half, 0)
+            else:
+                steps = max(int(max(abs(x2 - x1), abs(y2 - y1))), 1)
+                for t in np.linspace(0, 1, steps + 1):
+                    x, y = x1 + (x2 - x1) * t, y1 + (y2 - y1) * t
+                    fill(x - half, y - half, x + half, y + half, 0)
+        elif kind == "rect":
+            x, y, w, h, level, stroke = args
+            x, y, w, h = x * scale, y * scale, w * scale, h * scale
+            if level is not None:
+                fill(x, y, x + w, y + h, round(level * 255))
+            if stroke:
+                edge = max(stroke * scale, 1)
+                for x0, y0, x1, y1 in ((x, y, x + w, y + edge), (x, y + h - edge, x + w, y + h),
+                                       (x, y, x + edge, y + h), (x + w - edge, y, x + w, y + h)):
+                    fill(x0, y0, x1, y1, 0)
+        else:
+            x, y, value, size, anchor, bold = args
+            pixel = max(1, round(size * scale / 10))
+            advance = 6 * pixel
+            x = x * scale - {"start": 0, "middle": len(value) * advance / 2, "end": len(value) * advance}[anchor]
+            top = int(round(y * scale)) - 7 * pixel
+            for i, char in enumerate(value):
+                mask = GLYPH_MASKS.get(char.upper(), GLYPH_MASKS["?"])
+                if bold:
+                    mask = mask | np.pad(mask[:, :-1], ((0, 0), (1, 0)))
+                glyph = np.kron(mask, np.ones((pixel, pixel), dtype=bool))
+                left = int(round(x + i * advance))
+                rows = slice(max(top, 0), max(min(top + glyph.shape[0], height), 0))
+                cols = slice(max(left, 0), max(min(left + glyph.shape[1], width), 0))
+                target = canvas[rows, cols]
+                target[glyph[rows.start - top:rows.stop - top, cols.start - left:cols.stop - left]] = 0
+    return _png(canvas)
+
+
+RENDERERS = {
+    "svg": (render_svg, "image/svg+xml"),
+    "pdf": (render_pdf, "application/pdf"),
+    "png": (render_png, "image/png"),
+}
@@ -0,0 +1,231 @@
+from collections import defaultdict
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from asgiref.sync import sync_to_async
+from .models import Trip, TripLog
+from .response_cache import trip_scope, log_scope
+import asyncio
+import itertools
+import json
+import logging
+import re
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "QUEUE_SIZE": 100,          # undelivered events per subscriber before it is told to resync
+    "KEEPALIVE_SECONDS": 15,    # SSE comment sent when a stream has been idle this long
+    "RETRY_MS": 3000,           # SSE reconnect delay suggested to browsers
+}
+
+WEBSOCKET_PATH_RE = re.compile(r"^/ws/(trips|logs)/(\d+)/?$")
+
+
+def events_options():
+    return {**DEFAULTS, **getattr(settings, "EVENTS", {})}
+
+
+class Subscription:
+    """Events for some channels, queued on the subscriber's event loop
+
+    Publishers run in request threads, so delivery hops onto the loop with
+    call_soon_threadsafe. A subscriber that falls QUEUE_SIZE events behind
+    loses its backlog and gets a single "resync" event instead, telling the
+    client to refetch rather than letting one slow reader hold memory.
+    """
+
+    def __init__(self, broker, channels, loop, queue_size):
+        self.broker = broker
+        self.channels = tuple(channels)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def deliver(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The subscriber's loop is gone without it unsubscribing
+            self.close()
+
+    def _put(self, event):
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = {"id": event["id"], "type": "resync", "trip": None, "log": None, "data": {}}
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """Next event, or None after `timeout` seconds without one"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """In-process publish/subscribe over trip and log channels
+
+    Only reaches subscribers connected to this process, which covers a
+    single-node ASGI deployment where the sync views run in the server's
+    thread pool. Writes made by other processes (queued-mode drain workers,
+    management commands) are not seen.
+    """
+
+    def __init__(self, queue_size=DEFAULTS["QUEUE_SIZE"]):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._channels = defaultdict(set)
+        self._ids = itertools.count(1)
+
+    def subscribe(self, channels, loop=None):
+        subscription = Subscription(self, channels, loop or asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            for channel in subscription.channels:
+                self._channels[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[channel]
+
+    def listening(self, channels):
+        with self._lock:
+            return any(channel in self._channels for channel in channels)
+
+    def publish(self, channels, event):
+        """Send `event` once to every subscriber of any of `channels`"""
+        with self._lock:
+            subscribers = set().union(*(self._channels.get(channel, ()) for channel in channels))
+            event = {"id": next(self._ids), **event}
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return len(subscribers)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Process-wide broker configured from settings.EVENTS"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = LocalBroker(queue_size=events_options()["QUEUE_SIZE"])
+    return _broker
+
+
+def set_broker(broker):
+    """Install a specific broker (e.g. a fresh one in tests), returning the previous one"""
+    global _broker
+    with _broker_lock:
+        previous, _broker = _broker, broker
+    return previous
+
+
+def notify(event_type, trip_id=None, log_id=None, **data):
+    """Publish an event on the trip's and the log's channels once the transaction commits
+
+    Costs one dict lookup when nobody is subscribed, so writers can call it
+    unconditionally. Like invalidate(), publishing after commit means a
+    client refetching on an event always reads the new rows.
+    """
+    channels = []
+    if trip_id is not None:
+        channels.append(trip_scope(trip_id))
+    if log_id is not None:
+        channels.append(log_scope(log_id))
+    broker = get_broker()
+    if not broker.listening(channels):
+        return
+    event = {"type": event_type, "trip": trip_id, "log": log_id, "data": data}
+    transaction.on_commit(lambda: broker.publish(channels, event))
+
+
+def entry_event(entry):
+    return {
+        "id": entry.id,
+        "status": entry.status,
+        "start_time": entry.start_time,
+        "end_time": entry.end_time,
+        "mileage": round(entry.mileage, 2),
+    }
+
+
+def encode_event(event):
+    return json.dumps(event, cls=DjangoJSONEncoder)
+
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {encode_event(event)}\n\n"
+
+
+async def sse_stream(channels):
+    """Server-sent events for `channels`, with comment keepalives while idle"""
+    options = events_options()
+    subscription = get_broker().subscribe(channels)
+    try:
+        yield f"retry: {options['RETRY_MS']}\n\n"
+        while True:
+            event = await subscription.get(timeout=options["KEEPALIVE_SECONDS"])
+            yield format_sse(event) if event is not None else ": keepalive\n\n"
+    finally:
+        subscription.close()
+
+
+async def websocket_channels(path):
+    """Channels for a /ws/trips/<id>/ or /ws/logs/<id>/ path, None if it names nothing"""
+    match = WEBSOCKET_PATH_RE.match(path)
+    if not match:
+        return None
+    kind, pk = match.group(1), int(match.group(2))
+    model, scope = (Trip, trip_scope) if kind == "trips" else (TripLog, log_scope)
+    try:
+        exists = await model.objects.filter(pk=pk).aexists()
+    finally:
+        await sync_to_async(close_old_connections)()
+    return [scope(pk)] if exists else None
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI app pushing trip / log events as JSON text frames
+
+    Clients only listen; anything they send is ignored. Unknown paths and
+    missing rows are refused with close code 4404 before the handshake
+    completes.
+    """
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+    channels = await websocket_channels(scope["path"])
+    if channels is None:
+        await send({"type": "websocket.close", "code": 4404})
+        return
+
+    subscription = get_broker().subscribe(channels)
+    await send({"type": "websocket.accept"})
+
+    async def push():
+        while True:
+            event = await subscription.get()
+            await send({"type": "websocket.send", "text": encode_event(event)})
+
+    pusher = asyncio.ensure_future(push())
+    try:
+        while (await receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        pusher.cancel()
+        subscription.close()
@@ -0,0 +1,123 @@
+from .models import TripLog, LogEntry
+import csv
+import json
+
+
+CHUNK_SIZE = 2000
+
+# (column, values() lookup)
+LOG_ENTRY_COLUMNS = [
+    ("driver_id", "log__trip__driver_id"),
+    ("trip_id", "log__trip_id"),
+    ("log_id", "log_id"),
+    ("log_date", "log__log_date"),
+    ("entry_id", "id"),
+    ("status", "status"),
+    ("start_time", "start_time"),
+    ("end_time", "end_time"),
+    ("mileage", "mileage"),
+    ("start_gps", "start_gps"),
+    ("end_gps", "end_gps"),
+    ("remarks", "remarks"),
+    ("automated", "automated"),
+]
+
+TRIP_LOG_COLUMNS = [
+    ("driver_id", "trip__driver_id"),
+    ("trip_id", "trip_id"),
+    ("log_id", "id"),
+    ("log_date", "log_date"),
+    ("carrier_name", "trip__carrier_name"),
+    ("truck_number", "trip__truck_number"),
+    ("total_off_duty_hours", "total_off_duty_hours"),
+    ("total_sleeper_hours", "total_sleeper_hours"),
+    ("total_driving_hours", "total_driving_hours"),
+    ("total_on_duty_hours", "total_on_duty_hours"),
+    ("total_on_duty_hours_last_7_days", "total_on_duty_hours_last_7_days"),
+    ("total_on_duty_hours_last_8_days", "total_on_duty_hours_last_8_days"),
+    ("available_hours_tomorrow", "available_hours_tomorrow"),
+    ("total_miles_driving_today", "total_miles_driving_today"),
+    ("total_miles_today", "total_miles_today"),
+    ("remarks", "remarks"),
+]
+
+EXPORTS = {
+    "log-entries": (LogEntry, LOG_ENTRY_COLUMNS, "log__", ("log__log_date", "log_id", "start_time", "id")),
+    "logs": (TripLog, TRIP_LOG_COLUMNS, "", ("log_date", "id")),
+}
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def export_rows(kind, driver_ids=None, start=None, end=None):
+    """Ordered tuples for an export, read from the database in chunks"""
+    model, columns, log_prefix, ordering = EXPORTS[kind]
+
+    queryset = model.objects.all()
+    if driver_ids:
+        queryset = queryset.filter(**{f"{log_prefix}trip__driver_id__in": driver_ids})
+    if start:
+        queryset = queryset.filter(**{f"{log_prefix}log_date__gte": start})
+    if end:
+        queryset = queryset.filter(**{f"{log_prefix}log_date__lte": end})
+
+    return (
+        queryset
+        .order_by(*ordering)
+        .values_list(*[lookup for _, lookup in columns])
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def _cell(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def _json_default(value):
+    # Full-precision timestamps, decimals as strings like the API
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to csv.writer's caller"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, columns):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([name for name, _ in columns])
+    for row in rows:
+        yield writer.writerow([_cell(value) for value in row])
+
+
+def iter_ndjson(rows, columns):
+    names = [name for name, _ in columns]
+    for row in rows:
+        yield json.dumps(dict(zip(names, row)), default=_json_default) + "\n"
+
+
+def iter_export(kind, fmt, driver_ids=None, start=None, end=None):
+    """Lines of an export, produced incrementally"""
+    columns = EXPORTS[kind][1]
+    rows = export_rows(kind, driver_ids, start, end)
+    if fmt == "csv":
+        return iter_csv(rows, columns)
+    return iter_ndjson(rows, columns)
+
+
+def write_export(fh, kind, fmt, driver_ids=None, start=None, end=None):
+    """Writes an export to an open text file, returns the number of rows"""
+    count = -1 if fmt == "csv" else 0  # header line
+    for line in iter_export(kind, fmt, driver_ids, start, end):
+        fh.write(line)
+        count += 1
+    return count
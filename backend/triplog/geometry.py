@@ -0,0 +1,130 @@
+from .distance import EARTH_RADIUS_MILES, gps_coordinates
+from .models import LogEntry
+from .tracks import track_points_by_entry
+import math
+import numpy as np
+
+
+EARTH_RADIUS_METERS = EARTH_RADIUS_MILES * 1609.34
+
+# Web-map ground resolution at zoom 0 on the equator, meters per pixel
+ZOOM0_METERS_PER_PIXEL = 156543.03392
+MAX_ZOOM = 22
+
+# Points closer than this many pixels to the simplified line are dropped
+PIXEL_TOLERANCE = 1.0
+
+DEFAULT_TOLERANCE_METERS = 10.0
+
+
+def zoom_tolerance(zoom):
+    """Simplification tolerance in meters for a web-map zoom level"""
+    zoom = min(max(int(zoom), 0), MAX_ZOOM)
+    return ZOOM0_METERS_PER_PIXEL / 2 ** zoom * PIXEL_TOLERANCE
+
+
+def project(coordinates):
+    """(N, 2) lat/lon degrees -> (N, 2) local equirectangular x/y meters"""
+    radians = np.radians(coordinates)
+    cos_lat = math.cos(float(radians[:, 0].mean())) if len(radians) else 1.0
+    return np.column_stack((radians[:, 1] * cos_lat, radians[:, 0])) * EARTH_RADIUS_METERS
+
+
+def simplify_mask(coordinates, tolerance):
+    """Douglas-Peucker over (N, 2) lat/lon, returns the boolean mask of points to keep
+
+    Each split measures every point of the span against its chord in one
+    vectorized pass, so the Python loop only runs once per kept point.
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    count = len(coordinates)
+    keep = np.zeros(count, dtype=bool)
+    if count <= 2:
+        keep[:] = True
+        return keep
+
+    xy = project(coordinates)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        start, end = xy[first], xy[last]
+        inner = xy[first + 1:last]
+        chord = end - start
+        length = math.hypot(*chord)
+        if length == 0:
+            distances = np.hypot(*(inner - start).T)
+        else:
+            distances = np.abs(chord[0] * (inner[:, 1] - start[1]) - chord[1] * (inner[:, 0] - start[0])) / length
+
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def simplify(points, tolerance):
+    """Simplified copy of [(lat, lon), ...] within `tolerance` meters of the original"""
+    if len(points) <= 2:
+        return list(points)
+    mask = simplify_mask(points, tolerance)
+    return [point for point, kept in zip(points, mask) if kept]
+
+
+def entry_coordinates(entries):
+    """[(lat, lon), ...] per entry: the stored track, or start/end GPS for entries without one"""
+    tracks = track_points_by_entry([entry.id for entry in entries])
+    coordinates = {}
+    for entry in entries:
+        track = tracks.get(entry.id)
+        if track:
+            coordinates[entry.id] = [(lat, lon) for _, lat, lon in track]
+        else:
+            ends = [gps_coordinates(entry.start_gps), gps_coordinates(entry.end_gps)]
+            coordinates[entry.id] = [point for point in ends if point]
+    return coordinates
+
+
+def track_geometry(entries, tolerance):
+    """Simplified per-entry polylines for a map, with before/after point counts"""
+    entries = list(entries)
+    coordinates = entry_coordinates(entries)
+
+    raw_points = 0
+    features = []
+    for entry in entries:
+        points = coordinates[entry.id]
+        raw_points += len(points)
+        simplified = simplify(points, tolerance)
+        features.append({
+            "entry": entry.id,
+            "status": entry.status,
+            "points": [[round(lat, 6), round(lon, 6)] for lat, lon in simplified],
+        })
+
+    return {
+        "tolerance": round(tolerance, 3),
+        "raw_points": raw_points,
+        "points": sum(len(feature["points"]) for feature in features),
+        "entries": features,
+    }
+
+
+def log_geometry(log_id, tolerance):
+    entries = LogEntry.objects.filter(log_id=log_id).order_by("start_time", "id").only(
+        "id", "status", "start_gps", "end_gps"
+    )
+    return track_geometry(entries, tolerance)
+
+
+def trip_geometry(trip_id, tolerance):
+    entries = LogEntry.objects.filter(log__trip_id=trip_id).order_by("log__log_date", "start_time", "id").only(
+        "id", "status", "start_gps", "end_gps"
+    )
+    return track_geometry(entries, tolerance)
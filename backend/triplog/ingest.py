@@ -0,0 +1,394 @@
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from .models import Trip, TripLog, LogEntry
+from .aggregation import update_trip_log, apply_open_entry_delta
+from .events import notify, entry_event
+from .distance import get_distance_service, gps_coordinates
+from .geometry import simplify
+from .response_cache import invalidate
+from .tracks import append_tracks, to_point, track_points_by_entry
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+VALID_STATUSES = {choice for choice, _ in LogEntry.STATUS_CHOICES}
+
+MAX_BATCH_SIZE = 1000
+
+# Detail kept from a track when routing it for reconciliation
+RECONCILE_TOLERANCE_METERS = 50
+
+
+class IngestError(Exception):
+    """A ping that cannot be ingested, carrying the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, index=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.index = index
+
+    def as_response_data(self):
+        data = {"error": self.message}
+        if self.index is not None:
+            data["index"] = self.index
+        return data
+
+
+# Times a batch is folded again when its logs' last entries moved before the write
+MAX_FOLD_ATTEMPTS = 3
+
+
+class StaleBatch(Exception):
+    """The last entries a batch was folded against changed before it could be written"""
+
+
+def parse_timestamp(timestamp):
+    """Accepts a UNIX timestamp in ms or an ISO string and returns an aware datetime"""
+    if timestamp is None:
+        return timezone.now()
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        return datetime.fromtimestamp(timestamp / 1000, tz=dt_timezone.utc)  # Convert ms to seconds
+    if isinstance(timestamp, str):
+        parsed = datetime.fromisoformat(timestamp)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, dt_timezone.utc)
+        return parsed
+    raise ValueError(f"Unsupported timestamp {timestamp!r}")
+
+
+def parse_ping(data, index=None):
+    """Validates one {logId, status, timestamp, gps} payload"""
+    if not isinstance(data, dict):
+        raise IngestError("Ping must be an object", index=index)
+
+    try:
+        log_id = int(data.get("logId"))
+    except (TypeError, ValueError):
+        raise IngestError("TripLog not found", status=404, index=index)
+
+    status = data.get("status")
+    if status not in VALID_STATUSES:
+        raise IngestError(f"Invalid status {status!r}", index=index)
+
+    try:
+        timestamp = parse_timestamp(data.get("timestamp"))
+    except (ValueError, OverflowError, OSError):
+        raise IngestError("Invalid timestamp format", index=index)
+
+    gps = data.get("gps")
+    if gps is not None and not isinstance(gps, dict):
+        raise IngestError("Invalid gps", index=index)
+
+    return {"log_id": log_id, "status": status, "timestamp": timestamp, "gps": gps or {}}
+
+
+def parse_batch(data):
+    """Validated pings of a batch payload, either a list or {"pings": [...]}"""
+    data = data.get("pings") if isinstance(data, dict) else data
+    if not isinstance(data, list) or not data:
+        raise IngestError("Expected a non-empty list of pings")
+    if len(data) > MAX_BATCH_SIZE:
+        raise IngestError(f"At most {MAX_BATCH_SIZE} pings per batch")
+    return [parse_ping(item, index=index) for index, item in enumerate(data)]
+
+
+def fuel_warning(total_mileage):
+    """Warning text when the trip is within 5 units of the next 1000 boundary"""
+    remainder = float(total_mileage % 1000)
+    if remainder >= 995:
+        next_station = (int(total_mileage / 1000) + 1) * 1000
+        return f"Fuel station in the next {next_station - float(total_mileage):.1f} km"
+    return None
+
+
+def _last_entries(log_ids, lock=False):
+    """The most recent LogEntry of each log, in two queries, optionally locked for update"""
+    last_ids = (
+        LogEntry.objects
+        .filter(log__in=log_ids)
+        .values("log")
+        .annotate(last_id=Max("id"))
+        .values_list("last_id", flat=True)
+    )
+    entries = LogEntry.objects.filter(id__in=list(last_ids))
+    if lock:
+        entries = entries.select_for_update()
+    return {entry.log_id: entry for entry in entries}
+
+
+def _entry_versions(entries):
+    return {log_id: (entry.id, entry.updated_at) for log_id, entry in entries.items()}
+
+
+def reconcile_tracks(entries):
+    """(entry, [(lat, lon), ...]) to route for each closed entry, its stored track simplified to the turns that matter"""
+    tracks = track_points_by_entry([entry.id for entry in entries])
+    result = []
+    for entry in entries:
+        points = [(lat, lon) for _, lat, lon in tracks.get(entry.id, [])]
+        if len(points) < 2:
+            points = [point for point in (gps_coordinates(entry.start_gps), gps_coordinates(entry.end_gps)) if point]
+        result.append((entry, simplify(points, RECONCILE_TOLERANCE_METERS)))
+    return result
+
+
+def apply_reconciled(routed):
+    """Write {entry id: routed miles}, moving each Trip total by the difference"""
+    if not routed:
+        return
+
+    now = timezone.now()
+    with transaction.atomic():
+        current = {
+            entry_id: (log_id, trip_id, mileage)
+            for entry_id, log_id, trip_id, mileage in LogEntry.objects.select_for_update()
+            .filter(id__in=list(routed)).values_list("id", "log_id", "log__trip_id", "mileage")
+        }
+        trip_deltas = defaultdict(float)
+        log_ids = set()
+        for entry_id, (log_id, trip_id, mileage) in current.items():
+            LogEntry.objects.filter(id=entry_id).update(mileage=routed[entry_id], updated_at=now)
+            trip_deltas[trip_id] += routed[entry_id] - mileage
+            log_ids.add(log_id)
+
+        for trip_id, delta in trip_deltas.items():
+            Trip.objects.filter(id=trip_id).update(
+                total_mileage=F("total_mileage") + Decimal(str(round(delta, 2))), updated_at=now
+            )
+        for log_id in log_ids:
+            update_trip_log(log_id)
+        invalidate(trip_ids=list(trip_deltas), log_ids=log_ids)
+
+
+def reconcile_entries(entries):
+    """Replace the local mileage estimate of closed entries with one routed distance each
+
+    The route follows the entry's stored track in a single backend request.
+    Entries the backend cannot route keep their estimate. The Trip total
+    moves by the difference.
+    """
+    service = get_distance_service()
+    routed = {}
+    for entry, points in reconcile_tracks(entries):
+        miles = service.route_track(points)
+        if miles is not None:
+            routed[entry.id] = miles
+    apply_reconciled(routed)
+
+
+class PingBatch:
+    """An ordered list of parsed pings, possibly for several logs, taken through ingestion
+
+    Construction reads the logs and their open entries and folds the pings
+    in memory; write() then persists everything given the hop distances.
+    The steps are split so the async path can measure the hops on the event
+    loop between the two database phases.
+    """
+
+    def __init__(self, pings):
+        self.pings = pings
+        self.pings_by_log = defaultdict(list)
+        for ping in pings:
+            self.pings_by_log[ping["log_id"]].append(ping)
+
+        self.logs = TripLog.objects.select_related("trip").in_bulk(list(self.pings_by_log))
+        for index, ping in enumerate(pings):
+            if ping["log_id"] not in self.logs:
+                raise IngestError("TripLog not found", status=404, index=index if len(pings) > 1 else None)
+
+        self.last_entries = _last_entries(list(self.pings_by_log))
+        self.versions = _entry_versions(self.last_entries)
+        self.to_update = []
+        self.to_create = []
+        self.closed = []
+        self.hops = []  # (from gps, to gps, log, entry credited with the miles)
+        self.track_points = {}  # id(entry) -> (entry, [points]); new entries have no pk yet
+        self.only_extended = set()  # logs where only the open entry moved
+        self._fold()
+
+    def _add_point(self, entry, ping):
+        point = to_point(ping["timestamp"], ping["gps"])
+        if point is not None:
+            self.track_points.setdefault(id(entry), (entry, []))[1].append(point)
+
+    def _fold(self):
+        # Fold pings in memory; distances are measured afterwards in one batch
+        for log_id, log_pings in self.pings_by_log.items():
+            log = self.logs[log_id]
+            existing = self.last_entries.get(log_id)
+            entry = existing
+            if existing is not None:
+                self.only_extended.add(log_id)
+
+            for ping in log_pings:
+                if entry is None:
+                    # First log entry
+                    entry = LogEntry(
+                        log=log, status=ping["status"], start_time=ping["timestamp"],
+                        start_gps=ping["gps"], mileage=0.0,
+                    )
+                    self.to_create.append(entry)
+                    self._add_point(entry, ping)
+                    continue
+
+                previous_gps = entry.end_gps or entry.start_gps
+
+                if entry.status == ping["status"]:
+                    # Status unchanged → Update GPS and mileage
+                    self.hops.append((previous_gps, ping["gps"], log, entry))
+                    entry.end_gps = ping["gps"]
+                    self._add_point(entry, ping)
+                else:
+                    # Status changed → Close previous entry and start a new one. The closing
+                    # hop is part of its track, so its miles are too; otherwise reconciling
+                    # the track would credit the trip with that hop a second time
+                    self.hops.append((previous_gps, ping["gps"], log, entry))
+                    entry.end_time = ping["timestamp"]
+                    entry.end_gps = ping["gps"]
+                    self._add_point(entry, ping)
+                    self.closed.append(entry)
+                    self.only_extended.discard(log_id)
+                    entry = LogEntry(
+                        log=log, status=ping["status"], start_time=ping["timestamp"],
+                        start_gps=ping["gps"], mileage=0.0,
+                    )
+                    self.to_create.append(entry)
+                    self._add_point(entry, ping)
+
+            if existing is not None:
+                self.to_update.append(existing)
+
+    def hop_pairs(self):
+        return [(start, end) for start, end, _, _ in self.hops]
+
+    def write(self, miles, guard=None):
+        """Persist the folded entries, tracks and totals given the miles of each hop
+
+        The logs' last entries are locked and must still be the rows the
+        batch was folded against, else StaleBatch is raised before anything
+        is written. `guard`, if given, then runs inside the transaction and
+        may raise to abandon the write.
+        """
+        trip_mileage = defaultdict(float)
+        extended_miles = defaultdict(float)
+        for (_, _, log, entry), distance in zip(self.hops, miles):
+            trip_mileage[log.trip_id] += distance
+            entry.mileage += distance
+            if entry is self.last_entries.get(log.id):
+                extended_miles[log.id] += distance
+        open_entry_deltas = {
+            log_id: (self.last_entries[log_id].status, extended_miles[log_id]) for log_id in self.only_extended
+        }
+
+        now = timezone.now()
+        with transaction.atomic():
+            if _entry_versions(_last_entries(list(self.pings_by_log), lock=True)) != self.versions:
+                raise StaleBatch(f"Log entries of logs {list(self.pings_by_log)} changed during ingestion")
+            if guard is not None:
+                guard()
+            if self.to_update:
+                for entry in self.to_update:
+                    entry.updated_at = now  # bulk_update skips auto_now
+                LogEntry.objects.bulk_update(self.to_update, ["mileage", "end_gps", "end_time", "updated_at"])
+            if self.to_create:
+                LogEntry.objects.bulk_create(self.to_create)
+            append_tracks({entry.id: points for entry, points in self.track_points.values()})
+
+            #  Update the Trip (not TripLog) total_mileage
+            for trip_id, trip_miles in trip_mileage.items():
+                Trip.objects.filter(id=trip_id).update(
+                    total_mileage=F("total_mileage") + Decimal(str(trip_miles)), updated_at=now
+                )
+
+            for log_id in self.pings_by_log:
+                if log_id in open_entry_deltas:
+                    apply_open_entry_delta(log_id, *open_entry_deltas[log_id])
+                else:
+                    update_trip_log(log_id)
+
+            invalidate(trip_ids={log.trip_id for log in self.logs.values()}, log_ids=list(self.pings_by_log))
+
+            touched = defaultdict(list)
+            for entry in [*self.to_update, *self.to_create]:
+                touched[entry.log_id].append(entry_event(entry))
+            for log_id, entries in touched.items():
+                notify("entries", self.logs[log_id].trip_id, log_id, entries=entries)
+
+    def summary(self):
+        """Result of the batch, with per-trip fuel warnings read after every write"""
+        trip_ids = {log.trip_id for log in self.logs.values()}
+        fuel_warnings = {}
+        for trip_id, total_mileage in Trip.objects.filter(id__in=trip_ids).values_list("id", "total_mileage"):
+            message = fuel_warning(total_mileage)
+            if message:
+                fuel_warnings[trip_id] = message
+                notify("fuel_warning", trip_id, message=message, total_mileage=total_mileage)
+
+        logger.info(f"Ingested {len(self.pings)} pings for logs {list(self.pings_by_log)}")
+        return {
+            "processed": len(self.pings),
+            "entries_created": len(self.to_create),
+            "logs": list(self.pings_by_log),
+            "trip_ids": {log_id: log.trip_id for log_id, log in self.logs.items()},
+            "fuel_warnings": fuel_warnings,
+        }
+
+
+def ingest_pings(pings, guard=None):
+    """Apply an ordered list of parsed pings, possibly for several logs
+
+    Consecutive same-status pings are folded into the open entry in memory,
+    everything is persisted in one transaction with bulk writes, and each
+    affected TripLog is recomputed once. Every ping with coordinates is also
+    appended to its entry's packed track. Hop distances come from the
+    distance service in one batch; in reconciled mode entries closed by
+    this batch are then routed once each. A batch racing another one for
+    the same log is folded again on the new rows. Returns a summary with
+    per-trip fuel warnings. `guard` is passed to PingBatch.write().
+    """
+    service = get_distance_service()
+    for attempt in range(MAX_FOLD_ATTEMPTS):
+        batch = PingBatch(pings)
+        try:
+            # Routing calls (routed mode) happen here, outside the transaction
+            batch.write(service.distances(batch.hop_pairs()), guard=guard)
+            break
+        except StaleBatch:
+            if attempt == MAX_FOLD_ATTEMPTS - 1:
+                raise IngestError("Log entries changed concurrently, retry the request", status=409)
+    if batch.closed and service.reconciles:
+        reconcile_entries(batch.closed)
+    return batch.summary()
+
+
+async def aingest_pings(pings):
+    """ingest_pings() for async views
+
+    The database phases run through sync_to_async while routing calls are
+    awaited on the event loop, concurrently within a batch, so a worker's
+    threads are not held for the duration of a routing request.
+    """
+    service = get_distance_service()
+    for attempt in range(MAX_FOLD_ATTEMPTS):
+        batch = await sync_to_async(PingBatch)(pings)
+        try:
+            await sync_to_async(batch.write)(await service.adistances(batch.hop_pairs()))
+            break
+        except StaleBatch:
+            if attempt == MAX_FOLD_ATTEMPTS - 1:
+                raise IngestError("Log entries changed concurrently, retry the request", status=409)
+    if batch.closed and service.reconciles:
+        tracks = await sync_to_async(reconcile_tracks)(batch.closed)
+        miles = await asyncio.gather(*(service.aroute_track(points) for _, points in tracks))
+        await sync_to_async(apply_reconciled)({
+            entry.id: entry_miles for (entry, _), entry_miles in zip(tracks, miles) if entry_miles is not None
+        })
+    return await sync_to_async(batch.summary)()
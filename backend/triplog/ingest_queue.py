@@ -0,0 +1,270 @@
+from django.conf import settings
+from .models import TripLog, IngestCursor
+from .ingest import IngestError, parse_ping, ingest_pings
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "MODE": "sync",             # "sync" ingests inside the request, "queued" writes behind
+    "PATH": "ingest_queue.sqlite3",
+    "LEASE_SECONDS": 60,        # a claim older than this is considered abandoned
+    "MAX_ATTEMPTS": 5,          # failed drains before an event is parked as failed
+}
+
+# Times a drain refolds its events after a concurrent drain of the same log committed first
+MAX_STALE_RETRIES = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_event (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    log_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    enqueued_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS ingest_event_state_log ON ingest_event (state, log_id, id);
+CREATE TABLE IF NOT EXISTS queue_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def ingest_mode():
+    return {**DEFAULTS, **getattr(settings, "INGEST_QUEUE", {})}["MODE"]
+
+
+def serialize_ping(ping):
+    """Parsed ping -> the JSON payload format accepted by parse_ping"""
+    return json.dumps({
+        "logId": ping["log_id"],
+        "status": ping["status"],
+        "timestamp": ping["timestamp"].isoformat(),
+        "gps": ping["gps"],
+    })
+
+
+class IngestQueue:
+    """Durable, SQLite-backed FIFO of pings, drained in order per log
+
+    Workers claim all pending events of one log at a time, so events of the
+    same log are never processed concurrently or out of order. Delivery is
+    at-least-once: events are acked only after ingest_pings commits, and
+    drain_once() skips events already recorded in the log's IngestCursor.
+    Each file has a random queue_id; event ids only mean something next to
+    it, so a replaced or swapped file never inherits another's cursors.
+    """
+
+    def __init__(self, path, lease_seconds=60, max_attempts=5):
+        self.path = str(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        conn.execute("INSERT OR IGNORE INTO queue_meta (key, value) VALUES ('queue_id', ?)", (uuid.uuid4().hex,))
+        self.queue_id = conn.execute("SELECT value FROM queue_meta WHERE key = 'queue_id'").fetchone()[0]
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, fn):
+        """Runs fn(conn) inside a write transaction"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def enqueue(self, pings):
+        """Appends parsed pings in order; durable once this returns"""
+        now = time.time()
+        rows = [(ping["log_id"], serialize_ping(ping), now) for ping in pings]
+        self._write(lambda conn: conn.executemany(
+            "INSERT INTO ingest_event (log_id, payload, enqueued_at) VALUES (?, ?, ?)", rows
+        ))
+        return len(rows)
+
+    def claim(self, worker_id, limit=500):
+        """Claims the oldest pending events of one log, returns (log_id, [(id, payload)])"""
+        def claim_log(conn):
+            now = time.time()
+            # Return abandoned claims to the pool
+            conn.execute(
+                "UPDATE ingest_event SET state = 'pending', claimed_by = NULL, claimed_at = NULL "
+                "WHERE state = 'claimed' AND claimed_at < ?",
+                (now - self.lease_seconds,),
+            )
+            row = conn.execute(
+                "SELECT log_id FROM ingest_event WHERE state = 'pending' AND log_id NOT IN "
+                "(SELECT log_id FROM ingest_event WHERE state = 'claimed') ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None, []
+
+            log_id = row[0]
+            events = conn.execute(
+                "SELECT id, payload FROM ingest_event WHERE state = 'pending' AND log_id = ? "
+                "ORDER BY id LIMIT ?",
+                (log_id, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE ingest_event SET state = 'claimed', claimed_by = ?, claimed_at = ? WHERE id = ?",
+                [(worker_id, now, event_id) for event_id, _ in events],
+            )
+            return log_id, events
+
+        return self._write(claim_log)
+
+    def ack(self, event_ids):
+        """Removes processed events"""
+        self._write(lambda conn: conn.executemany(
+            "DELETE FROM ingest_event WHERE id = ?", [(event_id,) for event_id in event_ids]
+        ))
+
+    def release(self, event_ids, error, permanent=False):
+        """Returns events to the queue after a failure, parking them once out of attempts"""
+        self._write(lambda conn: conn.executemany(
+            "UPDATE ingest_event SET attempts = attempts + 1, last_error = ?, claimed_by = NULL, "
+            "claimed_at = NULL, state = CASE WHEN ? OR attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+            "WHERE id = ?",
+            [(str(error), permanent, self.max_attempts, event_id) for event_id in event_ids],
+        ))
+
+    def stats(self):
+        rows = self._connection().execute(
+            "SELECT state, COUNT(*) FROM ingest_event GROUP BY state"
+        ).fetchall()
+        return dict(rows)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_ingest_queue():
+    """Process-wide IngestQueue configured from settings.INGEST_QUEUE"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                options = {**DEFAULTS, **getattr(settings, "INGEST_QUEUE", {})}
+                _queue = IngestQueue(
+                    options["PATH"],
+                    lease_seconds=options["LEASE_SECONDS"],
+                    max_attempts=options["MAX_ATTEMPTS"],
+                )
+    return _queue
+
+
+def set_ingest_queue(queue):
+    """Install a specific queue (e.g. one on a temporary file in tests), returning the previous one"""
+    global _queue
+    with _queue_lock:
+        previous, _queue = _queue, queue
+    return previous
+
+
+def enqueue_pings(pings):
+    """Checks the target logs exist and appends the pings to the shared queue"""
+    log_ids = {ping["log_id"] for ping in pings}
+    found = set(TripLog.objects.filter(id__in=log_ids).values_list("id", flat=True))
+    if log_ids - found:
+        raise IngestError("TripLog not found", status=404)
+    return get_ingest_queue().enqueue(pings)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class EventsApplied(Exception):
+    """Some of a drain's events were ingested by another drain in the meantime"""
+
+
+def applied_event_id(log_id, queue_id):
+    """Last event of queue `queue_id` applied to the log, 0 if its cursor belongs to another queue file"""
+    cursor = IngestCursor.objects.filter(log_id=log_id).values_list("queue_id", "last_event_id").first()
+    return cursor[1] if cursor and cursor[0] == queue_id else 0
+
+
+def advance_cursor(log_id, queue_id, first_event_id, last_event_id):
+    """Guard for ingest_pings: moves the log's cursor past the batch, or raises EventsApplied
+
+    Runs inside the write transaction with the cursor row locked, so of two
+    drains holding the same events (a lease expired mid-ingest) only the
+    first to commit applies them. A cursor left by another queue file is
+    reset to this one.
+    """
+    IngestCursor.objects.get_or_create(log_id=log_id)
+    cursor = IngestCursor.objects.select_for_update().get(log_id=log_id)
+    if cursor.queue_id == queue_id and cursor.last_event_id >= first_event_id:
+        raise EventsApplied(f"Queued pings up to {cursor.last_event_id} of log {log_id} were already ingested")
+    cursor.queue_id = queue_id
+    cursor.last_event_id = last_event_id
+    cursor.save(update_fields=["queue_id", "last_event_id", "updated_at"])
+
+
+def ingest_events(queue_id, log_id, events):
+    """Ingest the claimed events the log has not seen yet, returns how many were applied"""
+    for _ in range(MAX_STALE_RETRIES):
+        applied = applied_event_id(log_id, queue_id)
+        events = [(event_id, payload) for event_id, payload in events if event_id > applied]
+        if not events:
+            return 0
+        pings = [parse_ping(json.loads(payload)) for _, payload in events]
+        try:
+            ingest_pings(pings, guard=lambda: advance_cursor(log_id, queue_id, events[0][0], events[-1][0]))
+        except EventsApplied:
+            continue
+        return len(events)
+    raise EventsApplied(f"Log {log_id} kept moving under {len(events)} queued pings")
+
+
+def drain_once(queue, worker_id=None, limit=500):
+    """Claims and ingests one log's pending events, returns how many were processed"""
+    worker_id = worker_id or default_worker_id()
+    log_id, events = queue.claim(worker_id, limit=limit)
+    if not events:
+        return 0
+
+    event_ids = [event_id for event_id, _ in events]
+    try:
+        ingest_events(queue.queue_id, log_id, events)
+    except IngestError as e:
+        # Bad input (e.g. the log was deleted) will not succeed on retry, a 409 race may
+        conflict = e.status == 409
+        logger.error(f"{'Requeueing' if conflict else 'Dropping'} {len(events)} queued pings for log {log_id}: {e.message}")
+        queue.release(event_ids, e.message, permanent=not conflict)
+        return 0
+    except Exception as e:
+        logger.exception(f"Failed to ingest queued pings for log {log_id}")
+        queue.release(event_ids, e)
+        return 0
+
+    # Acked even when every event was already applied, e.g. redelivered after a lost ack
+    queue.ack(event_ids)
+    return len(events)
@@ -0,0 +1,308 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.utils import timezone
+from .distance import gps_coordinates
+from .drawing import Drawing, RENDERERS
+from .models import TripLog, LogEntry
+import hashlib
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout changes so cached sheets are rendered again
+SHEET_VERSION = 1
+
+FORMATS = {name: content_type for name, (_, content_type) in RENDERERS.items()}
+
+DEFAULTS = {
+    "CACHE_DIR": None,   # Content-addressed output directory, None disables caching
+    "PNG_SCALE": 2.0,    # Pixels per point
+}
+
+# Grid rows, top to bottom, as on the paper form
+ROWS = [
+    ("off_duty", "1. Off Duty", "total_off_duty_hours"),
+    ("sleeper", "2. Sleeper Berth", "total_sleeper_hours"),
+    ("driving", "3. Driving", "total_driving_hours"),
+    ("on_duty", "4. On Duty (not driving)", "total_on_duty_hours"),
+]
+ROW_INDEX = {status: i for i, (status, _, _) in enumerate(ROWS)}
+
+# US letter, landscape, in points
+PAGE_WIDTH, PAGE_HEIGHT = 792, 612
+MARGIN = 36
+GRID_LEFT, GRID_RIGHT = 150, 700
+GRID_TOP, ROW_HEIGHT = 180, 26
+REMARK_LINE = 11
+
+
+def sheet_options():
+    return {**DEFAULTS, **getattr(settings, "LOG_SHEETS", {})}
+
+
+def _minutes(moment, day_start):
+    return (moment - day_start).total_seconds() / 60
+
+
+def _text(value):
+    return "" if value is None else str(value)
+
+
+def sheet_data(log_ids, now=None):
+    """{log_id: sheet} with everything the renderer reads, from two queries
+
+    Sheets are plain JSON values: they are hashed for the cache key and
+    sent as-is to rendering processes. Entry times are minutes from the
+    log day's midnight; an open entry runs to now, floored to the minute,
+    which marks the sheet "live": it changes every minute, so it is never
+    written to the sheet cache.
+    """
+    now = (now or timezone.now()).replace(second=0, microsecond=0)
+    logs = TripLog.objects.filter(id__in=log_ids).select_related("trip")
+    entries = {}
+    for entry in (
+        LogEntry.objects.filter(log_id__in=log_ids).order_by("log_id", "start_time", "id")
+        .values("log_id", "status", "start_time", "end_time", "start_gps", "remarks")
+    ):
+        entries.setdefault(entry["log_id"], []).append(entry)
+
+    sheets = {}
+    for log in logs:
+        trip = log.trip
+        day_start = timezone.make_aware(datetime.combine(log.log_date, time.min))
+        day_end = day_start + timedelta(days=1)
+        rows = []
+        live = False
+        for entry in entries.get(log.id, []):
+            if entry["start_time"] is None:
+                continue
+            live = live or (entry["end_time"] is None and now < day_end)
+            end = entry["end_time"] or min(now, day_end)
+            start_minute = max(_minutes(entry["start_time"], day_start), 0)
+            end_minute = min(_minutes(end, day_start), 24 * 60)
+            location = gps_coordinates(entry["start_gps"])
+            rows.append({
+                "status": entry["status"],
+                "start": round(start_minute, 2),
+                "end": round(max(end_minute, start_minute), 2),
+                "time": timezone.localtime(entry["start_time"]).strftime("%H:%M"),
+                "location": f"{location[0]:.4f}, {location[1]:.4f}" if location else "",
+                "remarks": _text(entry["remarks"]),
+            })
+        sheets[log.id] = {
+            "log": log.id,
+            "date": log.log_date.isoformat(),
+            "driver": trip.driver_id,
+            "from": trip.from_location,
+            "to": trip.to_location,
+            "carrier": trip.carrier_name,
+            "office": trip.main_office_address,
+            "terminal": trip.home_terminal_address,
+            "truck": trip.truck_number,
+            "cycle": trip.cycle_type,
+            "documents": ", ".join(filter(None, [trip.document_number, trip.shipper, trip.commodity])),
+            "remarks": _text(log.remarks),
+            "totals": {field: str(getattr(log, field)) for _, _, field in ROWS},
+            "miles_driving": str(log.total_miles_driving_today),
+            "miles": str(log.total_miles_today),
+            "on_duty_last_7_days": str(log.total_on_duty_hours_last_7_days),
+            "available_tomorrow": str(log.available_hours_tomorrow),
+            "entries": rows,
+            "live": live,
+        }
+    return sheets
+
+
+def sheet_hash(sheet, fmt):
+    """Content address of a rendered sheet: the rows it is drawn from, the format and the layout version"""
+    payload = json.dumps({"version": SHEET_VERSION, "format": fmt, "sheet": sheet}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def layout(sheet):
+    """Drawing of the standard 24-hour duty-status grid with its header, totals and remarks"""
+    page = Drawing(PAGE_WIDTH, PAGE_HEIGHT)
+    page.text(MARGIN, 48, "DRIVER'S DAILY LOG (24 HOURS)", size=16, bold=True)
+    page.text(PAGE_WIDTH - MARGIN, 48, sheet["date"], size=14, anchor="end", bold=True)
+
+    header = [
+        [("From", sheet["from"]), ("To", sheet["to"])],
+        [("Carrier", sheet["carrier"]), ("Main office", sheet["office"])],
+        [("Truck / trailer", sheet["truck"]), ("Home terminal", sheet["terminal"])],
+        [("Driver", sheet["driver"]), ("Cycle", sheet["cycle"]),
+         ("Miles driving today", sheet["miles_driving"]), ("Total miles today", sheet["miles"])],
+    ]
+    for line, fields in enumerate(header):
+        y = 76 + line * 18
+        column = (PAGE_WIDTH - 2 * MARGIN) / len(fields)
+        for i, (label, value) in enumerate(fields):
+            x = MARGIN + i * column
+            page.text(x, y, f"{label}:", size=8, bold=True)
+            page.text(x + len(label) * 4.6 + 8, y, value, size=9)
+            page.line(x + len(label) * 4.6 + 6, y + 3, x + column - 10, y + 3, width=0.3)
+
+    hour = (GRID_RIGHT - GRID_LEFT) / 24
+    grid_bottom = GRID_TOP + ROW_HEIGHT * len(ROWS)
+    page.rect(GRID_LEFT, GRID_TOP - 16, GRID_RIGHT - GRID_LEFT, 16, fill=0.85)
+    for h in range(25):
+        label = {0: "Mid", 12: "Noon", 24: "Mid"}.get(h, str(h % 12))
+        page.text(GRID_LEFT + h * hour, GRID_TOP - 5, label, size=7, anchor="middle", bold=h in (0, 12, 24))
+    page.text(GRID_RIGHT + 46, GRID_TOP - 5, "Total hours", size=7, anchor="middle", bold=True)
+
+    for row, (_, label, field) in enumerate(ROWS):
+        top = GRID_TOP + row * ROW_HEIGHT
+        page.rect(GRID_LEFT, top, GRID_RIGHT - GRID_LEFT, ROW_HEIGHT)
+        page.text(MARGIN, top + ROW_HEIGHT / 2 + 3, label, size=8, bold=True)
+        page.text(GRID_RIGHT + 46, top + ROW_HEIGHT / 2 + 3, sheet["totals"][field], size=9, anchor="middle")
+        for quarter in range(1, 96):
+            x = GRID_LEFT + quarter * hour / 4
+            if quarter % 4 == 0:
+                page.line(x, top, x, top + ROW_HEIGHT, width=0.4)
+            else:
+                page.line(x, top, x, top + (ROW_HEIGHT * 0.4 if quarter % 2 == 0 else ROW_HEIGHT * 0.25), width=0.3)
+    total = sum(float(value) for value in sheet["totals"].values())
+    page.text(GRID_RIGHT + 46, grid_bottom + 12, f"= {total:.2f}", size=9, anchor="middle", bold=True)
+
+    # Duty line: a bar through the row of each entry, joined by verticals at status changes
+    previous = None
+    for entry in sheet["entries"]:
+        row = ROW_INDEX.get(entry["status"])
+        if row is None or entry["end"] <= entry["start"]:
+            continue
+        y = GRID_TOP + row * ROW_HEIGHT + ROW_HEIGHT / 2
+        x0 = GRID_LEFT + entry["start"] / 60 * hour
+        x1 = GRID_LEFT + entry["end"] / 60 * hour
+        if previous is not None and previous[1] != y:
+            page.line(x0, previous[1], x0, y, width=1.6)
+        page.line(x0, y, x1, y, width=2.2)
+        previous = (x1, y)
+
+    y = grid_bottom + 34
+    page.text(MARGIN, y, "Remarks", size=10, bold=True)
+    page.text(
+        PAGE_WIDTH - MARGIN, y,
+        f"On duty, last 7 days: {sheet['on_duty_last_7_days']} h   Available tomorrow: {sheet['available_tomorrow']} h",
+        size=8, anchor="end",
+    )
+    page.line(MARGIN, y + 4, PAGE_WIDTH - MARGIN, y + 4, width=0.6)
+
+    lines = [sheet["remarks"]] if sheet["remarks"] else []
+    changes = [entry for i, entry in enumerate(sheet["entries"])
+               if i == 0 or entry["status"] != sheet["entries"][i - 1]["status"] or entry["remarks"]]
+    for entry in changes:
+        status = ROWS[ROW_INDEX[entry["status"]]][1][3:] if entry["status"] in ROW_INDEX else entry["status"]
+        details = "  ".join(filter(None, [entry["location"], entry["remarks"]]))
+        lines.append(f"{entry['time']}  {status}" + (f"  -  {details}" if details else ""))
+
+    space = int((PAGE_HEIGHT - MARGIN - 24 - (y + 8)) / REMARK_LINE)
+    if len(lines) > space:
+        lines = lines[:space - 1] + [f"... {len(lines) - space + 1} more"]
+    for i, line in enumerate(lines):
+        page.text(MARGIN, y + 8 + (i + 1) * REMARK_LINE, line[:150], size=8)
+
+    page.line(MARGIN, PAGE_HEIGHT - MARGIN - 14, PAGE_WIDTH - MARGIN, PAGE_HEIGHT - MARGIN - 14, width=0.6)
+    page.text(MARGIN, PAGE_HEIGHT - MARGIN, f"Shipping documents: {sheet['documents'] or '-'}", size=8)
+    page.text(PAGE_WIDTH - MARGIN, PAGE_HEIGHT - MARGIN, f"Log {sheet['log']}", size=7, anchor="end")
+    return page
+
+
+def render_sheet(sheet, fmt, png_scale=DEFAULTS["PNG_SCALE"]):
+    render, _ = RENDERERS[fmt]
+    page = layout(sheet)
+    return render(page, scale=png_scale) if fmt == "png" else render(page)
+
+
+class SheetCache:
+    """Rendered sheets on disk under their content hash, shared by every worker process"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, digest, fmt):
+        return os.path.join(self.directory, digest[:2], f"{digest}.{fmt}")
+
+    def get(self, digest, fmt):
+        if not self.directory:
+            return None
+        try:
+            with open(self.path(digest, fmt), "rb") as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, digest, fmt, data):
+        if not self.directory:
+            return
+        path = self.path(digest, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)  # Same content under the same name, so concurrent writers are harmless
+
+
+def get_sheet_cache():
+    return SheetCache(sheet_options()["CACHE_DIR"])
+
+
+def _render_and_store(sheet, fmt, digest, directory, png_scale):
+    data = render_sheet(sheet, fmt, png_scale)
+    SheetCache(directory).put(digest, fmt, data)
+    return sheet["log"], data
+
+
+def render_log_sheet(log_id, fmt):
+    """(bytes, content hash) of one log's sheet, None if the log does not exist"""
+    sheet = sheet_data([log_id]).get(log_id)
+    if sheet is None:
+        return None
+    digest = sheet_hash(sheet, fmt)
+    cache = SheetCache(None) if sheet["live"] else get_sheet_cache()
+    data = cache.get(digest, fmt)
+    if data is None:
+        data = render_sheet(sheet, fmt, sheet_options()["PNG_SCALE"])
+        cache.put(digest, fmt, data)
+    return data, digest
+
+
+def render_log_sheets(log_ids, fmt, workers=1):
+    """Yields (sheet, bytes) for many logs: cache hits first, then misses rendered across `workers` processes
+
+    Sheet rows are read in the parent with two queries; the workers only
+    lay out and encode, so they never touch the database.
+    """
+    options = sheet_options()
+    sheets = sheet_data(log_ids)
+    misses = []
+    for sheet in sheets.values():
+        digest = sheet_hash(sheet, fmt)
+        directory = None if sheet["live"] else options["CACHE_DIR"]
+        data = SheetCache(directory).get(digest, fmt)
+        if data is None:
+            misses.append((sheet, digest, directory))
+        else:
+            yield sheet, data
+
+    if workers <= 1 or len(misses) <= 1:
+        for sheet, digest, directory in misses:
+            yield sheet, _render_and_store(sheet, fmt, digest, directory, options["PNG_SCALE"])[1]
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            _render_and_store,
+            [sheet for sheet, _, _ in misses], [fmt] * len(misses), [digest for _, digest, _ in misses],
+            [directory for _, _, directory in misses], [options["PNG_SCALE"]] * len(misses),
+            chunksize=max(1, len(misses) // (workers * 4)),
+        )
+        for (sheet, _, _), (_, data) in zip(misses, results):
+            yield sheet, data
+
+
+def sheet_filename(sheet, fmt):
+    driver = "".join(char if char.isalnum() or char in "-_" else "_" for char in sheet["driver"])
+    return f"{driver}_{sheet['date']}_{sheet['log']}.{fmt}"
@@ -0,0 +1,15 @@
+from django.core.management.base import CommandError
+from django.utils.dateparse import parse_date
+
+
+def parse_day(value, name, default=None):
+    """Date of a --<name> YYYY-MM-DD option, `default` when it was not given"""
+    if not value:
+        return default
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise CommandError(f"--{name} must be a YYYY-MM-DD date")
+    return day
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+from triplog.benchmark import Benchmark, compare, load_results, save_results
+from triplog.distance import MODES
+from triplog.models import Trip
+from triplog.scripts import generate_fleet
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency percentiles, throughput and query counts of the ingest and read "
+        "hot paths against the configured database, with routing stubbed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("cases", nargs="*", help="Cases to run, all if omitted")
+        parser.add_argument("--iterations", type=int, default=200, help="Measured calls per case")
+        parser.add_argument("--warmup", type=int, default=10, help="Unmeasured calls per case")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for picking targets")
+        parser.add_argument("--routing-latency-ms", type=float, default=0, help="Simulated routing backend latency")
+        parser.add_argument("--distance-mode", choices=MODES, default="routed", help="Distance service mode for ingest")
+        parser.add_argument("--warm-cache", action="store_true", help="Keep the response cache between reads")
+        parser.add_argument("--seed-drivers", type=int, default=0, help="Generate a fleet of this many drivers if the database is empty")
+        parser.add_argument("--seed-days", type=int, default=28, help="Days of history when seeding")
+        parser.add_argument("--output", "-o", help="Write results as JSON to this file")
+        parser.add_argument("--compare", help="Earlier results JSON to compare against")
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 1:
+            raise CommandError("--iterations must be at least 1")
+
+        if options["seed_drivers"] and not Trip.objects.exists():
+            self.stderr.write(f"Seeding {options['seed_drivers']} drivers x {options['seed_days']} days...")
+            generate_fleet(drivers=options["seed_drivers"], days=options["seed_days"], seed=options["seed"])
+
+        try:
+            benchmark = Benchmark(
+                iterations=options["iterations"],
+                warmup=options["warmup"],
+                seed=options["seed"],
+                routing_latency_ms=options["routing_latency_ms"],
+                warm_cache=options["warm_cache"],
+                distance_mode=options["distance_mode"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        unknown = set(options["cases"]) - set(benchmark.cases)
+        if unknown:
+            raise CommandError(f"Unknown cases: {', '.join(sorted(unknown))}. Choose from {', '.join(benchmark.cases)}")
+
+        header = f"{'case':<32}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'queries':>10}{'errors':>8}"
+        self.stdout.write(header)
+
+        def progress(name, stats):
+            self.stdout.write(
+                f"{name:<32}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+                f"{stats['throughput_rps']:>10}{stats['queries_per_call']:>10}{stats['errors']:>8}"
+            )
+
+        results = benchmark.run(options["cases"], progress=progress)
+
+        if options["output"]:
+            save_results(options["output"], results)
+            self.stderr.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options["compare"]:
+            baseline = load_results(options["compare"])
+            self.stdout.write(f"\nCompared to {baseline.get('meta', {}).get('commit') or options['compare']}:")
+            for name, metric, before, after, change in compare(baseline, results):
+                change_text = f"{change:+.1f}%" if change is not None else "n/a"
+                self.stdout.write(f"{name:<32}{metric:<18}{before!s:>10} -> {after!s:<10}{change_text:>9}")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from triplog.routing import build_graph_file
+import time
+
+
+class Command(BaseCommand):
+    help = "Build the in-process routing graph (.npz) from an OSM XML extract."
+
+    def add_arguments(self, parser):
+        parser.add_argument("osm", help="OSM XML file, e.g. exported from openstreetmap.org or osmium cat -o x.osm")
+        parser.add_argument("output", help="Graph file to write; point ROAD_GRAPH_PATH at it")
+        parser.add_argument("--landmarks", type=int, default=8, help="ALT landmarks; more is faster to query, slower to build")
+
+    def handle(self, *args, **options):
+        if options["landmarks"] < 1:
+            raise CommandError("--landmarks must be at least 1")
+
+        started = time.monotonic()
+        try:
+            nodes, edges = build_graph_file(options["osm"], options["output"], landmarks=options["landmarks"])
+        except (OSError, SyntaxError) as e:  # ElementTree.ParseError is a SyntaxError
+            raise CommandError(f"Could not read {options['osm']}: {e}")
+        if not nodes:
+            raise CommandError(f"No routable ways found in {options['osm']}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {nodes} nodes and {edges} edges to {options['output']} in {time.monotonic() - started:.1f}s"
+        ))
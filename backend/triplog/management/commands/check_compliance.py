@@ -0,0 +1,36 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from triplog.compliance import check_compliance
+from triplog.management.arguments import parse_day
+
+
+class Command(BaseCommand):
+    help = "Evaluate hours-of-service rules for a range of days and store violations and available hours."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--driver", action="append", default=None, help="Driver id, repeatable; all drivers if omitted")
+        parser.add_argument("--start", help="First day, YYYY-MM-DD (default yesterday)")
+        parser.add_argument("--end", help="Last day, YYYY-MM-DD (default today)")
+        parser.add_argument("--batch-size", type=int, default=500, help="Drivers evaluated per batch")
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        start = parse_day(options["start"], "start", today - timedelta(days=1))
+        end = parse_day(options["end"], "end", today)
+        if end < start:
+            raise CommandError("--end must not be before --start")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+
+        def progress(done, total):
+            self.stderr.write(f"  {done}/{total} drivers")
+
+        totals = check_compliance(
+            start, end, driver_ids=options["driver"], batch_size=options["batch_size"],
+            progress=progress if options["verbosity"] > 1 else None,
+        )
+        self.stderr.write(self.style.SUCCESS(
+            f"Checked {totals['drivers']} drivers from {start} to {end}: {totals['violations']} violations, "
+            f"{totals['logs']} logs updated, {totals['recaps']} trip recaps"
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from triplog.ingest_queue import get_ingest_queue, drain_once, default_worker_id
+import time
+
+
+class Command(BaseCommand):
+    help = "Drain queued GPS pings into LogEntries. Run one instance per worker process."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+        parser.add_argument("--batch-size", type=int, default=500, help="Max pings claimed per log at a time")
+        parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds to sleep when idle")
+
+    def handle(self, *args, **options):
+        queue = get_ingest_queue()
+        worker_id = default_worker_id()
+        processed = 0
+
+        self.stdout.write(f"Worker {worker_id} draining {queue.path}")
+        try:
+            while True:
+                count = drain_once(queue, worker_id, limit=options["batch_size"])
+                processed += count
+                if count:
+                    continue
+                if options["once"] and not queue.stats().get("pending"):
+                    break
+                time.sleep(options["poll_interval"])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} pings, queue: {queue.stats()}"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from triplog.export import EXPORTS, FORMATS, write_export
+from triplog.management.arguments import parse_day
+import sys
+
+
+class Command(BaseCommand):
+    help = "Stream LogEntries or TripLogs for drivers and a date range to a CSV / NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(EXPORTS), help="What to export")
+        parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+        parser.add_argument("--driver", action="append", default=[], help="Driver id, repeatable; all drivers if omitted")
+        parser.add_argument("--start", help="First log date, YYYY-MM-DD")
+        parser.add_argument("--end", help="Last log date, YYYY-MM-DD")
+        parser.add_argument("--output", "-o", help="File to write, stdout if omitted")
+
+    def handle(self, *args, **options):
+        start = parse_day(options["start"], "start")
+        end = parse_day(options["end"], "end")
+        export = (options["kind"], options["format"], options["driver"], start, end)
+
+        if options["output"]:
+            with open(options["output"], "w", newline="", encoding="utf-8") as fh:
+                count = write_export(fh, *export)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {count} rows to {options['output']}"))
+        else:
+            count = write_export(sys.stdout, *export)
+            self.stderr.write(f"Wrote {count} rows")
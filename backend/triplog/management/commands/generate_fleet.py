@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from triplog.scripts import generate_fleet
+import time
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic multi-driver, multi-week fleet of Trips, TripLogs and LogEntries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drivers", type=int, default=10, help="Number of drivers")
+        parser.add_argument("--days", type=int, default=28, help="Days of history per driver, ending today")
+        parser.add_argument("--ping-interval", type=int, default=60, help="Seconds between GPS pings while driving")
+        parser.add_argument(
+            "--max-entry-minutes", type=int, default=None,
+            help="Split status blocks into entries of at most this many minutes (more rows)",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per bulk insert")
+        parser.add_argument("--seed", type=int, default=None, help="Random seed for a reproducible fleet")
+        parser.add_argument("--driver-prefix", default="sim-driver", help="Prefix of generated driver ids")
+
+    def handle(self, *args, **options):
+        for name in ("drivers", "days", "ping_interval", "batch_size"):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be at least 1")
+        if options["max_entry_minutes"] is not None and options["max_entry_minutes"] < 1:
+            raise CommandError("--max-entry-minutes must be at least 1")
+
+        started = time.monotonic()
+
+        def progress(done, counts):
+            if done % 100 == 0 or done == options["drivers"]:
+                self.stderr.write(
+                    f"{done}/{options['drivers']} drivers, {counts['entries']} entries "
+                    f"({time.monotonic() - started:.1f}s)"
+                )
+
+        try:
+            counts = generate_fleet(
+                drivers=options["drivers"],
+                days=options["days"],
+                ping_interval=options["ping_interval"],
+                max_entry_minutes=options["max_entry_minutes"],
+                batch_size=options["batch_size"],
+                seed=options["seed"],
+                driver_prefix=options["driver_prefix"],
+                progress=progress,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {counts['trips']} trips, {counts['logs']} logs, {counts['entries']} entries "
+            f"and {counts['rollups']} rollups in {time.monotonic() - started:.1f}s"
+        ))
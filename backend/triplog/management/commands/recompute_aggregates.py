@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from triplog.recompute import recompute, default_workers
+from triplog.management.arguments import parse_day
+
+
+class Command(BaseCommand):
+    help = "Recompute TripLog totals, rollups, rolling windows and TripCompletion recaps from LogEntries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trip", type=int, action="append", default=[], help="Trip id, repeatable")
+        parser.add_argument("--driver", action="append", default=[], help="Driver id, repeatable")
+        parser.add_argument("--start", help="First log date, YYYY-MM-DD")
+        parser.add_argument("--end", help="Last log date, YYYY-MM-DD")
+        parser.add_argument("--chunk-size", type=int, default=50, help="Drivers per chunk")
+        parser.add_argument(
+            "--workers", type=int, help="Processes recomputing chunks (default: 1 on SQLite, else the CPU count)",
+        )
+        parser.add_argument("--checkpoint", help="File recording finished drivers, for --resume")
+        parser.add_argument("--resume", action="store_true", help="Skip drivers already in --checkpoint")
+
+    def handle(self, *args, **options):
+        if options["resume"] and not options["checkpoint"]:
+            raise CommandError("--resume needs --checkpoint")
+        workers = options["workers"] if options["workers"] is not None else default_workers()
+        if options["chunk_size"] < 1 or workers < 1:
+            raise CommandError("--chunk-size and --workers must be positive")
+        if workers > 1 and connections["default"].vendor == "sqlite":
+            self.stderr.write(self.style.WARNING(
+                f"{workers} workers share one SQLite writer; chunks may fail with 'database is locked'"
+            ))
+
+        def progress(totals, elapsed):
+            finished = totals["done"] + totals["failed"]
+            rate = totals["logs"] / elapsed if elapsed else 0.0
+            eta = (totals["drivers"] - finished) * elapsed / finished if finished else 0.0
+            self.stderr.write(
+                f"  {finished}/{totals['drivers']} drivers, {totals['logs']} logs "
+                f"({rate:.0f} logs/s, ~{eta:.0f}s left)"
+            )
+
+        try:
+            totals = recompute(
+                trip_ids=options["trip"], driver_ids=options["driver"],
+                start=parse_day(options["start"], "start"), end=parse_day(options["end"], "end"),
+                chunk_size=options["chunk_size"], workers=workers,
+                checkpoint_path=options["checkpoint"], resume=options["resume"], progress=progress,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        summary = (
+            f"Recomputed {totals['logs']} logs of {totals['done']} drivers in {totals['chunks']} chunks "
+            f"({totals['skipped']} drivers already done, {totals['rolling']} rolling windows, "
+            f"{totals['recaps']} trip recaps)"
+        )
+        if totals["failed"]:
+            raise CommandError(f"{summary}; {totals['failed']} drivers failed, rerun with --resume")
+        self.stderr.write(self.style.SUCCESS(summary))
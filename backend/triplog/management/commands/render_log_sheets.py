@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from triplog.logsheet import FORMATS, render_log_sheets, sheet_filename
+from triplog.recompute import select_logs
+from triplog.management.arguments import parse_day
+import os
+import time
+import zipfile
+
+
+class Command(BaseCommand):
+    help = "Render printable daily log sheets for drivers and a date range into a directory or a .zip file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Directory to write, or a path ending in .zip")
+        parser.add_argument("--format", choices=sorted(FORMATS), default="pdf")
+        parser.add_argument("--trip", type=int, action="append", default=[], help="Trip id, repeatable")
+        parser.add_argument("--driver", action="append", default=[], help="Driver id, repeatable")
+        parser.add_argument("--start", help="First log date, YYYY-MM-DD")
+        parser.add_argument("--end", help="Last log date, YYYY-MM-DD")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Rendering processes")
+
+    def handle(self, *args, **options):
+        logs = select_logs(
+            trip_ids=options["trip"], driver_ids=options["driver"],
+            start=parse_day(options["start"], "start"), end=parse_day(options["end"], "end"),
+        )
+        log_ids = list(logs.order_by("trip__driver_id", "log_date", "id").values_list("id", flat=True))
+        fmt = options["format"]
+        output = options["output"]
+        started = time.perf_counter()
+
+        sheets = render_log_sheets(log_ids, fmt, workers=max(options["workers"], 1))
+        count = 0
+        if output.endswith(".zip"):
+            with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+                for sheet, data in sheets:
+                    archive.writestr(sheet_filename(sheet, fmt), data)
+                    count += 1
+        else:
+            os.makedirs(output, exist_ok=True)
+            for sheet, data in sheets:
+                with open(os.path.join(output, sheet_filename(sheet, fmt)), "wb") as fh:
+                    fh.write(data)
+                count += 1
+
+        self.stderr.write(self.style.SUCCESS(
+            f"Wrote {count} {fmt} sheets to {output} in {time.perf_counter() - started:.1f}s"
+        ))
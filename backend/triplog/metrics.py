@@ -0,0 +1,318 @@
+from collections import defaultdict
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextvars import ContextVar
+from django.conf import settings
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "DIRECTORY": None,        # shared by all workers of a host; None keeps metrics per process
+    "FLUSH_SECONDS": 1.0,     # how often a worker rewrites its file
+    "TOKEN": None,            # bearer token /api/metrics/ requires; None turns the endpoint off
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name -> (type, help)
+METRICS = {
+    "triplog_http_requests_total": ("counter", "HTTP requests by URL pattern name, method and status"),
+    "triplog_http_request_duration_seconds": ("histogram", "Time until the view returned a response"),
+    "triplog_db_queries_per_request": ("histogram", "Database queries issued per request"),
+    "triplog_db_queries_total": ("counter", "Database queries issued"),
+    "triplog_db_query_duration_seconds_total": ("counter", "Time spent executing database queries"),
+    "triplog_routing_calls_total": ("counter", "Outbound routing backend calls"),
+    "triplog_routing_call_duration_seconds_total": ("counter", "Time spent in outbound routing calls"),
+}
+
+# Requests without a matching URL pattern, and work outside any request
+UNMATCHED = "unmatched"
+BACKGROUND = "background"
+
+
+def metrics_options():
+    return {**DEFAULTS, **getattr(settings, "METRICS", {})}
+
+
+class Registry:
+    """Thread-safe sample store: (metric, sorted label pairs) -> value
+
+    Everything is a monotonically increasing sum, histograms included (one
+    sample per bucket plus _sum and _count), so snapshots of several
+    processes merge by adding them up.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(float)
+        self.lock = threading.Lock()
+        self.last_flush = 0.0
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.samples[key] += amount
+
+    def observe(self, name, labels, value, buckets):
+        with self.lock:
+            for le in buckets:
+                if value <= le:
+                    self.samples[(f"{name}_bucket", tuple(sorted({**labels, "le": str(le)}.items())))] += 1
+            self.samples[(f"{name}_bucket", tuple(sorted({**labels, "le": "+Inf"}.items())))] += 1
+            self.samples[(f"{name}_sum", tuple(sorted(labels.items())))] += value
+            self.samples[(f"{name}_count", tuple(sorted(labels.items())))] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.samples)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+
+registry = Registry()
+
+
+def _process_file(directory, pid=None):
+    return os.path.join(directory, f"metrics-{pid or os.getpid()}.json")
+
+
+def flush(force=False):
+    """Write this process's samples to its file in the shared directory, at most every FLUSH_SECONDS"""
+    options = metrics_options()
+    directory = options["DIRECTORY"]
+    if not directory:
+        return
+
+    now = time.monotonic()
+    if not force and now - registry.last_flush < options["FLUSH_SECONDS"]:
+        return
+    registry.last_flush = now
+
+    rows = [[name, list(labels), value] for (name, labels), value in registry.snapshot().items()]
+    path = _process_file(directory)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(rows, fh)
+        os.replace(tmp, path)  # Readers never see a half-written file
+    except OSError as e:
+        logger.warning(f"Could not write metrics file {path}: {e}")
+
+
+atexit.register(flush, force=True)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, owned by someone else
+    return True
+
+
+def collect():
+    """Samples of every worker process, summed
+
+    Files of workers that no longer run are deleted, so restarts do not
+    accumulate stale series. Their totals drop out with them, which
+    Prometheus reads as a counter reset.
+    """
+    directory = metrics_options()["DIRECTORY"]
+    if not directory:
+        return registry.snapshot()
+
+    flush(force=True)
+    merged = defaultdict(float)
+    try:
+        names = [name for name in os.listdir(directory) if name.startswith("metrics-") and name.endswith(".json")]
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        path = os.path.join(directory, name)
+        pid = name[len("metrics-"):-len(".json")]
+        if pid.isdigit() and not _alive(int(pid)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path, encoding="utf-8") as fh:
+                rows = json.load(fh)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable metrics file {name}: {e}")
+            continue
+        for metric, labels, value in rows:
+            merged[(metric, tuple(tuple(pair) for pair in labels))] += value
+    return merged
+
+
+def _family(sample_name):
+    for suffix in ("_bucket", "_sum", "_count"):
+        if sample_name.endswith(suffix) and sample_name[: -len(suffix)] in METRICS:
+            return sample_name[: -len(suffix)]
+    return sample_name
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _le_order(labels):
+    le = dict(labels).get("le")
+    return float("inf") if le in (None, "+Inf") else float(le)
+
+
+def render(samples):
+    """Prometheus text exposition format (version 0.0.4)"""
+    families = defaultdict(list)
+    for (name, labels), value in samples.items():
+        families[_family(name)].append((name, labels, value))
+
+    lines = []
+    for family in sorted(families):
+        metric_type, help_text = METRICS.get(family, ("untyped", ""))
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {metric_type}")
+        rows = sorted(
+            families[family],
+            key=lambda row: (tuple(pair for pair in row[1] if pair[0] != "le"), row[0], _le_order(row[1])),
+        )
+        for name, labels, value in rows:
+            label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels)
+            lines.append(f"{name}{{{label_text}}} {_format_value(value)}" if label_text else f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class RequestStats:
+    """Database and routing work attributed to the request being served"""
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.routing_calls = 0
+        self.routing_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - started
+
+
+_current = ContextVar("triplog_request_stats", default=None)
+
+
+def record_routing_call(seconds):
+    """Called by the distance service after every outbound routing request"""
+    stats = _current.get()
+    if stats is not None:
+        stats.routing_calls += 1
+        stats.routing_seconds += seconds
+    else:
+        labels = {"endpoint": BACKGROUND}
+        registry.inc("triplog_routing_calls_total", labels)
+        registry.inc("triplog_routing_call_duration_seconds_total", labels, seconds)
+
+
+def endpoint_name(request):
+    match = getattr(request, "resolver_match", None)
+    return (match.url_name or match.view_name) if match else UNMATCHED
+
+
+def _count_query(execute, sql, params, many, context):
+    # Installed on every connection, so queries are counted whichever thread
+    # runs them: sync_to_async (ASGI sync views, ORM calls from async views)
+    # copies the request's context into its worker thread
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """connection_created receiver adding the query counter to each new connection once"""
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+class MetricsMiddleware:
+    """Per URL pattern request counts, latency, DB queries and routing calls
+
+    Placed first in MIDDLEWARE so the latency covers the whole stack. For
+    streaming responses it measures the time to the first byte, not the
+    whole body. Async-capable, so async views are not pushed onto a thread.
+    Queries are counted by install_query_counter() on the connection that
+    runs them, under WSGI and ASGI alike.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, stats, elapsed):
+        endpoint = endpoint_name(request)
+        labels = {"endpoint": endpoint}
+
+        registry.inc("triplog_http_requests_total", {
+            "endpoint": endpoint, "method": request.method, "status": str(response.status_code),
+        })
+        registry.observe(
+            "triplog_http_request_duration_seconds", {"endpoint": endpoint, "method": request.method},
+            elapsed, LATENCY_BUCKETS,
+        )
+        registry.observe("triplog_db_queries_per_request", labels, stats.queries, QUERY_COUNT_BUCKETS)
+        registry.inc("triplog_db_queries_total", labels, stats.queries)
+        registry.inc("triplog_db_query_duration_seconds_total", labels, stats.query_seconds)
+        if stats.routing_calls:
+            registry.inc("triplog_routing_calls_total", labels, stats.routing_calls)
+            registry.inc("triplog_routing_call_duration_seconds_total", labels, stats.routing_seconds)
+
+        flush()
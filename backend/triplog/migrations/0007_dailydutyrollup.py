@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triplog', '0006_alter_logentry_start_time'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='logentry',
+            name='start_time',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True),
+        ),
+        migrations.CreateModel(
+            name='DailyDutyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('driver_id', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('off_duty_hours', models.DecimalField(decimal_places=2, default=0.0, max_digits=6)),
+                ('sleeper_hours', models.DecimalField(decimal_places=2, default=0.0, max_digits=6)),
+                ('driving_hours', models.DecimalField(decimal_places=2, default=0.0, max_digits=6)),
+                ('on_duty_hours', models.DecimalField(decimal_places=2, default=0.0, max_digits=6)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('driver_id', 'day'), name='unique_driver_day_rollup')],
+            },
+        ),
+    ]
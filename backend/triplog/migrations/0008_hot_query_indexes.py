@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triplog', '0007_dailydutyrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='logentry',
+            index=models.Index(fields=['log', 'status'], name='logentry_log_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='logentry',
+            index=models.Index(fields=['log', '-id'], name='logentry_log_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['status', 'created_at'], name='trip_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['driver_id'], name='trip_driver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='triplog',
+            index=models.Index(fields=['trip', 'log_date'], name='triplog_trip_date_idx'),
+        ),
+    ]
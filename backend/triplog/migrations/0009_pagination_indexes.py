@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triplog', '0008_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='logentry',
+            index=models.Index(fields=['log', 'start_time', 'id'], name='logentry_log_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='logentry',
+            index=models.Index(fields=['start_time', 'id'], name='logentry_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['-created_at', '-id'], name='trip_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='triplog',
+            index=models.Index(fields=['log_date', 'id'], name='triplog_date_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triplog', '0010_triplog_logentry_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField()),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField()),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('data', models.BinaryField(default=bytes)),
+                ('last_timestamp_ms', models.BigIntegerField()),
+                ('last_lat_e6', models.IntegerField()),
+                ('last_lon_e6', models.IntegerField()),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_segments', to='triplog.logentry')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('entry', 'seq'), name='unique_entry_track_seq')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triplog', '0011_tracksegment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HosViolation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('driver_id', models.CharField(max_length=100)),
+                ('rule', models.CharField(choices=[('driving_11', '11-hour driving limit'), ('window_14', '14-hour duty window'), ('break_30', '30-minute break after 8 hours driving'), ('cycle', '60/7 or 70/8 on-duty cycle limit')], max_length=20)),
+                ('occurred_at', models.DateTimeField()),
+                ('excess_hours', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('cycle_type', models.CharField(max_length=10)),
+                ('detected_at', models.DateTimeField(auto_now_add=True)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='violations', to='triplog.logentry')),
+                ('log', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='violations', to='triplog.triplog')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['driver_id', 'occurred_at'], name='violation_driver_time_idx'), models.Index(fields=['occurred_at', 'id'], name='violation_time_idx')],
+            },
+        ),
+    ]
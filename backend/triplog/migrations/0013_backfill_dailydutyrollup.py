@@ -0,0 +1,51 @@
+from django.db import migrations
+from django.db.models import Sum
+
+
+# TripLog total hours column -> DailyDutyRollup column, as in triplog.aggregation.ROLLUP_FIELDS
+ROLLUP_FIELDS = {
+    "total_off_duty_hours": "off_duty_hours",
+    "total_sleeper_hours": "sleeper_hours",
+    "total_driving_hours": "driving_hours",
+    "total_on_duty_hours": "on_duty_hours",
+}
+
+
+def backfill_rollups(apps, schema_editor):
+    """Rebuild every driver's day rows from TripLog, which 0007 created empty
+
+    Without this, update_trip_log only ever adds (new - old) deltas to the
+    table, so logs written before it existed never reach the rolling windows.
+    """
+    TripLog = apps.get_model("triplog", "TripLog")
+    DailyDutyRollup = apps.get_model("triplog", "DailyDutyRollup")
+
+    rows = (
+        TripLog.objects
+        .values("trip__driver_id", "log_date")
+        .annotate(**{rollup: Sum(field) for field, rollup in ROLLUP_FIELDS.items()})
+        .order_by()
+    )
+    DailyDutyRollup.objects.all().delete()
+    DailyDutyRollup.objects.bulk_create(
+        (
+            DailyDutyRollup(
+                driver_id=row["trip__driver_id"],
+                day=row["log_date"],
+                **{rollup: row[rollup] or 0 for rollup in ROLLUP_FIELDS.values()},
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triplog', '0012_hosviolation'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
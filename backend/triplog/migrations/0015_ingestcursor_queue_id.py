@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triplog', '0014_ingestcursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestcursor',
+            name='queue_id',
+            field=models.CharField(default='', max_length=32),
+        ),
+    ]
@@ -75,6 +75,14 @@ class Trip(models.Model):
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="trip_status_created_idx"),
+            models.Index(fields=["driver_id"], name="trip_driver_idx"),
+            models.Index(fields=["-created_at", "-id"], name="trip_created_idx"),
+        ]
+
     def __str__(self):
         return f"Trip from {self.from_location} to {self.to_location}"
 
@@ -106,6 +114,13 @@ class TripLog(models.Model):
     remarks = models.TextField(blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["trip", "log_date"], name="triplog_trip_date_idx"),
+            models.Index(fields=["log_date", "id"], name="triplog_date_idx"),
+        ]
 
     def __str__(self):
         return f"Trip Log {self.id} - Trip {self.trip.id} on {self.log_date}"
@@ -127,11 +142,112 @@ class LogEntry(models.Model):
     mileage = models.FloatField(default=0.0)  # Miles driven in this log entry
     remarks = models.TextField(blank=True, null=True)
     automated = models.BooleanField(default=True)  # Distinguish automated vs manual
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["log", "status"], name="logentry_log_status_idx"),
+            models.Index(fields=["log", "-id"], name="logentry_log_latest_idx"),
+            models.Index(fields=["log", "start_time", "id"], name="logentry_log_start_idx"),
+            models.Index(fields=["start_time", "id"], name="logentry_start_idx"),
+        ]
 
     def __str__(self):
         return f"{self.status} - {self.start_time}"
 
 
+class DailyDutyRollup(models.Model):
+    """Per-driver, per-day duty hours summed over all of the driver's TripLogs"""
+    driver_id = models.CharField(max_length=100)
+    day = models.DateField()
+
+    off_duty_hours = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+    sleeper_hours = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+    driving_hours = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+    on_duty_hours = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["driver_id", "day"], name="unique_driver_day_rollup"),
+        ]
+
+    def __str__(self):
+        return f"Duty rollup for driver {self.driver_id} on {self.day}"
+
+
+class TrackSegment(models.Model):
+    """A run of consecutive GPS points of one LogEntry, packed by triplog.tracks
+
+    `data` holds delta-encoded (timestamp, lat, lon) varints. The last point
+    is kept in plain columns so appending never decodes the segment.
+    """
+    entry = models.ForeignKey(LogEntry, on_delete=models.CASCADE, related_name="track_segments")
+    seq = models.PositiveIntegerField()
+    start_time = models.DateTimeField()  # Earliest point in the segment
+    end_time = models.DateTimeField()    # Latest point in the segment
+    point_count = models.PositiveIntegerField(default=0)
+    data = models.BinaryField(default=bytes)
+
+    last_timestamp_ms = models.BigIntegerField()
+    last_lat_e6 = models.IntegerField()
+    last_lon_e6 = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["entry", "seq"], name="unique_entry_track_seq"),
+        ]
+
+    def __str__(self):
+        return f"Track segment {self.seq} of LogEntry {self.entry_id}"
+
+
+class IngestCursor(models.Model):
+    """Highest ingest-queue event applied to a TripLog, written in the same transaction as its pings
+
+    Queue delivery is at-least-once; drains skip events at or below the
+    cursor, so a batch redelivered after its commit is not applied twice.
+    Event ids are only ordered within one queue file, so the cursor counts
+    for the file named by queue_id and restarts when another file writes.
+    """
+    log = models.OneToOneField(TripLog, on_delete=models.CASCADE, primary_key=True, related_name="ingest_cursor")
+    queue_id = models.CharField(max_length=32, default="")
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Ingest cursor {self.last_event_id} of TripLog {self.log_id}"
+
+
+class HosViolation(models.Model):
+    """An hours-of-service rule broken during a driving LogEntry, found by triplog.compliance"""
+    RULE_CHOICES = [
+        ("driving_11", "11-hour driving limit"),
+        ("window_14", "14-hour duty window"),
+        ("break_30", "30-minute break after 8 hours driving"),
+        ("cycle", "60/7 or 70/8 on-duty cycle limit"),
+    ]
+
+    driver_id = models.CharField(max_length=100)
+    log = models.ForeignKey(TripLog, on_delete=models.CASCADE, related_name="violations")
+    entry = models.ForeignKey(LogEntry, on_delete=models.CASCADE, related_name="violations")
+    rule = models.CharField(max_length=20, choices=RULE_CHOICES)
+    occurred_at = models.DateTimeField()  # When the limit was crossed
+    excess_hours = models.DecimalField(max_digits=6, decimal_places=2)
+    cycle_type = models.CharField(max_length=10)
+    detected_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["driver_id", "occurred_at"], name="violation_driver_time_idx"),
+            models.Index(fields=["occurred_at", "id"], name="violation_time_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.rule} violation by {self.driver_id} at {self.occurred_at}"
+
+
 class TripCompletion(models.Model):
     trip = models.OneToOneField(Trip, on_delete=models.CASCADE, related_name="recap")
 
@@ -0,0 +1,172 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+import json
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination over a composite, unique ordering such as (start_time, id)
+
+    The cursor carries the full ordering key of the boundary row, so each page
+    is a single indexed range query regardless of depth, ties in the leading
+    field never skip or repeat rows, and NULLs are ordered explicitly (first
+    when ascending, last when descending). Views pick the ordering through a
+    ``pagination_ordering`` attribute whose last field must be unique.
+    """
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    ordering = ("-id",)
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        default = getattr(settings, "API_PAGE_SIZE", 100)
+        max_page_size = getattr(settings, "API_MAX_PAGE_SIZE", 500)
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, default))
+        except (TypeError, ValueError):
+            size = default
+        return max(1, min(size, max_page_size))
+
+    def get_ordering(self, view):
+        ordering = tuple(getattr(view, "pagination_ordering", self.ordering))
+        if len({field.startswith("-") for field in ordering}) != 1:
+            raise ValueError("pagination_ordering fields must all sort in the same direction")
+        return ordering
+
+    def encode_cursor(self, values, reverse):
+        # isoformat keeps microseconds, which the boundary comparison needs
+        payload = json.dumps(
+            {"k": values, "r": reverse}, default=lambda value: value.isoformat(), separators=(",", ":")
+        )
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, urlsafe_b64encode(payload.encode()).decode()
+        )
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            raw_values = payload["k"]
+            if len(raw_values) != len(self.fields):
+                raise ValueError
+            values = [
+                None if raw is None else model._meta.get_field(field).to_python(raw)
+                for field, raw in zip(self.fields, raw_values)
+            ]
+            return values, bool(payload["r"])
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def order_expressions(self, descending):
+        expressions = []
+        for field, nullable in zip(self.fields, self.nullable):
+            # Only nullable fields get an explicit NULL placement, so plain indexes still serve the rest
+            if descending:
+                expressions.append(F(field).desc(nulls_last=True) if nullable else F(field).desc())
+            else:
+                expressions.append(F(field).asc(nulls_first=True) if nullable else F(field).asc())
+        return expressions
+
+    def after(self, values, descending):
+        """Rows strictly after the key `values` in the given direction"""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for field, value in zip(self.fields, values):
+            if value is None:
+                # NULL sorts first ascending / last descending
+                greater = Q(pk__in=[]) if descending else Q(**{f"{field}__isnull": False})
+                same = Q(**{f"{field}__isnull": True})
+            elif descending:
+                greater = Q(**{f"{field}__lt": value}) | Q(**{f"{field}__isnull": True})
+                same = Q(**{field: value})
+            else:
+                greater = Q(**{f"{field}__gt": value})
+                same = Q(**{field: value})
+            condition |= equal & greater
+            equal &= same
+
+        # Redundant range on the leading field so the planner can seek instead of scanning
+        leading, value = self.fields[0], values[0]
+        if value is not None:
+            if not descending:
+                condition &= Q(**{f"{leading}__gte": value})
+            elif not self.nullable[0]:
+                condition &= Q(**{f"{leading}__lte": value})
+        return condition
+
+    def key(self, obj):
+        return [getattr(obj, field) for field in self.fields]
+
+    def window(self, queryset, request, view):
+        """The page's rows plus one lookahead row, as a sliced queryset"""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        ordering = self.get_ordering(view)
+        self.fields = [field.lstrip("-") for field in ordering]
+        self.nullable = [queryset.model._meta.get_field(field).null for field in self.fields]
+        self.descending = ordering[0].startswith("-")
+
+        values, reverse = self.decode_cursor(request, queryset.model)
+        # Previous pages walk the ordering backwards and flip the page afterwards
+        direction = self.descending != reverse
+
+        queryset = queryset.order_by(*self.order_expressions(direction))
+        if values is not None:
+            queryset = queryset.filter(self.after(values, direction))
+        return queryset[:self.page_size + 1], values, reverse
+
+    def page_state(self, queryset, request, view=None):
+        """(id, updated_at) of the rows the page would contain, for cheap validators"""
+        window, _, _ = self.window(queryset, request, view)
+        return list(window.values_list("id", "updated_at"))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        window, values, reverse = self.window(queryset, request, view)
+
+        rows = list(window)
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.page = rows
+        self.has_next = has_more if not reverse else values is not None
+        self.has_previous = values is not None if not reverse else has_more
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.key(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.key(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
@@ -0,0 +1,211 @@
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from functools import lru_cache
+from .compliance import (
+    CYCLES, DEFAULT_CYCLE, DRIVING_LIMIT, WINDOW_LIMIT, BREAK_AFTER_DRIVING, BREAK_MIN, SHIFT_RESET_REST, CYCLE_RESTART_REST,
+    HOUR, driver_state,
+)
+from .distance import get_distance_service, gps_coordinates
+from .models import LogEntry
+import math
+import re
+
+
+DEFAULTS = {
+    "AVERAGE_SPEED_MPH": 55,
+    "FUEL_EVERY_MILES": 1000,        # Same interval as the ingest fuel warning
+    "FUEL_STOP_MINUTES": 30,
+    "HOURS_RESOLUTION_MINUTES": 15,  # Remaining hours are rounded down to this for the plan cache
+}
+
+# Memoized simulations per process
+PLAN_CACHE_SIZE = 4096
+
+# Accepted planning inputs; outside them a plan is meaningless or too long to simulate
+SPEED_RANGE_MPH = (5, 90)
+MIN_FUEL_EVERY_MILES = 50
+MAX_STOPS = 2000
+
+# "lat, lon" in a free-text location
+COORDINATES_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$")
+
+EPSILON = 1e-6
+
+
+class PlanError(Exception):
+    pass
+
+
+def planner_options():
+    return {**DEFAULTS, **getattr(settings, "TRIP_PLANNER", {})}
+
+
+def parse_location(value):
+    """(lat, lon) from a "lat, lon" string, None for anything else"""
+    match = COORDINATES_RE.match(value or "")
+    if not match:
+        return None
+    lat, lon = float(match.group(1)), float(match.group(2))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def _simulate(miles, since_fuel, drive, window, rest_break, cycle, cycle_limit, speed, fuel_every, fuel_hours):
+    """Stops as (kind, mile, start hour, hours) tuples and the driving hours, all hours from departure
+
+    The driver drives until the first limit binds: a 30-minute break after 8
+    hours of driving, a 10-hour rest when the 11-hour or 14-hour limit runs
+    out, a 34-hour restart when the cycle does, and a fuel stop every
+    `fuel_every` miles. Fuel stops are on duty; one of 30 minutes or more
+    also counts as the break.
+    """
+    stops = []
+    mile = elapsed = driving = 0.0
+
+    def stop(kind, hours):
+        nonlocal elapsed
+        if len(stops) >= MAX_STOPS:
+            raise PlanError(f"The trip needs more than {MAX_STOPS} stops")
+        stops.append((kind, round(mile, 1), round(elapsed, 2), round(hours, 2)))
+        elapsed += hours
+
+    # Every pass either adds a stop or drives until one is due, so this bounds the loop
+    for _ in range(2 * MAX_STOPS + 2):
+        if miles - mile <= EPSILON:
+            break
+        to_fuel = fuel_every - since_fuel
+        if cycle <= EPSILON:
+            stop("restart", CYCLE_RESTART_REST / HOUR)
+            drive, window, rest_break, cycle = DRIVING_LIMIT / HOUR, WINDOW_LIMIT / HOUR, BREAK_AFTER_DRIVING / HOUR, cycle_limit
+        elif drive <= EPSILON or window <= EPSILON:
+            stop("rest", SHIFT_RESET_REST / HOUR)
+            drive, window, rest_break = DRIVING_LIMIT / HOUR, WINDOW_LIMIT / HOUR, BREAK_AFTER_DRIVING / HOUR
+        elif to_fuel <= EPSILON:
+            stop("fuel", fuel_hours)
+            since_fuel = 0.0
+            window -= fuel_hours
+            cycle -= fuel_hours
+            if fuel_hours >= BREAK_MIN / HOUR:
+                rest_break = BREAK_AFTER_DRIVING / HOUR
+        elif rest_break <= EPSILON:
+            stop("break", BREAK_MIN / HOUR)
+            window -= BREAK_MIN / HOUR
+            rest_break = BREAK_AFTER_DRIVING / HOUR
+        else:
+            hours = min(drive, window, rest_break, cycle, (miles - mile) / speed, to_fuel / speed)
+            mile += hours * speed
+            since_fuel += hours * speed
+            elapsed += hours
+            driving += hours
+            drive -= hours
+            window -= hours
+            rest_break -= hours
+            cycle -= hours
+    else:
+        raise PlanError(f"The trip needs more than {MAX_STOPS} stops")
+    return tuple(stops), round(driving, 2), round(elapsed, 2)
+
+
+_cached_simulate = lru_cache(maxsize=PLAN_CACHE_SIZE)(_simulate)
+
+
+def plan_cache_info():
+    return _cached_simulate.cache_info()
+
+
+def clear_plan_cache():
+    _cached_simulate.cache_clear()
+
+
+def plan_route(miles, state, cycle_type, since_fuel=0.0, departure=None, **options):
+    """Stop schedule for driving `miles` from a driver_state(), with clock times from `departure`
+
+    Inputs are bucketed before the memoized simulation: remaining hours
+    round down to HOURS_RESOLUTION_MINUTES and miles round up, so the plan
+    only errs on the cautious side and replanning after every ping mostly
+    hits the cache.
+    """
+    options = {**planner_options(), **options}
+    speed = float(options["AVERAGE_SPEED_MPH"])
+    fuel_every = float(options["FUEL_EVERY_MILES"])
+    low, high = SPEED_RANGE_MPH
+    if not low <= speed <= high:
+        raise PlanError(f"Average speed must be between {low} and {high} mph")
+    if not fuel_every >= MIN_FUEL_EVERY_MILES:
+        raise PlanError(f"Fuel interval must be at least {MIN_FUEL_EVERY_MILES} miles")
+
+    resolution = options["HOURS_RESOLUTION_MINUTES"] * 60
+
+    def bucket(seconds):
+        return math.floor(seconds / resolution) * resolution / HOUR
+
+    limit, _ = CYCLES[cycle_type]
+    stops, driving_hours, total_hours = _cached_simulate(
+        math.ceil(miles), float(math.ceil(since_fuel % fuel_every)),
+        bucket(state["drive"]), bucket(state["window"]), bucket(state["break"]), bucket(state["cycle"]),
+        float(limit), speed, fuel_every, options["FUEL_STOP_MINUTES"] / 60,
+    )
+
+    departure = departure or timezone.now()
+    return {
+        "miles": round(miles, 1),
+        "driving_hours": driving_hours,
+        "total_hours": total_hours,
+        "departure": departure,
+        "arrival": departure + timedelta(hours=total_hours),
+        "stops": [
+            {
+                "type": kind,
+                "mile": mile,
+                "start": departure + timedelta(hours=start),
+                "end": departure + timedelta(hours=start + hours),
+                "hours": hours,
+            }
+            for kind, mile, start, hours in stops
+        ],
+    }
+
+
+def last_position(trip_id):
+    """The trip's latest known GPS position, or None"""
+    entry = (
+        LogEntry.objects.filter(log__trip_id=trip_id)
+        .order_by("-start_time", "-id").only("start_gps", "end_gps").first()
+    )
+    if entry is None:
+        return None
+    return gps_coordinates(entry.end_gps) or gps_coordinates(entry.start_gps)
+
+
+def plan_trip(trip, destination=None, as_of=None, **options):
+    """Plan from the trip's latest position (or from_location) to `destination` (or to_location)
+
+    Locations are "lat, lon" pairs: the repo has no geocoder, so free-text
+    addresses cannot be planned. The road distance comes from the shared
+    distance service and so shares its route cache.
+    """
+    origin = last_position(trip.id) or parse_location(trip.from_location)
+    destination = destination or parse_location(trip.to_location)
+    if origin is None:
+        raise PlanError("The trip has no GPS position and from_location is not a 'lat, lon' pair")
+    if destination is None:
+        raise PlanError("to_location is not a 'lat, lon' pair; pass the destination as to=lat,lon")
+
+    cycle_type = trip.cycle_type if trip.cycle_type in CYCLES else DEFAULT_CYCLE
+    as_of = as_of or timezone.now()
+    state = driver_state(trip.driver_id, cycle_type, as_of)
+    miles = get_distance_service().distance(
+        {"lat": origin[0], "lon": origin[1]}, {"lat": destination[0], "lon": destination[1]}
+    )
+
+    plan = plan_route(miles, state, cycle_type, since_fuel=float(trip.total_mileage), departure=as_of, **options)
+    plan.update({
+        "trip": trip.id,
+        "cycle_type": cycle_type,
+        "origin": list(origin),
+        "destination": list(destination),
+        "hours_left": {name: round(seconds / HOUR, 2) for name, seconds in state.items()},
+    })
+    return plan
@@ -0,0 +1,225 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connections, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .aggregation import (
+    STATUS_HOUR_FIELDS, ROLLUP_FIELDS, ROLLING_WINDOWS, log_total_aggregates, log_totals_from_row,
+    rolling_totals,
+)
+from .compliance import check_drivers
+from .models import TripLog, LogEntry, DailyDutyRollup
+from .response_cache import invalidate
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+TOTAL_FIELDS = [*STATUS_HOUR_FIELDS.values(), "total_miles_driving_today", "total_miles_today"]
+ROLLING_FIELDS = list(ROLLING_WINDOWS)
+
+# Later logs whose rolling windows reach back into a recomputed day
+ROLLING_REACH = timedelta(days=max(ROLLING_WINDOWS.values()))
+
+
+def select_logs(trip_ids=None, driver_ids=None, start=None, end=None):
+    """TripLogs matching every given filter; no filters selects them all"""
+    logs = TripLog.objects.all()
+    if trip_ids:
+        logs = logs.filter(trip_id__in=trip_ids)
+    if driver_ids:
+        logs = logs.filter(trip__driver_id__in=driver_ids)
+    if start:
+        logs = logs.filter(log_date__gte=start)
+    if end:
+        logs = logs.filter(log_date__lte=end)
+    return logs
+
+
+def selected_drivers(selection):
+    return sorted(set(
+        select_logs(**selection).order_by().values_list("trip__driver_id", flat=True).distinct()
+    ))
+
+
+def recompute_drivers(driver_ids, selection, as_of=None):
+    """Rebuild the selected TripLogs of some drivers, their rollups, rolling windows and trip recaps
+
+    Totals come from one GROUP BY over the chunk's LogEntries, rollups
+    from one GROUP BY over its TripLogs, and every write is a bulk
+    statement, so the query count depends on the chunk, not its size.
+    Logs up to eight days after a recomputed day get their rolling windows
+    refreshed too, since those windows include it. Compliance (violations,
+    restart-aware available hours, TripCompletion recaps) is then rerun
+    over the same days.
+    """
+    logs = list(
+        select_logs(**selection).filter(trip__driver_id__in=driver_ids)
+        .select_related("trip").only("id", "log_date", "trip_id", "trip__driver_id")
+    )
+    if not logs:
+        return {"logs": 0, "rollups": 0, "rolling": 0, "recaps": 0}
+
+    now = timezone.now()
+    rows = (
+        LogEntry.objects.filter(log_id__in=[log.id for log in logs])
+        .values("log_id").order_by().annotate(**log_total_aggregates())
+    )
+    totals = {row["log_id"]: row for row in rows}
+    for log in logs:
+        for field, value in log_totals_from_row(totals.get(log.id, {})).items():
+            setattr(log, field, value)
+        log.updated_at = now
+
+    days = {log.log_date for log in logs}
+    first_day, last_day = min(days), max(days)
+
+    with transaction.atomic():
+        TripLog.objects.bulk_update(logs, [*TOTAL_FIELDS, "updated_at"], batch_size=500)
+
+        # Rollups for every (driver, day) of the chunk, straight from TripLog
+        sums = (
+            TripLog.objects.filter(trip__driver_id__in=driver_ids, log_date__in=days)
+            .values("trip__driver_id", "log_date").order_by()
+            .annotate(**{rollup: Sum(field) for field, rollup in ROLLUP_FIELDS.items()})
+        )
+        rollups = [
+            DailyDutyRollup(
+                driver_id=row["trip__driver_id"], day=row["log_date"],
+                **{rollup: row[rollup] or Decimal("0.00") for rollup in ROLLUP_FIELDS.values()},
+            )
+            for row in sums
+        ]
+        DailyDutyRollup.objects.filter(driver_id__in=driver_ids, day__in=days).delete()
+        DailyDutyRollup.objects.bulk_create(rollups, batch_size=500)
+
+        # Rolling windows of the chunk's logs and of the later logs that look back on them
+        on_duty = defaultdict(dict)
+        for driver_id, day, hours in DailyDutyRollup.objects.filter(
+            driver_id__in=driver_ids, day__gte=first_day - ROLLING_REACH, day__lte=last_day + ROLLING_REACH,
+        ).values_list("driver_id", "day", "on_duty_hours"):
+            on_duty[driver_id][day] = hours
+
+        rolling = list(
+            TripLog.objects.filter(
+                trip__driver_id__in=driver_ids, log_date__gte=first_day, log_date__lte=last_day + ROLLING_REACH,
+            ).select_related("trip").only("id", "log_date", "trip_id", "trip__driver_id")
+        )
+        for log in rolling:
+            values = rolling_totals(on_duty[log.trip.driver_id], log.log_date)
+            for field, value in values.items():
+                setattr(log, field, value)
+            log.updated_at = now
+        TripLog.objects.bulk_update(rolling, [*ROLLING_FIELDS, "updated_at"], batch_size=500)
+
+        invalidate(
+            trip_ids={log.trip_id for log in rolling} | {log.trip_id for log in logs},
+            log_ids={log.id for log in rolling} | {log.id for log in logs},
+        )
+
+    _, _, recaps = check_drivers(driver_ids, first_day, last_day, as_of or now)
+    return {"logs": len(logs), "rollups": len(rollups), "rolling": len(rolling), "recaps": recaps}
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    # Never share the parent's database connections
+    connections.close_all()
+
+
+def _run_chunk(driver_ids, selection, as_of):
+    return driver_ids, recompute_drivers(driver_ids, selection, as_of)
+
+
+class Checkpoint:
+    """JSON file of the drivers already recomputed for a selection, written after every chunk"""
+
+    def __init__(self, path, selection):
+        self.path = path
+        self.selection = {key: value for key, value in selection.items() if value}
+        self.done = set()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as fh:
+            state = json.load(fh)
+        if state.get("selection") != json.loads(json.dumps(self.selection, default=str)):
+            raise ValueError(f"{self.path} was written for a different selection: {state.get('selection')}")
+        self.done = set(state.get("done", []))
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump({"selection": self.selection, "done": sorted(self.done)}, fh, default=str)
+        os.replace(tmp, self.path)
+
+
+def default_workers():
+    """One process on SQLite, where concurrent chunks would fail on the single writer lock"""
+    if connections["default"].vendor == "sqlite":
+        return 1
+    return os.cpu_count() or 1
+
+
+def recompute(trip_ids=None, driver_ids=None, start=None, end=None, chunk_size=50, workers=1,
+              checkpoint_path=None, resume=False, progress=None):
+    """Recompute TripLog and TripCompletion aggregates for a selection, chunked by driver
+
+    Chunks are groups of `chunk_size` drivers: a driver's rollups and
+    rolling windows never span two chunks, so `workers` processes can
+    recompute chunks side by side. Finished drivers are recorded in the
+    checkpoint file; with `resume` they are skipped.
+    """
+    selection = {"trip_ids": trip_ids, "driver_ids": driver_ids, "start": start, "end": end}
+    checkpoint = Checkpoint(checkpoint_path, selection)
+    if resume:
+        checkpoint.load()
+    else:
+        checkpoint.save()
+
+    drivers = [driver for driver in selected_drivers(selection) if driver not in checkpoint.done]
+    chunks = [drivers[i:i + chunk_size] for i in range(0, len(drivers), chunk_size)]
+    totals = {"drivers": len(drivers), "skipped": len(checkpoint.done), "chunks": len(chunks),
+              "done": 0, "failed": 0, "logs": 0, "rollups": 0, "rolling": 0, "recaps": 0}
+    as_of = timezone.now()
+    started = time.perf_counter()
+
+    def finish(chunk, run):
+        try:
+            _, counts = run()
+        except Exception:
+            # Left out of the checkpoint, so a resumed run retries these drivers
+            logger.exception(f"recompute: chunk {chunk[0]}..{chunk[-1]} failed")
+            totals["failed"] += len(chunk)
+        else:
+            checkpoint.done.update(chunk)
+            checkpoint.save()
+            totals["done"] += len(chunk)
+            for key, value in counts.items():
+                totals[key] += value
+        if progress:
+            progress(totals, time.perf_counter() - started)
+
+    if workers <= 1:
+        for chunk in chunks:
+            finish(chunk, lambda: _run_chunk(chunk, selection, as_of))
+        return totals
+
+    # Children must open their own connections, not inherit the parent's sockets
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(_run_chunk, chunk, selection, as_of): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            finish(futures[future], future.result)
+    return totals
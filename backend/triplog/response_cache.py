@@ -0,0 +1,118 @@
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+import hashlib
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = "responses"
+
+
+def response_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _generation_key(scope):
+    return f"gen:{scope}"
+
+
+def scope_versions(scopes):
+    """Current generation of each scope, creating missing ones
+
+    A fresh generation starts from the clock rather than 1, so a generation
+    key that was evicted and recreated never matches responses cached under
+    its previous life.
+    """
+    cache = response_cache()
+    keys = [_generation_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns())
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes):
+    """Move each scope to a fresh generation
+
+    Set from the clock rather than incremented: incr() is a read-modify-write
+    on the file-based backend, so two workers bumping at once could both
+    write the same next generation and keep a response cached in between.
+    """
+    generation = time.time_ns()
+    response_cache().set_many({_generation_key(scope): generation for scope in scopes})
+
+
+def trip_scope(trip_id):
+    return f"trip:{trip_id}"
+
+
+def log_scope(log_id):
+    return f"log:{log_id}"
+
+
+def invalidate(trip_ids=(), log_ids=()):
+    """Drop cached responses that depend on these trips / logs once the transaction commits
+
+    Running after commit means a read racing the write can only cache the old
+    rows under the old generation, which this bump then retires.
+    """
+    scopes = [trip_scope(trip_id) for trip_id in trip_ids if trip_id is not None]
+    scopes += [log_scope(log_id) for log_id in log_ids if log_id is not None]
+    if scopes:
+        transaction.on_commit(lambda: bump(*scopes))
+
+
+class CachedResponseMixin:
+    """Serve GET responses from the response cache, keyed on the path and scope generations
+
+    Views name the trip / log their output depends on with `cache_scope`, a
+    (trip_scope or log_scope, URL kwarg holding its id) pair, or override
+    get_cache_scopes(). Writes to those rows call invalidate(), which moves
+    the generation and so orphans every cached response built from them.
+    Sits in front of ConditionalGetMixin so cache hits also answer
+    If-None-Match without touching the database.
+    """
+
+    cache_scope = None
+
+    def get_cache_scopes(self):
+        assert self.cache_scope is not None, (
+            f"'{type(self).__name__}' should either set `cache_scope` or override `get_cache_scopes()`"
+        )
+        scope, kwarg = self.cache_scope
+        return [scope(self.kwargs[kwarg])]
+
+    def get_cache_key(self, request):
+        scopes = self.get_cache_scopes()
+        versions = scope_versions(scopes)
+        raw = ":".join([type(self).__name__, request.get_full_path(), *map(str, versions)])
+        return "response:" + hashlib.md5(raw.encode()).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        cache = response_cache()
+        key = self.get_cache_key(request)
+
+        cached = cache.get(key)
+        if cached is not None:
+            data, etag = cached
+            if etag:
+                not_modified = get_conditional_response(request, etag=etag)
+                if not_modified is not None:
+                    if not_modified.status_code == 304:
+                        not_modified["ETag"] = etag
+                    return not_modified
+            response = Response(data)
+            if etag:
+                response["ETag"] = etag
+            return response
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, (response.data, response.get("ETag")))
+        return response
@@ -0,0 +1,263 @@
+from collections import defaultdict
+from .distance import haversine_miles_array, METERS_PER_MILE
+import heapq
+import logging
+import math
+import random
+import xml.etree.ElementTree as ET
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# OSM highway values a truck can drive on
+ROUTABLE_HIGHWAYS = {
+    "motorway", "motorway_link", "trunk", "trunk_link", "primary", "primary_link",
+    "secondary", "secondary_link", "tertiary", "tertiary_link", "unclassified",
+    "residential", "living_street", "service", "road",
+}
+
+# Size of the cells of the nearest-node grid, in degrees
+GRID_DEGREES = 0.01
+
+INF = math.inf
+
+
+def _oneway(tags):
+    """1 for forward-only ways, -1 for reverse-only, 0 for two-way"""
+    value = tags.get("oneway", "")
+    if value in ("yes", "true", "1"):
+        return 1
+    if value == "-1":
+        return -1
+    if tags.get("junction") == "roundabout" or tags.get("highway") in ("motorway", "motorway_link"):
+        return 0 if value == "no" else 1
+    return 0
+
+
+def read_osm(path):
+    """Routable (lat, lon) nodes and directed (from, to) node pairs from an OSM XML extract"""
+    coordinates = {}
+    edges = []
+    for _, element in ET.iterparse(path, events=("end",)):
+        if element.tag == "node":
+            coordinates[element.get("id")] = (float(element.get("lat")), float(element.get("lon")))
+            element.clear()
+        elif element.tag == "way":
+            tags = {tag.get("k"): tag.get("v") for tag in element.iter("tag")}
+            if tags.get("highway") in ROUTABLE_HIGHWAYS and tags.get("access") not in ("no", "private"):
+                refs = [nd.get("ref") for nd in element.iter("nd")]
+                direction = _oneway(tags)
+                for a, b in zip(refs, refs[1:]):
+                    if direction >= 0:
+                        edges.append((a, b))
+                    if direction <= 0:
+                        edges.append((b, a))
+            element.clear()
+    return coordinates, edges
+
+
+def _csr(count, sources, targets, weights):
+    """Compressed sparse row adjacency: edges of node v are offsets[v]:offsets[v + 1]"""
+    order = np.argsort(sources, kind="stable")
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.add.at(offsets, sources + 1, 1)
+    return np.cumsum(offsets), targets[order].astype(np.int32), weights[order].astype(np.float32)
+
+
+def _dijkstra(offsets, targets, weights, source):
+    """Distances from source to every node over a CSR graph of memoryviews"""
+    distances = [INF] * (len(offsets) - 1)
+    distances[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        dist, node = heapq.heappop(heap)
+        if dist > distances[node]:
+            continue
+        for i in range(offsets[node], offsets[node + 1]):
+            candidate = dist + weights[i]
+            target = targets[i]
+            if candidate < distances[target]:
+                distances[target] = candidate
+                heapq.heappush(heap, (candidate, target))
+    return distances
+
+
+def build_graph(coordinates, edges, landmarks=8, seed=0):
+    """RoadGraph arrays from node coordinates and directed edges, with ALT landmarks
+
+    Landmarks are chosen farthest-first: each new landmark is the reachable
+    node farthest from those already picked, which keeps the triangle
+    inequality bounds tight across the whole graph.
+    """
+    used = sorted({node for edge in edges for node in edge if node in coordinates})
+    index = {node: i for i, node in enumerate(used)}
+    edges = [(index[a], index[b]) for a, b in edges if a in index and b in index and a != b]
+
+    lat = np.array([coordinates[node][0] for node in used])
+    lon = np.array([coordinates[node][1] for node in used])
+    sources = np.array([a for a, _ in edges], dtype=np.int64)
+    targets = np.array([b for _, b in edges], dtype=np.int64)
+    meters = haversine_miles_array(lat[sources], lon[sources], lat[targets], lon[targets]) * METERS_PER_MILE
+
+    forward = _csr(len(used), sources, targets, meters)
+    backward = _csr(len(used), targets, sources, meters)
+
+    forward_views = [memoryview(array) for array in forward]
+    backward_views = [memoryview(array) for array in backward]
+    landmark_from, landmark_to = [], []
+    rng = random.Random(seed)
+    nearest = [INF] * len(used)
+    start = rng.randrange(len(used)) if used else None
+    for _ in range(min(landmarks, len(used))):
+        from_landmark = _dijkstra(*forward_views, start)
+        landmark_from.append(from_landmark)
+        landmark_to.append(_dijkstra(*backward_views, start))
+        nearest = [min(a, b) for a, b in zip(nearest, from_landmark)]
+        reachable = [(dist, node) for node, dist in enumerate(nearest) if dist < INF]
+        start = max(reachable)[1] if reachable and max(reachable)[0] > 0 else rng.randrange(len(used))
+
+    return {
+        "lat": lat,
+        "lon": lon,
+        "offsets": forward[0],
+        "targets": forward[1],
+        "weights": forward[2],
+        "landmark_from": np.array(landmark_from, dtype=np.float32).reshape(len(landmark_from), len(used)),
+        "landmark_to": np.array(landmark_to, dtype=np.float32).reshape(len(landmark_to), len(used)),
+    }
+
+
+def build_graph_file(osm_path, output_path, landmarks=8):
+    coordinates, edges = read_osm(osm_path)
+    arrays = build_graph(coordinates, edges, landmarks=landmarks)
+    with open(output_path, "wb") as fh:
+        np.savez(fh, **arrays)
+    return len(arrays["lat"]), len(arrays["targets"])
+
+
+class RoadGraph:
+    """Shortest road distances over an array-backed graph with ALT (A*, landmarks, triangle inequality)
+
+    Weights are edge lengths, so queries return the shortest driving
+    distance, not the distance of the fastest route OSRM would pick.
+    """
+
+    def __init__(self, lat, lon, offsets, targets, weights, landmark_from, landmark_to, snap_max_meters=500):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        # memoryviews index to plain Python numbers, much faster than NumPy scalars in the search loop
+        self.offsets = memoryview(np.ascontiguousarray(offsets, dtype=np.int64))
+        self.targets = memoryview(np.ascontiguousarray(targets, dtype=np.int32))
+        self.weights = memoryview(np.ascontiguousarray(weights, dtype=np.float32))
+        self.landmark_from = [memoryview(np.ascontiguousarray(row, dtype=np.float32)) for row in landmark_from]
+        self.landmark_to = [memoryview(np.ascontiguousarray(row, dtype=np.float32)) for row in landmark_to]
+        self.snap_max_meters = snap_max_meters
+        self._build_grid()
+
+    @classmethod
+    def load(cls, path, **options):
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in data.files}, **options)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _build_grid(self):
+        cells = defaultdict(list)
+        for node, key in enumerate(zip(
+            np.floor(self.lat / GRID_DEGREES).astype(np.int64).tolist(),
+            np.floor(self.lon / GRID_DEGREES).astype(np.int64).tolist(),
+        )):
+            cells[key].append(node)
+        self.grid = {key: np.array(nodes) for key, nodes in cells.items()}
+
+    def nearest_node(self, lat, lon):
+        """(node, meters) of the closest graph node within snap_max_meters, else (None, None)"""
+        row, col = math.floor(lat / GRID_DEGREES), math.floor(lon / GRID_DEGREES)
+        max_ring = int(self.snap_max_meters / (GRID_DEGREES * 111_000 * max(math.cos(math.radians(lat)), 0.1))) + 1
+        best = (None, INF)
+        for ring in range(max_ring + 1):
+            nodes = [
+                self.grid[(row + dr, col + dc)]
+                for dr in range(-ring, ring + 1) for dc in range(-ring, ring + 1)
+                if max(abs(dr), abs(dc)) == ring and (row + dr, col + dc) in self.grid
+            ]
+            if nodes:
+                candidates = np.concatenate(nodes)
+                meters = haversine_miles_array(lat, lon, self.lat[candidates], self.lon[candidates]) * METERS_PER_MILE
+                i = int(meters.argmin())
+                if meters[i] < best[1]:
+                    best = (int(candidates[i]), float(meters[i]))
+            # Anything in a farther ring is at least `ring` cells away
+            if best[0] is not None and best[1] <= ring * GRID_DEGREES * 111_000 * math.cos(math.radians(lat)):
+                break
+        if best[0] is None or best[1] > self.snap_max_meters:
+            return None, None
+        return best
+
+    def _heuristic(self, target):
+        """Admissible lower bound on node -> target meters from the landmark distances"""
+        to_target = [(row_from, row_from[target], row_to, row_to[target])
+                     for row_from, row_to in zip(self.landmark_from, self.landmark_to)]
+
+        def bound(node):
+            best = 0.0
+            for row_from, from_target, row_to, to_target_ in to_target:
+                # d(L, t) - d(L, v) <= d(v, t)
+                from_node = row_from[node]
+                if from_target < INF and from_node < INF:
+                    best = max(best, from_target - from_node)
+                elif from_target == INF and from_node < INF:
+                    return INF  # L reaches v but not t, so v cannot reach t
+                # d(v, L) - d(t, L) <= d(v, t)
+                to_node = row_to[node]
+                if to_node < INF and to_target_ < INF:
+                    best = max(best, to_node - to_target_)
+                elif to_node == INF and to_target_ < INF:
+                    return INF  # t reaches L but v does not, so v cannot reach t
+            return best
+        return bound
+
+    def shortest_meters(self, source, target):
+        """Shortest path length in meters between two nodes, INF if unreachable"""
+        if source == target:
+            return 0.0
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        bound = self._heuristic(target)
+        distances = {source: 0.0}
+        heap = [(bound(source), 0.0, source)]
+        settled = set()
+        while heap:
+            _, dist, node = heapq.heappop(heap)
+            if node == target:
+                return dist
+            if node in settled:
+                continue
+            settled.add(node)
+            for i in range(offsets[node], offsets[node + 1]):
+                neighbour = targets[i]
+                candidate = dist + weights[i]
+                if candidate < distances.get(neighbour, INF):
+                    estimate = bound(neighbour)
+                    if estimate == INF:
+                        continue
+                    distances[neighbour] = candidate
+                    heapq.heappush(heap, (candidate + estimate, candidate, neighbour))
+        return INF
+
+    def route_miles(self, *coordinates):
+        """Road miles through (lat, lon) waypoints in order, None if a point is off the network or unreachable"""
+        snapped = [self.nearest_node(lat, lon) for lat, lon in coordinates]
+        if any(node is None for node, _ in snapped):
+            return None
+
+        meters = 0.0
+        for (a, _), (b, _) in zip(snapped, snapped[1:]):
+            leg = self.shortest_meters(a, b)
+            if leg == INF:
+                return None
+            meters += leg
+        # The stretches between the points and the road, at both ends
+        meters += snapped[0][1] + snapped[-1][1]
+        return meters / METERS_PER_MILE
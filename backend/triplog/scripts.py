@@ -1,8 +1,110 @@
-from datetime import datetime, timedelta  # Add datetime import here
-from triplog.models import TripLog, LogEntry, Trip
+from datetime import datetime, time, timedelta  # Add datetime import here
+from decimal import Decimal
+from triplog.models import TripLog, LogEntry, Trip, DailyDutyRollup
+from triplog.aggregation import (
+    update_trip_log, timedelta_to_decimal, miles_to_decimal, STATUS_HOUR_FIELDS, ROLLUP_FIELDS,
+    rolling_totals,
+)
+from triplog.compliance import check_compliance
+from triplog.distance import EARTH_RADIUS_MILES, gps_coordinates
+from triplog.tracks import append_tracks, to_point
+from django.db import transaction
 from django.utils import timezone
+import math
 import random
 
+
+def advance(position, heading, miles):
+    """Moves a (lat, lon) position `miles` along a compass heading in degrees"""
+    lat, lon = map(math.radians, position)
+    bearing = math.radians(heading)
+    angular = miles / EARTH_RADIUS_MILES
+    new_lat = math.asin(
+        math.sin(lat) * math.cos(angular) + math.cos(lat) * math.sin(angular) * math.cos(bearing)
+    )
+    new_lon = lon + math.atan2(
+        math.sin(bearing) * math.sin(angular) * math.cos(lat),
+        math.cos(angular) - math.sin(lat) * math.sin(new_lat),
+    )
+    return round(math.degrees(new_lat), 6), round((math.degrees(new_lon) + 540) % 360 - 180, 6)
+
+
+def drive(position, heading, hours, speed_mph, ping_interval, rng):
+    """Simulates pings every `ping_interval` seconds along a wandering route
+
+    Returns (end position, end heading, miles, [(seconds offset, lat, lon), ...]).
+    """
+    points = [(0, *position)]
+    miles = 0.0
+    total_seconds = int(hours * 3600)
+    elapsed = 0
+    while elapsed < total_seconds:
+        step = min(ping_interval, total_seconds - elapsed)
+        elapsed += step
+        heading = (heading + rng.gauss(0, 4)) % 360
+        hop = speed_mph * rng.uniform(0.85, 1.1) * step / 3600
+        position = advance(position, heading, hop)
+        miles += hop
+        points.append((elapsed, *position))
+    return position, heading, miles, points
+
+
+def gps_dict(position):
+    return {"latitude": position[0], "longitude": position[1]}
+
+
+def build_log_entries(trip_log, status_blocks, start_time, position, heading=None,
+                      speed_mph=55, ping_interval=60, max_entry_minutes=None, rng=random):
+    """Unsaved, back-to-back LogEntries for (status, minutes) blocks with a contiguous GPS track
+
+    Driving blocks move the position at roughly `speed_mph`, sampled every
+    `ping_interval` seconds; mileage is the length of that track. Blocks longer
+    than `max_entry_minutes` are split into consecutive entries of the same
+    status. Returns (entries, end position, end heading, tracks), where
+    tracks[i] holds the (timestamp_ms, lat_e6, lon_e6) pings of entries[i]
+    for append_tracks (empty for entries that do not move).
+    """
+    heading = rng.uniform(0, 360) if heading is None else heading
+    entries = []
+    tracks = []
+    current_time = start_time
+
+    for status, duration_minutes in status_blocks:
+        remaining = duration_minutes
+        while remaining > 0:
+            minutes = min(remaining, max_entry_minutes) if max_entry_minutes else remaining
+            remaining -= minutes
+            end_time = current_time + timedelta(minutes=minutes)
+
+            start_position = position
+            mileage = 0.0
+            points = []
+            if status == "driving":
+                position, heading, mileage, pings = drive(
+                    position, heading, minutes / 60, speed_mph, ping_interval, rng
+                )
+                points = [
+                    to_point(current_time + timedelta(seconds=offset), gps_dict((lat, lon)))
+                    for offset, lat, lon in pings
+                ]
+
+            entries.append(LogEntry(
+                log=trip_log,
+                status=status,
+                start_time=current_time,
+                end_time=end_time,
+                start_gps=gps_dict(start_position),
+                end_gps=gps_dict(position),
+                mileage=round(mileage, 2),
+                remarks=f"Auto-generated {status}",
+                automated=True,
+            ))
+            tracks.append(points)
+            current_time = end_time
+
+    return entries, position, heading, tracks
+
+
 def create_trip_log_and_entries(trip_id):
     try:
         trip = Trip.objects.get(id=trip_id)
@@ -26,52 +128,187 @@ def create_trip_log_and_entries(trip_id):
         ("on_duty", 3 * 60),     # 3 hours
     ]
 
-    # Driving distance simulation
-    total_miles = 250
-    driving_minutes = dict(status_blocks)["driving"]
-    miles_per_minute = total_miles / driving_minutes
-
-    # Set start time pointer, starting at 1:48:18 AM on the given date
-    current_time = timezone.make_aware(datetime(2025, 4, 5, 1, 48, 18))
-    start_time = None
-    end_time = None
-    for idx, (status, duration_minutes) in enumerate(status_blocks):
-        
-        
-        if idx == 0:
-            # For the first status, use the current_time as start_time
-            start_time = current_time
-        else:
-            # For subsequent statuses, the start time is the end time of the previous status
-            print(f"endtime",end_time)
-            start_time = end_time
-        
-        # Calculate the end time for this status
-        end_time = start_time + timedelta(minutes=duration_minutes)
-        print(f"starttime",start_time)
-        # If the status is "driving", calculate mileage
-        mileage = round(duration_minutes * miles_per_minute, 2) if status == "driving" else 0.0
-
-        # Create LogEntry
-        LogEntry.objects.create(
-            log=trip_log,
-            status=status,
-            start_time=start_time,
-            end_time=end_time,
-            start_gps={"lat": round(random.uniform(-90, 90), 6), "lon": round(random.uniform(-180, 180), 6)},
-            end_gps={"lat": round(random.uniform(-90, 90), 6), "lon": round(random.uniform(-180, 180), 6)},
-            mileage=mileage,
-            remarks=f"Auto-generated {status}",
-            automated=True
-        )
-
-    # Set trip log totals
-    trip_log.total_off_duty_hours = 4
-    trip_log.total_sleeper_hours = 6
-    trip_log.total_driving_hours = 5
-    trip_log.total_on_duty_hours = 3
-    trip_log.total_miles_driving_today = total_miles
-    trip_log.total_miles_today = total_miles
-    trip_log.save()
+    # Set start time pointer, starting at 1:48:18 AM on the log date
+    current_time = timezone.make_aware(datetime.combine(log_date, time(1, 48, 18)))
+
+    # Continue from where the trip's last entry ended, if any
+    last_entry = LogEntry.objects.filter(log__trip=trip).order_by("-id").first()
+    position = gps_coordinates(last_entry.end_gps or last_entry.start_gps) if last_entry else None
+    position = position or (round(random.uniform(30, 47), 6), round(random.uniform(-120, -75), 6))
+
+    entries, _, _, tracks = build_log_entries(trip_log, status_blocks, current_time, position)
+    with transaction.atomic():
+        LogEntry.objects.bulk_create(entries)
+        append_tracks({entry.id: points for entry, points in zip(entries, tracks)})
+
+    # Trip log totals come from the entries themselves
+    update_trip_log(trip_log.id)
 
     print(f"✅ TripLog and non-overlapping LogEntries created for Trip {trip_id}")
+
+
+def plan_day(rng):
+    """(status, minutes) blocks covering one 24h day in a plausible HOS pattern"""
+    if rng.random() < 1 / 7:
+        return [("off_duty", 24 * 60)]  # Rest day
+
+    blocks = []
+    shift_start = rng.randint(4 * 60, 8 * 60)
+    blocks.append(("off_duty", shift_start))
+    blocks.append(("on_duty", rng.randint(15, 45)))          # Pre-trip inspection
+    first_drive = rng.randint(3 * 60, 5 * 60 + 30)
+    blocks.append(("driving", first_drive))
+    blocks.append(("off_duty", 30))                          # 30-minute break
+    blocks.append(("driving", rng.randint(2 * 60, 11 * 60 - first_drive)))
+    blocks.append(("on_duty", rng.randint(15, 60)))          # Fuel / post-trip
+
+    used = sum(minutes for _, minutes in blocks)
+    rest_status = "sleeper" if rng.random() < 0.6 else "off_duty"
+    blocks.append((rest_status, 24 * 60 - used))
+    return blocks
+
+
+def day_totals(entries):
+    """TripLog hour and mileage columns for one day's unsaved entries"""
+    durations = {field: timedelta() for field in STATUS_HOUR_FIELDS.values()}
+    miles_today = 0.0
+    miles_driving = 0.0
+    for entry in entries:
+        durations[STATUS_HOUR_FIELDS[entry.status]] += entry.end_time - entry.start_time
+        miles_today += entry.mileage
+        if entry.status == "driving":
+            miles_driving += entry.mileage
+
+    totals = {field: timedelta_to_decimal(duration) for field, duration in durations.items()}
+    totals["total_miles_today"] = miles_to_decimal(miles_today)
+    totals["total_miles_driving_today"] = miles_to_decimal(miles_driving)
+    return totals
+
+
+def generate_fleet(drivers=10, days=28, ping_interval=60, max_entry_minutes=None,
+                   batch_size=5000, seed=None, driver_prefix="sim-driver", progress=None):
+    """Inserts a synthetic multi-driver, multi-week fleet with batched bulk inserts
+
+    Every driver runs back-to-back trips of 1-5 days ending today. Each day
+    follows plan_day(), GPS positions are contiguous across entries, days and
+    trips, and TripLog totals, rolling windows and DailyDutyRollup rows are
+    computed in memory with the same rules as update_trip_log. The simulated
+    pings of driving entries are stored as their tracks. Available hours are
+    then filled in by check_compliance. Returns row counts per model.
+
+    Raises ValueError if any of the generated driver ids already has trips;
+    use another `driver_prefix` to add a second fleet.
+    """
+    rng = random.Random(seed)
+    first_day = timezone.now().date() - timedelta(days=days - 1)
+    counts = {"trips": 0, "logs": 0, "entries": 0, "rollups": 0}
+    pending_entries = []
+    pending_tracks = []
+    driver_ids = [f"{driver_prefix}-{driver_index}" for driver_index in range(drivers)]
+
+    used = Trip.objects.filter(driver_id__in=driver_ids).values_list("driver_id", flat=True).first()
+    if used is not None:
+        raise ValueError(f"Driver prefix {driver_prefix!r} is already used ({used} has trips); pick another one")
+
+    def flush_entries():
+        with transaction.atomic():
+            LogEntry.objects.bulk_create(pending_entries, batch_size=batch_size)
+            append_tracks({entry.id: points for entry, points in zip(pending_entries, pending_tracks)})
+        counts["entries"] += len(pending_entries)
+        pending_entries.clear()
+        pending_tracks.clear()
+
+    for driver_index in range(drivers):
+        driver_id = driver_ids[driver_index]
+        position = (round(rng.uniform(30, 47), 6), round(rng.uniform(-120, -75), 6))
+        heading = rng.uniform(0, 360)
+        speed = rng.uniform(50, 65)
+
+        # Split the period into consecutive trips
+        trip_days = []
+        remaining = days
+        while remaining > 0:
+            length = min(remaining, rng.randint(1, 5))
+            trip_days.append(length)
+            remaining -= length
+
+        cycle_type = "60/7" if rng.random() < 0.2 else "70/8"
+        trips = Trip.objects.bulk_create([
+            Trip(
+                driver_id=driver_id,
+                from_location=f"Terminal {rng.randint(1, 50)}",
+                to_location=f"Consignee {rng.randint(1, 500)}",
+                carrier_name=f"Sim Carrier {driver_index % 20}",
+                main_office_address=f"{rng.randint(1, 9999)} Main St",
+                truck_number=f"T-{driver_index:05d}",
+                home_terminal_address=f"{rng.randint(1, 9999)} Depot Rd",
+                cycle_type=cycle_type,
+                status="completed" if n < len(trip_days) - 1 else "ongoing",
+                is_completed=n < len(trip_days) - 1,
+            )
+            for n in range(len(trip_days))
+        ])
+        counts["trips"] += len(trips)
+
+        # Build every day of this driver in memory, then insert logs before their entries
+        day_offset = 0
+        logs = []
+        day_entries = []
+        day_tracks = []
+        trip_miles = {}
+        on_duty_by_day = {}
+        rollups = []
+        for trip, length in zip(trips, trip_days):
+            trip_miles[trip.id] = 0.0
+            for _ in range(length):
+                log_date = first_day + timedelta(days=day_offset)
+                day_offset += 1
+                trip_log = TripLog(trip=trip, log_date=log_date)
+                start = timezone.make_aware(datetime.combine(log_date, time.min))
+                entries, position, heading, tracks = build_log_entries(
+                    trip_log, plan_day(rng), start, position, heading,
+                    speed_mph=speed, ping_interval=ping_interval,
+                    max_entry_minutes=max_entry_minutes, rng=rng,
+                )
+
+                totals = day_totals(entries)
+                on_duty_by_day[log_date] = totals["total_on_duty_hours"]
+                totals.update(rolling_totals(on_duty_by_day, log_date))
+                for field, value in totals.items():
+                    setattr(trip_log, field, value)
+
+                rollups.append(DailyDutyRollup(
+                    driver_id=driver_id, day=log_date,
+                    **{rollup: totals[field] for field, rollup in ROLLUP_FIELDS.items()},
+                ))
+                trip_miles[trip.id] += sum(entry.mileage for entry in entries)
+                logs.append(trip_log)
+                day_entries.append(entries)
+                day_tracks.append(tracks)
+
+        with transaction.atomic():
+            TripLog.objects.bulk_create(logs, batch_size=batch_size)
+            DailyDutyRollup.objects.bulk_create(rollups, batch_size=batch_size)
+            for trip in trips:
+                trip.total_mileage = Decimal(str(round(trip_miles[trip.id], 2)))
+            Trip.objects.bulk_update(trips, ["total_mileage"], batch_size=batch_size)
+
+        counts["logs"] += len(logs)
+        counts["rollups"] += len(rollups)
+
+        for trip_log, entries, tracks in zip(logs, day_entries, day_tracks):
+            for entry in entries:
+                entry.log = trip_log  # Picks up the id assigned by bulk_create
+            pending_entries.extend(entries)
+            pending_tracks.extend(tracks)
+            if len(pending_entries) >= batch_size:
+                flush_entries()
+
+        if progress:
+            progress(driver_index + 1, counts)
+
+    if pending_entries:
+        flush_entries()
+    # Available hours (and violations, recaps) come from the compliance engine, as for live logs
+    check_compliance(first_day, timezone.now().date(), driver_ids=driver_ids)
+    return counts
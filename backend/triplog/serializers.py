@@ -1,6 +1,6 @@
 # backend/triplog/serializers.py
 from rest_framework import serializers
-from .models import CustomUser, Trip, TripLog, LogEntry, TripCompletion
+from .models import CustomUser, Trip, TripLog, LogEntry, TripCompletion, HosViolation
 from django.contrib.auth.password_validation import validate_password
 
 class UserSerializer(serializers.ModelSerializer):
@@ -38,7 +38,18 @@ class LogEntrySerializer(serializers.ModelSerializer):
         model = LogEntry
         fields = '__all__'
 
+class TripLogTreeSerializer(TripLogSerializer):
+    log_entries = LogEntrySerializer(many=True, read_only=True)
+
+class TripTreeSerializer(TripSerializer):
+    logs = TripLogTreeSerializer(many=True, read_only=True)
+
 class TripCompletionSerializer(serializers.ModelSerializer):
     class Meta:
         model = TripCompletion
         fields = '__all__'
+
+class HosViolationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = HosViolation
+        fields = '__all__'
@@ -1,3 +1,2056 @@
-from django.test import TestCase
+from concurrent.futures import Future
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from triplog.models import (
+    Trip, TripLog, LogEntry, DailyDutyRollup, HosViolation, TripCompletion, IngestCursor, TrackSegment,
+)
+from triplog.aggregation import ROLLING_WINDOWS, STATUS_HOUR_FIELDS
+from triplog.aggregation import update_trip_log, rebuild_driver_days, apply_open_entry_delta
+from triplog.aggregation import miles_to_decimal, timedelta_to_decimal
+from triplog.async_http import AsyncHTTPPool, HTTPError
+from triplog.distance import DistanceService, haversine_miles, reset_distance_service, set_distance_service
+from triplog.ingest import MAX_BATCH_SIZE, PingBatch, StaleBatch, ingest_pings, parse_ping
+from triplog.ingest_queue import IngestQueue, drain_once, ingest_events, set_ingest_queue
+from triplog.response_cache import bump, response_cache, scope_versions, trip_scope, log_scope
+from triplog.events import LocalBroker, set_broker
+from triplog.authentication import user_cache
+from triplog.models import CustomUser
+from triplog.benchmark import StubDistanceService, compare, load_results
+from triplog import geometry, metrics, routing, tracks
+from triplog.routing import RoadGraph
+from triplog.scripts import generate_fleet
+from triplog.compliance import check_compliance
+from triplog.recompute import recompute, recompute_drivers
+from triplog import planner, logsheet
+import asyncio
+import csv
+import io
+import json
+import re
+import tempfile
+import struct
+import subprocess
+import threading
+import time
+import os
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+
+# The response cache is process-local in tests, so they never touch the directory running workers share
+local_response_cache = override_settings(CACHES={
+    **settings.CACHES,
+    "responses": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "triplog-test-responses"},
+})
+
+
+@local_response_cache
+class TriplogTestCase(TestCase):
+    """Starts every test with an empty response cache, since row ids repeat across tests"""
+
+    def setUp(self):
+        super().setUp()
+        response_cache().clear()
+
+
+class StubOSRMHandler(BaseHTTPRequestHandler):
+    """Answers every route request with a fixed distance, optionally after a delay"""
+    distance_meters = 16093.4
+    delay = 0
+    hits = 0
+
+    def do_GET(self):
+        type(self).hits += 1
+        time.sleep(self.delay)
+        body = json.dumps({"code": "Ok", "routes": [{"distance": self.distance_meters}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubOSRMServerMixin:
+    """Runs StubOSRMHandler on a free local port at self.url for each test"""
+
+    def setUp(self):
+        super().setUp()
+        StubOSRMHandler.hits = 0
+        StubOSRMHandler.delay = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubOSRMHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+
+class DistanceServiceTests(StubOSRMServerMixin, SimpleTestCase):
+    start = {"latitude": 40.7128, "longitude": -74.0060}
+    end = {"latitude": 40.7306, "longitude": -73.9352}
+
+    def test_routed_distance_is_cached(self):
+        service = DistanceService(OSRM_URL=self.url)
+        self.assertAlmostEqual(service.distance(self.start, self.end), 10.0)
+        self.assertAlmostEqual(service.distance(self.start, self.end), 10.0)
+        self.assertEqual(StubOSRMHandler.hits, 1)
+
+    def test_nearby_points_share_a_cache_entry(self):
+        service = DistanceService(OSRM_URL=self.url)
+        service.distance(self.start, self.end)
+        service.distance({"lat": 40.71281, "lon": -74.00601}, self.end)
+        self.assertEqual(StubOSRMHandler.hits, 1)
+
+    def test_missing_gps_is_zero(self):
+        service = DistanceService(OSRM_URL=self.url)
+        self.assertEqual(service.distance({}, self.end), 0)
+        self.assertEqual(StubOSRMHandler.hits, 0)
+
+    def test_slow_backend_falls_back_to_estimate(self):
+        StubOSRMHandler.delay = 0.5
+        service = DistanceService(OSRM_URL=self.url, READ_TIMEOUT=0.1, FALLBACK_ROAD_FACTOR=1.0)
+        started = time.monotonic()
+        miles = service.distance(self.start, self.end)
+        self.assertLess(time.monotonic() - started, 0.5)
+        expected = haversine_miles(40.7128, -74.006, 40.7306, -73.9352)
+        self.assertAlmostEqual(miles, expected, places=3)
+
+        # Within the backoff window the backend is not asked again
+        service.distance(self.start, {"latitude": 41.0, "longitude": -74.0})
+        self.assertEqual(StubOSRMHandler.hits, 1)
+
+    def test_persistent_cache_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "distances.sqlite3")
+            DistanceService(OSRM_URL=self.url, PERSISTENT_CACHE=path).distance(self.start, self.end)
+            restarted = DistanceService(OSRM_URL=self.url, PERSISTENT_CACHE=path)
+            self.assertAlmostEqual(restarted.distance(self.start, self.end), 10.0)
+            self.assertEqual(StubOSRMHandler.hits, 1)
+
+
+class AggregationTests(TriplogTestCase):
+    totals = [*STATUS_HOUR_FIELDS.values(), "total_miles_driving_today", "total_miles_today"]
+    start = datetime(2026, 3, 2, 6, tzinfo=dt_timezone.utc)
+
+    @classmethod
+    def setUpTestData(cls):
+        trip = Trip.objects.create(
+            driver_id="driver", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+        )
+        cls.log = TripLog.objects.create(trip=trip, log_date=cls.start.date())
+
+    def entries(self, blocks):
+        """Consecutive (status, minutes, miles) entries from self.start, the last one left open"""
+        at = self.start
+        created = []
+        for index, (status, minutes, miles) in enumerate(blocks):
+            end = at + timedelta(minutes=minutes)
+            created.append(LogEntry.objects.create(
+                log=self.log, status=status, start_time=at, end_time=end if index < len(blocks) - 1 else None,
+                mileage=miles,
+            ))
+            at = end
+        return created
+
+    def recomputed(self):
+        """The total columns summed entry by entry, as the per-status loops did before the aggregate"""
+        hours = {field: timedelta() for field in STATUS_HOUR_FIELDS.values()}
+        miles = driving = 0.0
+        for entry in LogEntry.objects.filter(log=self.log):
+            if entry.end_time is not None:
+                hours[STATUS_HOUR_FIELDS[entry.status]] += entry.end_time - entry.start_time
+            miles += entry.mileage
+            if entry.status == "driving":
+                driving += entry.mileage
+        expected = {field: timedelta_to_decimal(duration) for field, duration in hours.items()}
+        expected["total_miles_driving_today"] = miles_to_decimal(driving)
+        expected["total_miles_today"] = miles_to_decimal(miles)
+        return expected
+
+    def stored(self):
+        return TripLog.objects.filter(id=self.log.id).values(*self.totals).get()
+
+    def test_single_pass_matches_entry_by_entry_totals(self):
+        self.entries([
+            ("on_duty", 45, 0.0), ("driving", 250, 210.4), ("off_duty", 30, 0.0), ("driving", 185, 151.25),
+            ("sleeper", 480, 0.0), ("on_duty", 20, 1.5), ("driving", 10, 7.0),
+        ])
+        update_trip_log(self.log.id)
+        expected = self.recomputed()
+        self.assertEqual(self.stored(), expected)
+        self.assertEqual(expected["total_driving_hours"], Decimal("7.25"))
+        self.assertEqual(expected["total_sleeper_hours"], Decimal("8.00"))
+        self.assertEqual(expected["total_miles_driving_today"], Decimal("368.65"))
+
+    def test_open_entry_delta_matches_a_full_recompute(self):
+        for status in ("driving", "on_duty"):
+            with self.subTest(status=status):
+                LogEntry.objects.filter(log=self.log).delete()
+                *_, open_entry = self.entries([("off_duty", 60, 0.0), ("driving", 90, 80.0), (status, 5, 2.0)])
+                update_trip_log(self.log.id)
+
+                # Pings on the open entry only move its mileage
+                for miles in (0.4, 12.345, 3.005):
+                    LogEntry.objects.filter(id=open_entry.id).update(mileage=F("mileage") + miles)
+                    apply_open_entry_delta(self.log.id, status, miles)
+                incremental = self.stored()
+                self.assertEqual(incremental, self.recomputed())
+
+                update_trip_log(self.log.id)
+                self.assertEqual(self.stored(), incremental)
+
+    def test_driving_mileage_change_moves_both_mileage_columns(self):
+        _, driving, _ = self.entries([("on_duty", 30, 0.0), ("driving", 120, 100.0), ("off_duty", 10, 0.0)])
+        update_trip_log(self.log.id)
+        LogEntry.objects.filter(id=driving.id).update(mileage=95.5)
+        update_trip_log(self.log.id)
+        self.assertEqual(self.stored(), self.recomputed())
+        self.assertEqual(self.stored()["total_miles_driving_today"], Decimal("95.50"))
+
+
+class HotQueryPlanTests(TriplogTestCase):
+    """EXPLAIN QUERY PLAN for every statement on the ingest and read hot paths
+
+    A plan step that scans a triplog table instead of searching an index, or
+    sorts its ORDER BY through a temp b-tree, fails the test.
+    """
+    hot_tables = ("triplog_trip", "triplog_triplog", "triplog_logentry", "triplog_dailydutyrollup")
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trips = [
+            Trip.objects.create(
+                driver_id=f"driver-{i % 2}", from_location="A", to_location="B", carrier_name="Carrier",
+                main_office_address="Office", truck_number=str(i), home_terminal_address="Terminal",
+                status="completed" if i else "ongoing",
+            )
+            for i in range(3)
+        ]
+        start = timezone.now() - timedelta(days=3)
+        cls.logs = []
+        for trip in cls.trips:
+            for day in range(3):
+                log = TripLog.objects.create(trip=trip, log_date=(start + timedelta(days=day)).date())
+                cls.logs.append(log)
+                for n, status in enumerate(["off_duty", "driving", "on_duty"]):
+                    LogEntry.objects.create(
+                        log=log, status=status,
+                        start_time=start + timedelta(days=day, hours=n),
+                        end_time=start + timedelta(days=day, hours=n + 1),
+                        start_gps={"latitude": 40.0, "longitude": -74.0},
+                        end_gps={"latitude": 40.0, "longitude": -74.0},
+                        mileage=10.0,
+                    )
+
+    def setUp(self):
+        super().setUp()
+        reset_distance_service()
+        self.addCleanup(reset_distance_service)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertNoFullScans(self, queries):
+        if connection.vendor != "sqlite":
+            self.skipTest("Plan assertions are written against SQLite's EXPLAIN QUERY PLAN")
+
+        checked = 0
+        for query in queries:
+            sql = query["sql"]
+            if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                continue
+            checked += 1
+            for step in self.explain(sql):
+                scan = re.match(r"SCAN (\w+)", step)
+                if scan and scan.group(1) in self.hot_tables:
+                    self.fail(f"Full scan of {scan.group(1)} ({step}) in:\n{sql}")
+                if "USE TEMP B-TREE FOR ORDER BY" in step:
+                    self.fail(f"Sort without an index ({step}) in:\n{sql}")
+        self.assertGreater(checked, 0)
+
+    def capture(self, fn, *args, **kwargs):
+        with CaptureQueriesContext(connection) as ctx:
+            fn(*args, **kwargs)
+        return ctx.captured_queries
+
+    def test_update_trip_log(self):
+        self.assertNoFullScans(self.capture(update_trip_log, self.logs[4].id))
+
+    def test_ingest_status_change_and_extension(self):
+        with self.settings(DISTANCE_SERVICE={"OSRM_URL": "http://127.0.0.1:9", "CONNECT_TIMEOUT": 0.01}):
+            pings = [
+                {"log_id": self.logs[4].id, "status": "on_duty", "timestamp": timezone.now(),
+                 "gps": {"latitude": 40.1, "longitude": -74.0}},
+                {"log_id": self.logs[5].id, "status": "driving", "timestamp": timezone.now(),
+                 "gps": {"latitude": 40.1, "longitude": -74.0}},
+            ]
+            self.assertNoFullScans(self.capture(ingest_pings, pings))
+
+    def test_log_entries_by_log(self):
+        self.assertNoFullScans(self.capture(self.client.get, f"/api/logs/log-entries/{self.logs[0].id}/"))
+
+    def test_logs_by_trip(self):
+        self.assertNoFullScans(self.capture(self.client.get, f"/api/trip/logs/{self.trips[0].id}/"))
+
+    def test_paginated_lists(self):
+        for url in ("/api/log-entries/", "/api/logs/", "/api/trips/"):
+            first = self.client.get(url, {"page_size": 2}).json()
+            self.assertNoFullScans(self.capture(self.client.get, first["next"]))
+
+    def test_trip_end(self):
+        self.assertNoFullScans(self.capture(self.client.post, f"/api/trip-completion/{self.trips[0].id}/"))
+
+    def test_rebuild_driver_days(self):
+        days = [log.log_date for log in self.logs[:3]]
+        self.assertNoFullScans(self.capture(rebuild_driver_days, "driver-0", days))
+
+
+class KeysetPaginationTests(TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        trip = Trip.objects.create(
+            driver_id="driver", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+        )
+        cls.log = TripLog.objects.create(trip=trip, log_date=timezone.now().date())
+        start = timezone.now()
+        # Ties on start_time and a NULL start_time must neither repeat nor skip rows
+        times = [None, start, start, start, start + timedelta(minutes=1), start + timedelta(minutes=2), None]
+        for start_time in times:
+            LogEntry.objects.create(log=cls.log, status="driving", start_time=start_time)
+        cls.expected = list(
+            LogEntry.objects.order_by(F("start_time").asc(nulls_first=True), "id").values_list("id", flat=True)
+        )
+
+    def walk(self, url, direction):
+        ids = []
+        while url:
+            page = self.client.get(url).json()
+            ids.extend(entry["id"] for entry in page["results"])
+            last_page = page
+            url = page[direction]
+        return ids, last_page
+
+    def test_forward_and_backward_traversal(self):
+        forward, last_page = self.walk("/api/log-entries/?page_size=2", "next")
+        self.assertEqual(forward, self.expected)
+
+        backward = []
+        url = last_page["previous"]
+        while url:
+            page = self.client.get(url).json()
+            backward = [entry["id"] for entry in page["results"]] + backward
+            url = page["previous"]
+        self.assertEqual(backward + [entry["id"] for entry in last_page["results"]], self.expected)
+
+    def test_page_size_is_capped(self):
+        with self.settings(API_MAX_PAGE_SIZE=3):
+            page = self.client.get("/api/log-entries/", {"page_size": 1000}).json()
+        self.assertEqual(len(page["results"]), 3)
+        self.assertIsNotNone(page["next"])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get("/api/log-entries/", {"cursor": "garbage"}).status_code, 404)
+
+    def test_by_parent_endpoints_stay_plain_arrays(self):
+        # The client reads these as arrays
+        entries = self.client.get(f"/api/logs/log-entries/{self.log.id}/", {"page_size": 2}).json()
+        self.assertEqual([entry["id"] for entry in entries], self.expected)
+        logs = self.client.get(f"/api/trip/logs/{self.log.trip_id}/").json()
+        self.assertEqual([log["id"] for log in logs], [self.log.id])
+
+
+class TripTreeTests(TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(
+            driver_id="driver", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+        )
+        cls.today = timezone.now().date()
+        for day in range(5):
+            log = TripLog.objects.create(trip=cls.trip, log_date=cls.today - timedelta(days=day))
+            for status in ("off_duty", "driving"):
+                LogEntry.objects.create(log=log, status=status)
+
+    def test_query_count_is_constant(self):
+        # Trip, logs and entries, plus the three ETag lookups
+        with self.assertNumQueries(6):
+            tree = self.client.get(f"/api/trips/{self.trip.id}/tree/").json()
+        self.assertEqual(len(tree["logs"]), 5)
+        self.assertEqual([len(log["log_entries"]) for log in tree["logs"]], [2] * 5)
+
+    def test_date_range(self):
+        start = (self.today - timedelta(days=1)).isoformat()
+        tree = self.client.get(f"/api/trips/{self.trip.id}/tree/", {"start": start}).json()
+        self.assertEqual([log["log_date"] for log in tree["logs"]], [start, self.today.isoformat()])
+        self.assertEqual(self.client.get(f"/api/trips/{self.trip.id}/tree/", {"end": "soon"}).status_code, 400)
+
+
+class ConditionalGetTests(TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(
+            driver_id="driver", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+        )
+        cls.log = TripLog.objects.create(trip=cls.trip, log_date=timezone.now().date())
+        cls.entry = LogEntry.objects.create(log=cls.log, status="driving")
+
+    def assertRevalidates(self, url, change):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        etag = first["ETag"]
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        response_cache().clear()  # Validators are under test here, not cache invalidation
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail(self):
+        self.assertIn("Last-Modified", self.client.get(f"/api/trips/{self.trip.id}/"))
+        self.assertRevalidates(
+            f"/api/log-entries/{self.entry.id}/",
+            lambda: self.client.patch(f"/api/log-entries/{self.entry.id}/", {"remarks": "x"}, content_type="application/json"),
+        )
+
+    def test_list_sees_new_rows(self):
+        self.assertRevalidates(
+            f"/api/logs/log-entries/{self.log.id}/",
+            lambda: LogEntry.objects.create(log=self.log, status="on_duty"),
+        )
+
+    def test_list_sees_deletes(self):
+        self.assertRevalidates(f"/api/trip/logs/{self.trip.id}/", lambda: self.log.delete())
+
+    def test_tree_sees_aggregate_updates(self):
+        self.assertRevalidates(
+            f"/api/trips/{self.trip.id}/tree/",
+            lambda: self.client.post("/api/logs/log-end", {"log": self.log.id, "remarks": "done"}, content_type="application/json"),
+        )
+
+    def test_missing_object_is_404(self):
+        self.assertEqual(self.client.get("/api/trips/9999/").status_code, 404)
+
+
+class ResponseCacheTests(TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(
+            driver_id="driver", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+        )
+        cls.log = TripLog.objects.create(trip=cls.trip, log_date=timezone.now().date())
+        cls.entry = LogEntry.objects.create(log=cls.log, status="driving")
+
+    def setUp(self):
+        super().setUp()
+        reset_distance_service()
+        self.addCleanup(reset_distance_service)
+
+    def assertInvalidatedBy(self, url, write):
+        before = self.client.get(url).json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json(), before)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        self.assertGreater(len(ctx.captured_queries), 0)
+
+    def test_entries_by_log_after_ping(self):
+        self.assertInvalidatedBy(
+            f"/api/logs/log-entries/{self.log.id}/",
+            lambda: self.client.post("/api/update-log-entry/", {
+                "logId": self.log.id, "status": "on_duty", "timestamp": timezone.now().isoformat(), "gps": {},
+            }, content_type="application/json"),
+        )
+
+    def test_logs_by_trip_after_log_end(self):
+        self.assertInvalidatedBy(
+            f"/api/trip/logs/{self.trip.id}/",
+            lambda: self.client.post("/api/logs/log-end", {"log": self.log.id, "remarks": "done"},
+                                     content_type="application/json"),
+        )
+
+    def test_trip_detail_after_trip_end(self):
+        self.assertInvalidatedBy(
+            f"/api/trips/{self.trip.id}/",
+            lambda: self.client.post(f"/api/trip-completion/{self.trip.id}/"),
+        )
+
+    def test_tree_after_entry_delete(self):
+        self.assertInvalidatedBy(
+            f"/api/trips/{self.trip.id}/tree/",
+            lambda: self.client.delete(f"/api/log-entries/{self.entry.id}/"),
+        )
+
+    def test_other_trips_stay_cached(self):
+        url = f"/api/trips/{self.trip.id}/"
+        self.client.get(url)
+        other = Trip.objects.create(
+            driver_id="other", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="2", home_terminal_address="Terminal",
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/api/trip-completion/{other.id}/")
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+    def test_default_backend_is_shared_by_workers(self):
+        # Invalidations go through the cache, so a per-process one leaves other workers stale
+        from backend import settings as project_settings
+        self.assertNotIn("locmem", project_settings.CACHES["responses"]["BACKEND"])
+
+    def test_bump_never_reads_the_old_generation(self):
+        # A read-modify-write lets two workers bumping together land on one generation
+        scope = trip_scope(self.trip.id)
+        before = scope_versions([scope])
+        cache = response_cache()
+        with mock.patch.object(cache, "incr", side_effect=AssertionError), \
+                mock.patch.object(cache, "get", side_effect=AssertionError):
+            bump(scope)
+        self.assertNotEqual(scope_versions([scope]), before)
+
+
+class ExportTests(TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.now().date()
+        for driver in ("a", "b"):
+            trip = Trip.objects.create(
+                driver_id=driver, from_location="A", to_location="B", carrier_name="Carrier",
+                main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+            )
+            for day in range(3):
+                log = TripLog.objects.create(trip=trip, log_date=cls.today - timedelta(days=day))
+                LogEntry.objects.create(log=log, status="driving", start_gps={"lat": 1.0, "lon": 2.0})
+
+    def stream(self, url, params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_for_one_driver_and_range(self):
+        body = self.stream("/api/export/log-entries/", {"driver": "a", "start": (self.today - timedelta(days=1)).isoformat()})
+        rows = list(csv.reader(body.splitlines()))
+        self.assertEqual(rows[0][:3], ["driver_id", "trip_id", "log_id"])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual({row[0] for row in rows[1:]}, {"a"})
+        self.assertEqual(json.loads(rows[1][9]), {"lat": 1.0, "lon": 2.0})
+
+    def test_ndjson_fleet(self):
+        lines = self.stream("/api/export/logs/", {"output": "ndjson"}).splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(json.loads(lines[0])["log_date"], (self.today - timedelta(days=2)).isoformat())
+
+    def test_management_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "entries.ndjson")
+            call_command("export_logs", "log-entries", "--format", "ndjson", "--driver", "b", "-o", path, stderr=io.StringIO())
+            with open(path) as fh:
+                self.assertEqual(len(fh.readlines()), 3)
+
+
+class GenerateFleetTests(TriplogTestCase):
+    def test_generated_totals_match_recompute(self):
+        call_command("generate_fleet", "--drivers", "2", "--days", "10", "--seed", "7",
+                     "--max-entry-minutes", "120", stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Trip.objects.values("driver_id").distinct().count(), 2)
+        self.assertEqual(TripLog.objects.count(), 20)
+        self.assertEqual(DailyDutyRollup.objects.count(), 20)
+
+        columns = ["total_driving_hours", "total_on_duty_hours", "total_miles_today",
+                   "total_on_duty_hours_last_8_days"]
+        generated = {row[0]: row[1:] for row in TripLog.objects.values_list("id", *columns)}
+        for log_id in generated:
+            update_trip_log(log_id)
+        recomputed = {row[0]: row[1:] for row in TripLog.objects.values_list("id", *columns)}
+        self.assertEqual(generated, recomputed)
+
+        # Each day covers 24 hours with a contiguous track
+        log = TripLog.objects.order_by("id").first()
+        entries = list(log.log_entries.order_by("start_time"))
+        self.assertEqual(entries[-1].end_time - entries[0].start_time, timedelta(hours=24))
+        for previous, entry in zip(entries, entries[1:]):
+            self.assertEqual(previous.end_time, entry.start_time)
+            self.assertEqual(previous.end_gps, entry.start_gps)
+
+    def test_driving_entries_get_their_tracks(self):
+        generate_fleet(drivers=1, days=2, ping_interval=300, seed=3)
+
+        driving = LogEntry.objects.filter(status="driving")
+        self.assertTrue(driving.exists())
+        for entry in driving:
+            points = tracks.fetch_track(entry.id)
+            for point, timestamp, gps in ((points[0], entry.start_time, entry.start_gps),
+                                          (points[-1], entry.end_time, entry.end_gps)):
+                self.assertEqual(point[0], int(timestamp.timestamp() * 1000))
+                self.assertAlmostEqual(point[1], gps["latitude"], places=6)
+                self.assertAlmostEqual(point[2], gps["longitude"], places=6)
+        self.assertFalse(TrackSegment.objects.exclude(entry__status="driving").exists())
+
+    def test_rejects_a_used_driver_prefix(self):
+        generate_fleet(drivers=1, days=2, seed=3)
+        counts = (Trip.objects.count(), LogEntry.objects.count(), DailyDutyRollup.objects.count())
+
+        with self.assertRaises(CommandError):
+            call_command("generate_fleet", "--drivers", "2", "--days", "2",
+                         stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual((Trip.objects.count(), LogEntry.objects.count(), DailyDutyRollup.objects.count()), counts)
+
+        generate_fleet(drivers=1, days=2, seed=3, driver_prefix="other-driver")
+        self.assertEqual(Trip.objects.values("driver_id").distinct().count(), 2)
+
+
+@local_response_cache
+class BenchmarkTests(TransactionTestCase):
+    # The benchmark commits on a copy of the database, so it cannot run inside a test transaction
+
+    def test_runs_every_case_on_a_throwaway_copy(self):
+        generate_fleet(drivers=2, days=3, seed=1)
+        counts = (TripLog.objects.count(), LogEntry.objects.count())
+        response_cache().set("live", 1)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.json")
+            call_command("benchmark", "--iterations", "3", "--warmup", "1", "-o", path,
+                         stdout=io.StringIO(), stderr=io.StringIO())
+            results = load_results(path)
+
+        self.assertIn("update-log-entry", results["results"])
+        self.assertIn("trip-detail", results["results"])
+        for name, stats in results["results"].items():
+            self.assertEqual(stats["errors"], 0, name)
+            self.assertEqual(stats["calls"], 3)
+            self.assertGreater(stats["queries_per_call"], 0)
+        self.assertEqual((TripLog.objects.count(), LogEntry.objects.count()), counts)
+        self.assertEqual(response_cache().get("live"), 1)
+        self.assertEqual(compare(results, results)[0][4], 0.0)
+
+
+class MetricsTests(TriplogTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+
+    def sample(self, body, name, **labels):
+        label_text = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+        match = re.search(rf"^{re.escape(name)}\{{{re.escape(label_text)}\}} (\S+)$", body, re.M)
+        return float(match.group(1)) if match else None
+
+    def test_requests_are_recorded_per_url_name(self):
+        self.client.get("/api/trips/")
+        self.client.get("/api/trips/")
+        self.client.get("/api/no-such-route/")
+
+        with self.settings(METRICS={"TOKEN": "scrape"}):
+            response = self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer scrape")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+
+        self.assertIn("# TYPE triplog_http_request_duration_seconds histogram", body)
+        self.assertEqual(self.sample(body, "triplog_http_requests_total",
+                                     endpoint="trip-list-create", method="GET", status="200"), 2)
+        self.assertEqual(self.sample(body, "triplog_http_requests_total",
+                                     endpoint="unmatched", method="GET", status="404"), 1)
+        self.assertEqual(self.sample(body, "triplog_http_request_duration_seconds_bucket",
+                                     endpoint="trip-list-create", le="+Inf", method="GET"), 2)
+        self.assertGreater(self.sample(body, "triplog_db_queries_total", endpoint="trip-list-create"), 0)
+
+    async def test_sync_views_count_queries_under_asgi(self):
+        response = await self.async_client.get("/api/trips/")
+        self.assertEqual(response.status_code, 200)
+
+        body = metrics.render(metrics.collect())
+        self.assertGreater(self.sample(body, "triplog_db_queries_total", endpoint="trip-list-create"), 0)
+
+    def test_endpoint_needs_the_configured_token(self):
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 404)
+        with self.settings(METRICS={"TOKEN": "scrape"}):
+            self.assertEqual(self.client.get("/api/metrics/").status_code, 401)
+            self.assertEqual(self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer guess").status_code, 401)
+
+    def test_workers_are_merged_through_the_directory(self):
+        other_worker = [["triplog_http_requests_total",
+                         [["endpoint", "trip-list-create"], ["method", "GET"], ["status", "200"]], 3]]
+        dead = subprocess.Popen(["true"])
+        dead.wait()  # Reaped, so its pid belongs to no running process
+        with tempfile.TemporaryDirectory() as tmp, self.settings(METRICS={"DIRECTORY": tmp}):
+            self.client.get("/api/trips/")
+            for pid in (os.getppid(), dead.pid):
+                with open(os.path.join(tmp, f"metrics-{pid}.json"), "w") as fh:
+                    json.dump(other_worker, fh)
+
+            body = metrics.render(metrics.collect())
+            self.assertFalse(os.path.exists(os.path.join(tmp, f"metrics-{dead.pid}.json")))
+        self.assertEqual(self.sample(body, "triplog_http_requests_total",
+                                     endpoint="trip-list-create", method="GET", status="200"), 4)
+
+    def test_routing_calls_are_attributed_to_the_request(self):
+        metrics.record_routing_call(0.25)
+        body = metrics.render(metrics.collect())
+        self.assertEqual(self.sample(body, "triplog_routing_calls_total", endpoint="background"), 1)
+        self.assertEqual(self.sample(body, "triplog_routing_call_duration_seconds_total", endpoint="background"), 0.25)
+
+
+class BatchIngestTests(TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(
+            driver_id="driver", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+        )
+        cls.log = TripLog.objects.create(trip=cls.trip, log_date=timezone.now().date())
+        cls.other_log = TripLog.objects.create(trip=cls.trip, log_date=timezone.now().date())
+
+    def setUp(self):
+        super().setUp()
+        self.service = StubDistanceService()
+        self.addCleanup(set_distance_service, set_distance_service(self.service))
+        self.start = timezone.now().replace(microsecond=0)
+
+    def ping(self, minute, status="driving", log=None):
+        return {
+            "logId": (log or self.log).id, "status": status,
+            "timestamp": (self.start + timedelta(minutes=minute)).isoformat(),
+            "gps": {"latitude": 40.0 + minute / 100, "longitude": -90.0},
+        }
+
+    def post(self, body):
+        return self.client.post("/api/update-log-entries/", body, content_type="application/json")
+
+    def miles(self, *latitudes):
+        return sum(self.service.estimate((a, -90.0), (b, -90.0)) for a, b in zip(latitudes, latitudes[1:]))
+
+    def test_same_status_pings_fold_into_one_entry(self):
+        response = self.post([self.ping(minute) for minute in range(5)] + [self.ping(5, "on_duty")])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["processed"], response.json()["entries_created"]), (6, 2))
+
+        driving, on_duty = LogEntry.objects.filter(log=self.log).order_by("id")
+        self.assertEqual((driving.status, on_duty.status), ("driving", "on_duty"))
+        self.assertEqual(driving.end_time, self.start + timedelta(minutes=5))
+        self.assertIsNone(on_duty.end_time)
+        self.assertAlmostEqual(driving.mileage, self.miles(40.0, 40.05), places=6)
+
+    def test_batch_spans_several_logs(self):
+        response = self.post({"pings": [
+            self.ping(0), self.ping(0, log=self.other_log), self.ping(1), self.ping(2, "sleeper", self.other_log),
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["entries_created"], 3)
+        self.assertEqual(LogEntry.objects.filter(log=self.log).count(), 1)
+        self.assertEqual(
+            list(LogEntry.objects.filter(log=self.other_log).order_by("id").values_list("status", flat=True)),
+            ["driving", "sleeper"],
+        )
+        self.trip.refresh_from_db()
+        self.assertAlmostEqual(float(self.trip.total_mileage), self.miles(40.0, 40.01) + self.miles(40.0, 40.02), places=2)
+
+    def test_size_cap_and_per_index_errors(self):
+        too_many = self.post([self.ping(0)] * (MAX_BATCH_SIZE + 1))
+        self.assertEqual(too_many.status_code, 400)
+        self.assertEqual(too_many.json(), {"error": f"At most {MAX_BATCH_SIZE} pings per batch"})
+        self.assertEqual(self.post([self.ping(0)] * MAX_BATCH_SIZE).status_code, 200)
+
+        bad_status = self.post([self.ping(10), {**self.ping(11), "status": "flying"}])
+        self.assertEqual((bad_status.status_code, bad_status.json()), (400, {"error": "Invalid status 'flying'", "index": 1}))
+        missing = self.post([self.ping(10), self.ping(11), {**self.ping(12), "logId": 0}])
+        self.assertEqual((missing.status_code, missing.json()), (404, {"error": "TripLog not found", "index": 2}))
+        self.assertEqual(self.post([]).status_code, 400)
+        # Nothing of a rejected batch is written
+        self.assertEqual(LogEntry.objects.get(log=self.log).end_gps["latitude"], 40.0)
+
+    def test_concurrent_batches_on_one_entry_keep_both(self):
+        ingest_pings([parse_ping(self.ping(0))])
+        stale = PingBatch([parse_ping(self.ping(1))])
+        ingest_pings([parse_ping(self.ping(2))])
+        with self.assertRaises(StaleBatch):
+            stale.write(self.service.distances(stale.hop_pairs()))
+
+        # A batch overtaken between folding and writing is folded again on the new row
+        overtaken = [False]
+        distances = self.service.distances
+
+        def race(pairs):
+            if not overtaken[0]:
+                overtaken[0] = True
+                ingest_pings([parse_ping(self.ping(3))])
+            return distances(pairs)
+
+        with mock.patch.object(self.service, "distances", side_effect=race):
+            ingest_pings([parse_ping(self.ping(4))])
+
+        entry = LogEntry.objects.get(log=self.log)
+        self.assertAlmostEqual(entry.mileage, self.miles(40.0, 40.02, 40.03, 40.04), places=6)
+        self.trip.refresh_from_db()
+        self.assertAlmostEqual(float(self.trip.total_mileage), entry.mileage, places=2)
+
+
+class IngestQueueTests(TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(
+            driver_id="driver", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+        )
+        cls.log = TripLog.objects.create(trip=cls.trip, log_date=timezone.now().date())
+        cls.other_log = TripLog.objects.create(trip=cls.trip, log_date=timezone.now().date())
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.queue = IngestQueue(os.path.join(directory.name, "queue.sqlite3"), lease_seconds=60, max_attempts=2)
+        self.addCleanup(set_ingest_queue, set_ingest_queue(self.queue))
+        previous = set_distance_service(StubDistanceService())
+        self.addCleanup(set_distance_service, previous)
+        self.start = timezone.now().replace(microsecond=0)
+
+    def ping(self, minute, log=None, status="driving"):
+        return {
+            "log_id": (log or self.log).id, "status": status, "timestamp": self.start + timedelta(minutes=minute),
+            "gps": {"latitude": 40.0 + minute / 100, "longitude": -90.0},
+        }
+
+    def payload(self, ping):
+        return {"logId": ping["log_id"], "status": ping["status"], "timestamp": ping["timestamp"].isoformat(),
+                "gps": ping["gps"]}
+
+    def later(self, seconds):
+        return mock.patch("triplog.ingest_queue.time.time", return_value=time.time() + seconds)
+
+    def trip_total(self):
+        self.trip.refresh_from_db()
+        return float(self.trip.total_mileage)
+
+    def test_enqueue_claim_ack_release(self):
+        self.assertEqual(self.queue.enqueue([self.ping(0), self.ping(1)]), 2)
+        log_id, events = self.queue.claim("w1")
+        self.assertEqual(log_id, self.log.id)
+        self.assertEqual([json.loads(payload)["timestamp"] for _, payload in events],
+                         [self.ping(0)["timestamp"].isoformat(), self.ping(1)["timestamp"].isoformat()])
+        self.assertEqual(self.queue.stats(), {"claimed": 2})
+
+        self.queue.ack([events[0][0]])
+        self.queue.release([events[1][0]], "boom")
+        self.assertEqual(self.queue.stats(), {"pending": 1})
+        self.assertEqual(self.queue.claim("w2"), (self.log.id, [events[1]]))
+
+    def test_expired_lease_is_reclaimed(self):
+        self.queue.enqueue([self.ping(0)])
+        _, events = self.queue.claim("w1")
+        self.assertEqual(self.queue.claim("w2"), (None, []))
+        with self.later(61):
+            self.assertEqual(self.queue.claim("w2"), (self.log.id, events))
+
+    def test_claims_one_log_at_a_time_in_order(self):
+        self.queue.enqueue([self.ping(0), self.ping(1, self.other_log), self.ping(2), self.ping(3, self.other_log)])
+        first_log, first = self.queue.claim("w1")
+        second_log, second = self.queue.claim("w2")
+        self.assertEqual((first_log, second_log), (self.log.id, self.other_log.id))
+        self.assertEqual([json.loads(payload)["timestamp"] for _, payload in first],
+                         [self.ping(0)["timestamp"].isoformat(), self.ping(2)["timestamp"].isoformat()])
+        self.assertLess(first[0][0], first[1][0])
+        self.assertEqual(len(second), 2)
+        # Both logs are claimed, so nothing is left to hand out
+        self.assertEqual(self.queue.claim("w3"), (None, []))
+
+    def test_failures_retry_until_max_attempts(self):
+        self.queue.enqueue([self.ping(0)])
+        with mock.patch("triplog.ingest_queue.ingest_pings", side_effect=RuntimeError("database is locked")):
+            self.assertEqual(drain_once(self.queue, "w1"), 0)
+            self.assertEqual(self.queue.stats(), {"pending": 1})
+            self.assertEqual(drain_once(self.queue, "w1"), 0)
+        self.assertEqual(self.queue.stats(), {"failed": 1})
+
+    def test_bad_input_fails_permanently(self):
+        log = TripLog.objects.create(trip=self.trip, log_date=timezone.now().date())
+        self.queue.enqueue([self.ping(0, log)])
+        log.delete()
+        self.assertEqual(drain_once(self.queue, "w1"), 0)
+        self.assertEqual(self.queue.stats(), {"failed": 1})
+
+    def test_redelivery_after_commit_is_not_applied_twice(self):
+        self.queue.enqueue([self.ping(minute) for minute in range(3)])
+        # The worker commits the ingest but dies before acking
+        with mock.patch.object(self.queue, "ack"):
+            self.assertEqual(drain_once(self.queue, "w1"), 3)
+        total = self.trip_total()
+        self.assertGreater(total, 0)
+
+        with self.later(61):
+            self.assertEqual(drain_once(self.queue, "w2"), 3)
+        self.assertEqual(self.queue.stats(), {})
+        self.assertEqual(self.trip_total(), total)
+        self.assertEqual(LogEntry.objects.filter(log=self.log).count(), 1)
+
+    def test_overlapping_drains_apply_each_event_once(self):
+        self.queue.enqueue([self.ping(minute) for minute in range(3)])
+        _, events = self.queue.claim("w1")
+        # A drain whose lease expired committed the first two while this one held all three
+        queue_id = self.queue.queue_id
+        self.assertEqual(ingest_events(queue_id, self.log.id, events[:2]), 2)
+        self.assertEqual(ingest_events(queue_id, self.log.id, events), 1)
+        self.assertEqual(ingest_events(queue_id, self.log.id, events), 0)
+
+        entry = LogEntry.objects.get(log=self.log)
+        self.assertAlmostEqual(self.trip_total(), entry.mileage, places=2)
+        service = StubDistanceService()
+        self.assertAlmostEqual(entry.mileage, service.estimate((40.0, -90.0), (40.02, -90.0)), places=6)
+
+    def test_replaced_queue_file_is_not_skipped(self):
+        # The cursor of a previous file is far ahead of the ids a new file starts from
+        IngestCursor.objects.create(log=self.log, queue_id="0" * 32, last_event_id=10 ** 15)
+        self.queue.enqueue([self.ping(0), self.ping(1)])
+        self.assertEqual(drain_once(self.queue, "w1"), 2)
+        self.assertEqual(LogEntry.objects.filter(log=self.log).count(), 1)
+
+        cursor = IngestCursor.objects.get(log=self.log)
+        self.assertEqual((cursor.queue_id, cursor.last_event_id), (self.queue.queue_id, 2))
+        # Reopening the same file keeps its identity
+        self.assertEqual(IngestQueue(self.queue.path).queue_id, self.queue.queue_id)
+
+    @override_settings(INGEST_QUEUE={"MODE": "queued"})
+    def test_queued_endpoints_answer_202_and_drain(self):
+        pings = [self.payload(self.ping(minute)) for minute in range(4)]
+        for url, body, expected in (
+            ("/api/update-log-entry/", pings[0], {"message": "Log entry queued"}),
+            ("/api/update-log-entries/", pings[1:2], {"message": "Log entries queued", "queued": 1}),
+            ("/api/async/update-log-entry/", pings[2], {"message": "Log entry queued"}),
+            ("/api/async/update-log-entries/", {"pings": pings[3:]}, {"message": "Log entries queued", "queued": 1}),
+        ):
+            response = self.client.post(url, body, content_type="application/json")
+            self.assertEqual((response.status_code, response.json()), (202, expected), url)
+        self.assertEqual(LogEntry.objects.filter(log=self.log).count(), 0)
+        self.assertEqual(self.queue.stats(), {"pending": 4})
+
+        missing = self.client.post("/api/update-log-entry/", {**pings[0], "logId": 0}, content_type="application/json")
+        self.assertEqual(missing.status_code, 404)
+
+        call_command("drain_ingest_queue", "--once", stdout=io.StringIO())
+        self.assertEqual(self.queue.stats(), {})
+        self.assertEqual(LogEntry.objects.filter(log=self.log).count(), 1)
+        self.assertGreater(IngestCursor.objects.get(log=self.log).last_event_id, 0)
+
+
+class TrackTests(TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        trip = Trip.objects.create(
+            driver_id="driver", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+        )
+        cls.log = TripLog.objects.create(trip=trip, log_date=timezone.now().date())
+
+    def setUp(self):
+        super().setUp()
+        previous = set_distance_service(StubDistanceService())
+        self.addCleanup(set_distance_service, previous)
+        self.start = timezone.now().replace(microsecond=0)
+
+    def ping(self, minute, status="driving", lat=40.0):
+        return {
+            "log_id": self.log.id, "status": status, "timestamp": self.start + timedelta(minutes=minute),
+            "gps": {"latitude": lat + minute / 1000, "lon": -90.0 - minute / 1000},
+        }
+
+    def test_encoding_round_trip(self):
+        points = [(1_700_000_000_000, 40_123_456, -90_654_321), (1_700_000_060_000, 40_123_400, -90_654_400),
+                  (1_699_999_990_000, -1, 179_999_999)]
+        data = tracks.encode_points(points)
+        self.assertEqual(list(tracks.decode_points(data)), points)
+        # A minute later and a few metres away costs a handful of bytes, not a JSON object
+        self.assertLessEqual(len(tracks.encode_points(points[:2])) - len(tracks.encode_points(points[:1])), 8)
+
+    def test_ingest_appends_across_segments(self):
+        with mock.patch.object(tracks, "SEGMENT_POINTS", 4):
+            ingest_pings([self.ping(minute) for minute in range(6)])
+            ingest_pings([self.ping(minute) for minute in range(6, 10)])
+
+        entry = LogEntry.objects.get(log=self.log)
+        self.assertEqual(list(entry.track_segments.order_by("seq").values_list("point_count", flat=True)), [4, 4, 2])
+        points = tracks.fetch_track(entry.id)
+        self.assertEqual([t for t, _, _ in points],
+                         [int((self.start + timedelta(minutes=minute)).timestamp() * 1000) for minute in range(10)])
+        self.assertAlmostEqual(points[3][1], 40.003)
+        self.assertAlmostEqual(points[3][2], -90.003)
+
+    def test_status_change_point_closes_and_opens(self):
+        ingest_pings([self.ping(0), self.ping(1), self.ping(2, status="on_duty")])
+        driving, on_duty = LogEntry.objects.filter(log=self.log).order_by("id")
+        self.assertEqual(len(tracks.fetch_track(driving.id)), 3)
+        self.assertEqual(tracks.fetch_track(on_duty.id), tracks.fetch_track(driving.id)[-1:])
+
+    def test_range_endpoint_reads_only_overlapping_segments(self):
+        with mock.patch.object(tracks, "SEGMENT_POINTS", 4):
+            ingest_pings([self.ping(minute) for minute in range(12)])
+        entry = LogEntry.objects.get(log=self.log)
+
+        start = (self.start + timedelta(minutes=5)).isoformat()
+        end = int((self.start + timedelta(minutes=6)).timestamp() * 1000)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f"/api/log-entries/{entry.id}/track/", {"start": start, "end": end})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["points"]), 2)
+        segment_query = [query["sql"] for query in ctx.captured_queries if "triplog_tracksegment" in query["sql"]]
+        self.assertEqual(len(segment_query), 1)
+        self.assertIn('"start_time" <=', segment_query[0])
+
+        self.assertEqual(self.client.get("/api/log-entries/999999/track/").status_code, 404)
+
+
+class GeometryTests(TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(
+            driver_id="driver", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+        )
+        cls.log = TripLog.objects.create(trip=cls.trip, log_date=timezone.now().date())
+        cls.entry = LogEntry.objects.create(log=cls.log, status="driving")
+        start = int(timezone.now().timestamp() * 1000)
+        # A straight road north with about 1 m of sideways jitter, then a turn east
+        points = [(start + i * 1000, round((40 + i * 0.0001) * 1e6), -90_000_000 + (i % 2) * 12) for i in range(500)]
+        points += [(start + (500 + i) * 1000, points[-1][1], -90_000_000 + i * 100) for i in range(1, 300)]
+        tracks.append_track(cls.entry.id, points)
+        LogEntry.objects.create(log=cls.log, status="on_duty", start_gps={"lat": 40.05, "lon": -89.97})
+
+    def test_simplify_keeps_corners_within_tolerance(self):
+        line = [(40.0, -90.0), (40.00001, -89.99), (40.0, -89.98), (40.1, -89.98)]
+        self.assertEqual(geometry.simplify(line, 10), [line[0], line[2], line[3]])
+        self.assertEqual(geometry.simplify(line, 1), line)
+        self.assertEqual(geometry.simplify(line[:2], 1000), line[:2])
+
+    def test_log_geometry_by_zoom(self):
+        coarse = self.client.get(f"/api/logs/{self.log.id}/geometry/", {"zoom": 10}).json()
+        fine = self.client.get(f"/api/logs/{self.log.id}/geometry/", {"tolerance": 0.5}).json()
+
+        self.assertEqual(coarse["raw_points"], 800)
+        self.assertEqual([feature["status"] for feature in coarse["entries"]], ["driving", "on_duty"])
+        self.assertEqual(len(coarse["entries"][0]["points"]), 3)  # Start, corner, end
+        self.assertEqual(coarse["entries"][1]["points"], [[40.05, -89.97]])
+        self.assertGreater(fine["points"], coarse["points"])
+
+    def test_trip_geometry_is_cached_until_a_ping(self):
+        url = f"/api/trips/{self.trip.id}/geometry/"
+        before = self.client.get(url, {"zoom": 12}).json()
+        with self.assertNumQueries(0):
+            self.client.get(url, {"zoom": 12})
+
+        previous = set_distance_service(StubDistanceService())
+        self.addCleanup(set_distance_service, previous)
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_pings([{"log_id": self.log.id, "status": "on_duty", "timestamp": timezone.now(),
+                           "gps": {"lat": 40.06, "lon": -89.97}}])
+        after = self.client.get(url, {"zoom": 12}).json()
+        self.assertNotEqual(after, before)
+        self.assertEqual(after["entries"][-1]["points"][-1], [40.06, -89.97])
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get(f"/api/logs/{self.log.id}/geometry/", {"zoom": "x"}).status_code, 400)
+        self.assertEqual(self.client.get(f"/api/logs/{self.log.id}/geometry/", {"tolerance": "-1"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/trips/999999/geometry/").status_code, 404)
+
+
+class DistanceModeTests(StubOSRMServerMixin, TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(
+            driver_id="driver", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+        )
+        cls.log = TripLog.objects.create(trip=cls.trip, log_date=timezone.now().date())
+
+    def use_service(self, **options):
+        previous = set_distance_service(DistanceService(OSRM_URL=self.url, **options))
+        self.addCleanup(set_distance_service, previous)
+
+    def pings(self, statuses):
+        start = timezone.now()
+        return [
+            {"log_id": self.log.id, "status": status, "timestamp": start + timedelta(minutes=i),
+             "gps": {"latitude": 40.0 + i * 0.01, "longitude": -74.0}}
+            for i, status in enumerate(statuses)
+        ]
+
+    def test_local_distances_are_vectorized_haversine(self):
+        service = DistanceService(MODE="local", LOCAL_ROAD_FACTOR=1.1)
+        pairs = [({"lat": 40.0, "lon": -74.0}, {"latitude": 40.1, "longitude": -74.2}), ({}, {"lat": 1, "lon": 1})]
+        miles = service.distances(pairs)
+        self.assertAlmostEqual(miles[0], haversine_miles(40.0, -74.0, 40.1, -74.2) * 1.1)
+        self.assertEqual(miles[1], 0)
+
+    def test_local_mode_never_routes(self):
+        self.use_service(MODE="local")
+        ingest_pings(self.pings(["driving"] * 4 + ["on_duty"]))
+        self.assertEqual(StubOSRMHandler.hits, 0)
+
+        # The hop closing the driving entry is credited to it
+        expected = haversine_miles(40.0, -74.0, 40.04, -74.0)
+        driving = LogEntry.objects.get(log=self.log, status="driving")
+        self.assertAlmostEqual(driving.mileage, expected, places=6)
+        self.trip.refresh_from_db()
+        self.assertAlmostEqual(float(self.trip.total_mileage), expected, places=2)
+
+    def test_reconciled_mode_routes_once_per_closed_entry(self):
+        self.use_service(MODE="reconciled")
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_pings(self.pings(["driving"] * 4))
+        self.assertEqual(StubOSRMHandler.hits, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_pings(self.pings(["driving"] * 2 + ["on_duty"])[2:])
+        self.assertEqual(StubOSRMHandler.hits, 1)
+
+        driving = LogEntry.objects.get(log=self.log, status="driving")
+        self.assertAlmostEqual(driving.mileage, 10.0)
+        self.log.refresh_from_db()
+        self.assertEqual(self.log.total_miles_driving_today, Decimal("10.00"))
+
+    def test_reconciled_status_changes_keep_trip_total_equal_to_entries(self):
+        self.use_service(MODE="reconciled")
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_pings(self.pings(["driving"] * 3 + ["on_duty"] * 2 + ["driving"] * 2 + ["off_duty"]))
+        self.assertEqual(StubOSRMHandler.hits, 3)
+
+        self.trip.refresh_from_db()
+        entries = sum(LogEntry.objects.filter(log=self.log).values_list("mileage", flat=True))
+        self.assertAlmostEqual(float(self.trip.total_mileage), entries, places=2)
+        self.assertAlmostEqual(entries, 30.0)
+
+    def test_unknown_mode_is_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            DistanceService(MODE="teleport")
+
+
+class AsyncHTTPPoolTests(SimpleTestCase):
+    """The pool against a raw server answering each request with the next canned (bytes, close) response"""
+
+    def run_pool(self, responses, calls):
+        """Result (or exception type) of each get_json, and the number of connections opened"""
+        pending = list(responses)
+        opened = []
+
+        async def handle(reader, writer):
+            opened.append(writer)
+            try:
+                while pending:
+                    await reader.readuntil(b"\r\n\r\n")
+                    response, close = pending.pop(0)
+                    writer.write(response)
+                    await writer.drain()
+                    if close:
+                        break
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            writer.close()
+
+        async def main():
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            pool = AsyncHTTPPool(f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}")
+            results = []
+            async with server:
+                for _ in range(calls):
+                    try:
+                        results.append(await pool.get_json("/route", read_timeout=1))
+                    except Exception as e:
+                        results.append(type(e))
+                await pool.aclose()
+            return results
+
+        return asyncio.run(main()), len(opened)
+
+    def test_bodyless_statuses_keep_the_connection(self):
+        results, opened = self.run_pool([
+            (b"HTTP/1.1 204 No Content\r\n\r\n", False),
+            (b"HTTP/1.1 304 Not Modified\r\nContent-Length: 50\r\n\r\n", False),
+            (b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}", False),
+        ], calls=3)
+        self.assertEqual(results, [json.JSONDecodeError, HTTPError, {}])
+        self.assertEqual(opened, 1)
+
+    def test_interim_responses_are_skipped(self):
+        results, _ = self.run_pool([
+            (b'HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK\r\nContent-Length: 11\r\n\r\n{"a": true}', False),
+        ], calls=1)
+        self.assertEqual(results, [{"a": True}])
+
+    def test_bodies_ended_by_close_are_not_pooled(self):
+        results, opened = self.run_pool([
+            (b"HTTP/1.1 200 OK\r\n\r\n{}", True),
+            (b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}", False),
+        ], calls=2)
+        self.assertEqual(results, [{}, {}])
+        self.assertEqual(opened, 2)
+
+
+class RoadGraphTests(SimpleTestCase):
+    """A 6x6 street grid 0.01 degrees apart, with a one-way street along the top row"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.osm_path = os.path.join(cls.tmp.name, "grid.osm")
+        cls.graph_path = os.path.join(cls.tmp.name, "grid.npz")
+
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6">']
+        node_id = lambda row, col: row * 10 + col + 1
+        for row in range(6):
+            for col in range(6):
+                lines.append(f'<node id="{node_id(row, col)}" lat="{40 + row * 0.01}" lon="{-74 + col * 0.01}"/>')
+        way_id = 1000
+        for row in range(6):
+            tags = '<tag k="highway" v="residential"/>' + ('<tag k="oneway" v="yes"/>' if row == 5 else "")
+            refs = "".join(f'<nd ref="{node_id(row, col)}"/>' for col in range(6))
+            lines.append(f'<way id="{way_id}">{refs}{tags}</way>')
+            way_id += 1
+        for col in range(6):
+            refs = "".join(f'<nd ref="{node_id(row, col)}"/>' for row in range(6))
+            lines.append(f'<way id="{way_id}">{refs}<tag k="highway" v="residential"/></way>')
+            way_id += 1
+        lines.append(f'<way id="{way_id}"><nd ref="1"/><nd ref="56"/><tag k="highway" v="footway"/></way>')
+        lines.append("</osm>")
+        with open(cls.osm_path, "w") as fh:
+            fh.write("\n".join(lines))
+
+        call_command("build_road_graph", cls.osm_path, cls.graph_path, "--landmarks", "4", stdout=io.StringIO())
+        cls.graph = RoadGraph.load(cls.graph_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+    def node(self, row, col):
+        return self.graph.nearest_node(40 + row * 0.01, -74 + col * 0.01)[0]
+
+    def test_alt_matches_plain_dijkstra(self):
+        self.assertEqual(len(self.graph), 36)  # The footway is not routable
+        for source in range(len(self.graph)):
+            expected = routing._dijkstra(self.graph.offsets, self.graph.targets, self.graph.weights, source)
+            for target in range(len(self.graph)):
+                self.assertAlmostEqual(self.graph.shortest_meters(source, target), expected[target], places=1)
+
+    def test_one_way_street(self):
+        east = self.graph.shortest_meters(self.node(5, 0), self.node(5, 5))
+        west = self.graph.shortest_meters(self.node(5, 5), self.node(5, 0))
+        self.assertAlmostEqual(east, haversine_miles(40.05, -74, 40.05, -73.95) * 1609.34, delta=1)
+        self.assertGreater(west, east * 1.3)  # Detours through row 4
+
+    def test_route_miles_snaps_points_to_the_network(self):
+        miles = self.graph.route_miles((40.0001, -74.0), (40.0001, -73.98))
+        self.assertAlmostEqual(miles, haversine_miles(40, -74, 40, -73.98) + 2 * 0.0001 * 69.09, places=2)
+        self.assertIsNone(self.graph.route_miles((41.0, -74.0), (40.0, -74.0)))
+
+    def test_distance_service_uses_the_graph(self):
+        service = DistanceService(ROUTER="graph", GRAPH_PATH=self.graph_path, OSRM_URL="http://127.0.0.1:9")
+        miles = service.distance({"lat": 40.0, "lon": -74.0}, {"lat": 40.02, "lon": -73.99})
+        self.assertAlmostEqual(miles, haversine_miles(40, -74, 40.02, -74) + haversine_miles(40.02, -74, 40.02, -73.99), places=3)
+        with self.assertRaises(ImproperlyConfigured):
+            DistanceService(ROUTER="graph")
+
+
+class RollupTests(TriplogTestCase):
+    day = datetime(2026, 3, 10, tzinfo=dt_timezone.utc)
+
+    def trip(self, driver_id="driver-1"):
+        return Trip.objects.create(
+            driver_id=driver_id, from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="T-1", home_terminal_address="Terminal",
+        )
+
+    def on_duty(self, trip, days_back, hours):
+        """A log `days_back` days before self.day holding one on-duty entry of `hours`"""
+        start = self.day - timedelta(days=days_back)
+        log, _ = TripLog.objects.get_or_create(trip=trip, log_date=start.date())
+        LogEntry.objects.create(log=log, status="on_duty", start_time=start, end_time=start + timedelta(hours=hours))
+        update_trip_log(log.id)
+        return log
+
+    def rollup(self, driver_id="driver-1", day=None):
+        row = DailyDutyRollup.objects.filter(driver_id=driver_id, day=day or self.day.date()).first()
+        return row and row.on_duty_hours
+
+    def test_two_trips_on_one_day_share_the_driver_row(self):
+        self.on_duty(self.trip(), 0, 3)
+        log = self.on_duty(self.trip(), 0, 4)
+        self.on_duty(self.trip("driver-2"), 0, 5)
+
+        self.assertEqual(self.rollup(), Decimal("7.00"))
+        self.assertEqual(self.rollup("driver-2"), Decimal("5.00"))
+        log.refresh_from_db()
+        self.assertEqual(log.total_on_duty_hours, Decimal("4.00"))
+        self.assertEqual(log.total_on_duty_hours_last_7_days, Decimal("7.00"))
+
+    def test_windows_span_the_driver_trips(self):
+        earlier, later = self.trip(), self.trip()
+        for back in (9, 8, 7, 6):
+            self.on_duty(earlier, back, 10)
+        log = self.on_duty(later, 0, 2)
+
+        log.refresh_from_db()
+        self.assertEqual(log.total_on_duty_hours_last_6_days, Decimal("12.00"))
+        self.assertEqual(log.total_on_duty_hours_last_7_days, Decimal("22.00"))
+        self.assertEqual(log.total_on_duty_hours_last_8_days, Decimal("32.00"))
+
+    def test_api_trip_log_writes_rebuild_the_rollup(self):
+        trip = self.trip()
+        self.on_duty(trip, 0, 3)
+        response = self.client.post("/api/logs/", {
+            "trip": trip.id, "log_date": "2026-03-10", "total_on_duty_hours": "4.00",
+        }, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        log_id = response.json()["id"]
+        self.assertEqual(self.rollup(), Decimal("7.00"))
+
+        self.client.patch(f"/api/logs/{log_id}/", {"log_date": "2026-03-09"}, content_type="application/json")
+        self.assertEqual(self.rollup(), Decimal("3.00"))
+        self.assertEqual(self.rollup(day=self.day.date() - timedelta(days=1)), Decimal("4.00"))
+
+        self.client.delete(f"/api/logs/{log_id}/")
+        self.assertEqual(self.rollup(), Decimal("3.00"))
+        self.assertFalse(self.rollup(day=self.day.date() - timedelta(days=1)))
+
+    def test_api_log_entry_writes_rebuild_the_rollup(self):
+        log = self.on_duty(self.trip(), 0, 3)
+        start = self.day + timedelta(hours=5)
+        response = self.client.post("/api/log-entries/", {
+            "log": log.id, "status": "on_duty", "start_time": start.isoformat(),
+            "end_time": (start + timedelta(hours=2)).isoformat(),
+        }, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        entry_id = response.json()["id"]
+        self.assertEqual(self.rollup(), Decimal("5.00"))
+
+        self.client.patch(f"/api/log-entries/{entry_id}/", {"status": "driving"}, content_type="application/json")
+        self.assertEqual(self.rollup(), Decimal("3.00"))
+        self.assertEqual(DailyDutyRollup.objects.get(driver_id="driver-1").driving_hours, Decimal("2.00"))
+
+        self.client.delete(f"/api/log-entries/{entry_id}/")
+        self.assertEqual(self.rollup(), Decimal("3.00"))
+        self.assertEqual(DailyDutyRollup.objects.get(driver_id="driver-1").driving_hours, Decimal("0.00"))
+
+    def test_migration_backfills_existing_logs(self):
+        from django.apps import apps
+        from importlib import import_module
+        backfill = import_module("triplog.migrations.0013_backfill_dailydutyrollup").backfill_rollups
+
+        self.on_duty(self.trip(), 0, 3)
+        self.on_duty(self.trip(), 0, 4)
+        self.on_duty(self.trip("driver-2"), 1, 5)
+        expected = set(DailyDutyRollup.objects.values_list("driver_id", "day", "on_duty_hours"))
+        # As on a database whose logs predate the table
+        DailyDutyRollup.objects.all().delete()
+
+        backfill(apps, None)
+        self.assertEqual(set(DailyDutyRollup.objects.values_list("driver_id", "day", "on_duty_hours")), expected)
+        self.assertEqual(len(expected), 2)
+
+
+class ComplianceTests(TriplogTestCase):
+    start =datetime(2026, 3, 2, tzinfo=dt_timezone.utc)
+    as_of = datetime(2026, 3, 20, tzinfo=dt_timezone.utc)
+
+    def schedule(self, blocks, driver_id="driver-1", cycle_type="70/8", status="ongoing"):
+        """One trip whose entries are consecutive (status, hours) blocks from self.start, one TripLog per day"""
+        trip = Trip.objects.create(
+            driver_id=driver_id, from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="T-1", home_terminal_address="Terminal",
+            cycle_type=cycle_type, status=status, is_completed=status == "completed",
+        )
+        logs = {}
+        at = self.start
+        for status_, hours in blocks:
+            end = at + timedelta(hours=hours)
+            if at.date() not in logs:
+                logs[at.date()] = TripLog.objects.create(trip=trip, log_date=at.date())
+            LogEntry.objects.create(log=logs[at.date()], status=status_, start_time=at, end_time=end)
+            at = end
+        return trip, logs
+
+    def days(self, count, driving=10):
+        """`count` days of driving in two halves around a 30-minute break, then off duty until the next day"""
+        half = driving / 2
+        return [("driving", half), ("off_duty", 0.5), ("driving", half), ("off_duty", 23.5 - driving)] * count
+
+    def check(self):
+        return check_compliance(self.start.date(), (self.as_of - timedelta(days=1)).date(), as_of=self.as_of)
+
+    def violations(self, rule):
+        return [(violation.occurred_at, violation.excess_hours)
+                for violation in HosViolation.objects.filter(rule=rule).order_by("occurred_at")]
+
+    def test_driving_limit_and_break(self):
+        self.schedule([("on_duty", 1), ("driving", 12), ("off_duty", 11)])
+        self.check()
+        self.assertEqual(self.violations("driving_11"), [(self.start + timedelta(hours=12), Decimal("1.00"))])
+        self.assertEqual(self.violations("break_30"), [(self.start + timedelta(hours=9), Decimal("4.00"))])
+        self.assertEqual(self.violations("window_14"), [])
+
+    def test_window_counts_on_duty_and_short_rests(self):
+        self.schedule([
+            ("on_duty", 2), ("driving", 4), ("off_duty", 0.5), ("driving", 4), ("off_duty", 4), ("driving", 3),
+            ("off_duty", 10),
+        ])
+        self.check()
+        self.assertEqual(self.violations("window_14"), [(self.start + timedelta(hours=14.5), Decimal("3.00"))])
+        self.assertEqual(self.violations("driving_11"), [])
+        self.assertEqual(self.violations("break_30"), [])
+
+    def test_cycle_follows_trip_cycle_type(self):
+        self.schedule(self.days(8), driver_id="eight", cycle_type="70/8")
+        self.schedule(self.days(8), driver_id="seven", cycle_type="60/7")
+        self.check()
+
+        cycle = HosViolation.objects.filter(rule="cycle")
+        eight = list(cycle.filter(driver_id="eight").order_by("occurred_at"))
+        seven = list(cycle.filter(driver_id="seven").order_by("occurred_at"))
+        # 70/8 runs out on the eighth day, 60/7 on the seventh and again on the eighth
+        self.assertEqual(eight[0].occurred_at, self.start + timedelta(days=7))
+        self.assertEqual(sum(violation.excess_hours for violation in eight), Decimal("10.00"))
+        self.assertEqual(seven[0].occurred_at, self.start + timedelta(days=6))
+        self.assertEqual(sum(violation.excess_hours for violation in seven), Decimal("20.00"))
+        self.assertEqual({violation.cycle_type for violation in seven}, {"60/7"})
+
+    def test_34_hour_restart(self):
+        blocks = self.days(5)
+        restarted, _ = self.schedule(blocks + [("off_duty", 20.5)] + self.days(3), driver_id="restart", cycle_type="60/7")
+        self.schedule(blocks + self.days(3), driver_id="no-restart", cycle_type="60/7")
+        self.check()
+
+        self.assertFalse(HosViolation.objects.filter(driver_id="restart").exists())
+        self.assertTrue(HosViolation.objects.filter(driver_id="no-restart", rule="cycle").exists())
+
+        # 30 hours since the restart, the next day is the seventh of the new cycle
+        last_log = TripLog.objects.filter(trip=restarted).order_by("log_date").last()
+        self.assertEqual(last_log.available_hours_tomorrow, Decimal("30.00"))
+
+    def test_update_trip_log_estimates_available_hours_from_rollups(self):
+        _, logs = self.schedule(self.days(8, driving=6))
+        for day in sorted(logs):
+            update_trip_log(logs[day].id)
+        last = logs[max(logs)]
+        last.refresh_from_db()
+        # Seven 6-hour days before tomorrow count against 70/8
+        self.assertEqual(last.available_hours_tomorrow, Decimal("28.00"))
+
+        # Without a restart the compliance run agrees
+        self.check()
+        last.refresh_from_db()
+        self.assertEqual(last.available_hours_tomorrow, Decimal("28.00"))
+
+    def test_compliance_credits_the_restart_update_trip_log_ignores(self):
+        _, logs = self.schedule(self.days(5) + [("off_duty", 20.5)] + self.days(3), cycle_type="60/7")
+        for day in sorted(logs):
+            update_trip_log(logs[day].id)
+        last = logs[max(logs)]
+        last.refresh_from_db()
+        # The six days before tomorrow hold 50 hours on the rollup rows, restart or not
+        self.assertEqual(last.available_hours_tomorrow, Decimal("10.00"))
+
+        self.check()
+        last.refresh_from_db()
+        self.assertEqual(last.available_hours_tomorrow, Decimal("30.00"))
+
+    def test_completed_trip_recap(self):
+        trip, _ = self.schedule(self.days(3), status="completed")
+        # The driver's next trip starts after 40 hours off
+        self.start += timedelta(days=3, hours=36)
+        self.schedule(self.days(1))
+        self.start -= timedelta(days=3, hours=36)
+        self.check()
+
+        recap = TripCompletion.objects.get(trip=trip)
+        self.assertTrue(recap.reset_applied)
+        self.assertEqual(recap.consecutive_hours_off, 13.5 + 36)
+        self.assertEqual(recap.total_on_duty_last_period, 30.0)
+        self.assertEqual(recap.available_hours_tomorrow, 40.0)
+
+    def test_rerun_replaces_violations_and_lists_them(self):
+        self.schedule([("driving", 12), ("off_duty", 12)])
+        self.check()
+        self.check()
+        self.assertEqual(HosViolation.objects.filter(rule="driving_11").count(), 1)
+
+        response = self.client.get("/api/compliance/violations/", {"driver": "driver-1", "rule": "driving_11"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["excess_hours"] for row in response.json()["results"]], ["1.00"])
+        response = self.client.get("/api/compliance/violations/", {"start": "2026-03-03"})
+        self.assertEqual(response.json()["results"], [])
+
+
+class InlineExecutor:
+    """ProcessPoolExecutor stand-in running each task at submit time in this process"""
+
+    def __init__(self, max_workers=None, initializer=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class RecomputeTests(TriplogTestCase):
+    columns = ["total_miles_today", *STATUS_HOUR_FIELDS.values(), *ROLLING_WINDOWS]
+
+    def setUp(self):
+        super().setUp()
+        generate_fleet(drivers=3, days=10, max_entry_minutes=240, seed=11)
+        self.expected = self.snapshot()
+        self.rollups = set(DailyDutyRollup.objects.values_list("driver_id", "day", "on_duty_hours"))
+        # Aggregates drift: zeroed totals and lost rollups
+        TripLog.objects.update(**{column: 0 for column in self.columns})
+        DailyDutyRollup.objects.all().delete()
+
+    def snapshot(self):
+        return {row[0]: row[1:] for row in TripLog.objects.values_list("id", *self.columns)}
+
+    def test_rebuilds_totals_rollups_and_recaps(self):
+        err = io.StringIO()
+        call_command("recompute_aggregates", "--workers", "1", "--chunk-size", "2", stderr=err)
+        self.assertIn("Recomputed 30 logs of 3 drivers in 2 chunks", err.getvalue())
+        self.assertEqual(self.snapshot(), self.expected)
+        self.assertEqual(set(DailyDutyRollup.objects.values_list("driver_id", "day", "on_duty_hours")), self.rollups)
+        completed = Trip.objects.filter(status="completed").count()
+        self.assertEqual(TripCompletion.objects.count(), completed)
+
+    def test_selection_and_resume(self):
+        drivers = sorted(Trip.objects.values_list("driver_id", flat=True).distinct())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "checkpoint.json")
+            with open(path, "w") as fh:
+                json.dump({"selection": {"driver_ids": drivers[:2]}, "done": [drivers[0]]}, fh)
+
+            totals = recompute(driver_ids=drivers[:2], chunk_size=1, checkpoint_path=path, resume=True)
+            self.assertEqual((totals["skipped"], totals["done"], totals["logs"]), (1, 1, 10))
+            with open(path) as fh:
+                self.assertEqual(json.load(fh)["done"], drivers[:2])
+
+            with self.assertRaises(ValueError):
+                recompute(driver_ids=drivers, checkpoint_path=path, resume=True)
+
+        recomputed = {driver_id: set(TripLog.objects.filter(trip__driver_id=driver_id).values_list("id", flat=True))
+                      for driver_id in drivers}
+        current = self.snapshot()
+        for log_id in recomputed[drivers[1]]:
+            self.assertEqual(current[log_id], self.expected[log_id])
+        for log_id in recomputed[drivers[0]] | recomputed[drivers[2]]:
+            self.assertEqual(current[log_id][0], 0)
+
+    def test_sqlite_defaults_to_one_worker(self):
+        with mock.patch("triplog.recompute.ProcessPoolExecutor") as pool:
+            call_command("recompute_aggregates", "--chunk-size", "1", stderr=io.StringIO())
+        pool.assert_not_called()
+        self.assertEqual(self.snapshot(), self.expected)
+
+    def test_worker_pool_path(self):
+        # The in-memory test database is not visible to child processes, so chunks run in this one
+        with mock.patch("triplog.recompute.ProcessPoolExecutor", InlineExecutor):
+            totals = recompute(chunk_size=1, workers=3)
+        self.assertEqual((totals["chunks"], totals["done"], totals["failed"], totals["logs"]), (3, 3, 0, 30))
+        self.assertEqual(self.snapshot(), self.expected)
+
+    def test_failed_chunk_is_retried_on_resume(self):
+        drivers = sorted(Trip.objects.values_list("driver_id", flat=True).distinct())
+
+        def flaky(driver_ids, selection, as_of=None):
+            if drivers[1] in driver_ids:
+                raise RuntimeError("database is locked")
+            return recompute_drivers(driver_ids, selection, as_of)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "checkpoint.json")
+            err = io.StringIO()
+            with mock.patch("triplog.recompute.recompute_drivers", flaky), \
+                    mock.patch("triplog.recompute.ProcessPoolExecutor", InlineExecutor):
+                with self.assertRaisesMessage(CommandError, "1 drivers failed, rerun with --resume"):
+                    call_command("recompute_aggregates", "--workers", "2", "--chunk-size", "1",
+                                 "--checkpoint", path, stderr=err)
+            self.assertIn("share one SQLite writer", err.getvalue())
+            with open(path) as fh:
+                self.assertEqual(json.load(fh)["done"], [drivers[0], drivers[2]])
+
+            totals = recompute(chunk_size=1, checkpoint_path=path, resume=True)
+            self.assertEqual((totals["skipped"], totals["done"], totals["failed"]), (2, 1, 0))
+        self.assertEqual(self.snapshot(), self.expected)
+
+
+class PlannerTests(TriplogTestCase):
+    fresh = {"drive": 11 * 3600, "window": 14 * 3600, "break": 8 * 3600, "cycle": 70 * 3600, "rest": 0}
+
+    def setUp(self):
+        super().setUp()
+        planner.clear_plan_cache()
+        previous = set_distance_service(StubDistanceService())
+        self.addCleanup(set_distance_service, previous)
+
+    def stops(self, miles, state, cycle_type="70/8", **options):
+        plan = planner.plan_route(miles, state, cycle_type, AVERAGE_SPEED_MPH=50, **options)
+        return [(stop["type"], stop["mile"]) for stop in plan["stops"]], plan
+
+    def test_breaks_rests_and_fuel(self):
+        stops, plan = self.stops(1200, self.fresh)
+        # 8h to the break, 3h more to the 11-hour limit; the fuel stop at 1000 miles also resets the break
+        self.assertEqual(stops, [("break", 400), ("rest", 550), ("break", 950), ("fuel", 1000), ("rest", 1100)])
+        self.assertEqual(plan["driving_hours"], 24.0)
+        self.assertEqual(plan["total_hours"], 24 + 0.5 + 10 + 0.5 + 0.5 + 10)
+        self.assertEqual(plan["arrival"] - plan["departure"], timedelta(hours=45.5))
+
+    def test_remaining_hours_bind(self):
+        stops, _ = self.stops(200, {**self.fresh, "window": 2 * 3600})
+        self.assertEqual(stops, [("rest", 100)])
+        stops, _ = self.stops(200, {**self.fresh, "cycle": 3 * 3600 + 600}, cycle_type="60/7")
+        self.assertEqual(stops, [("restart", 150)])  # 3h10m rounds down to 3h
+        stops, _ = self.stops(200, self.fresh, since_fuel=1950)
+        self.assertEqual(stops, [("fuel", 50)])
+
+    def test_replanning_hits_the_cache(self):
+        self.stops(500, {**self.fresh, "drive": 9 * 3600 + 300})
+        self.stops(499.6, {**self.fresh, "drive": 9 * 3600 + 60})
+        self.assertEqual(planner.plan_cache_info().hits, 1)
+
+    def test_plan_endpoint_uses_driver_hours(self):
+        trip = Trip.objects.create(
+            driver_id="planner", from_location="Denver", to_location="41.0, -100.0", carrier_name="Carrier",
+            main_office_address="Office", truck_number="T-1", home_terminal_address="Terminal", cycle_type="60/7",
+        )
+        log = TripLog.objects.create(trip=trip, log_date=timezone.localdate())
+        now = timezone.now()
+        LogEntry.objects.create(
+            log=log, status="driving", start_time=now - timedelta(hours=10), end_time=now,
+            start_gps={"lat": 39.7, "lon": -105.0}, end_gps={"lat": 40.0, "lon": -104.0},
+        )
+
+        response = self.client.get(f"/api/trips/{trip.id}/plan/", {"speed": "50"})
+        self.assertEqual(response.status_code, 200)
+        plan = response.json()
+        self.assertEqual(plan["origin"], [40.0, -104.0])
+        self.assertEqual(plan["hours_left"]["drive"], 1.0)
+        self.assertEqual(plan["hours_left"]["cycle"], 50.0)
+        # 10 hours driven without a break: a break, one more hour, then the 10-hour rest
+        self.assertEqual([stop["type"] for stop in plan["stops"]][:2], ["break", "rest"])
+        self.assertAlmostEqual(plan["miles"], haversine_miles(40, -104, 41, -100) * 1.2, delta=0.1)
+
+        response = self.client.get(f"/api/trips/{trip.id}/plan/", {"to": "Omaha"})
+        self.assertEqual(response.status_code, 400)
+        for params in ({"speed": "1e-6"}, {"speed": "500"}, {"speed": "nan"}, {"fuel_every": "1e-7"}):
+            self.assertEqual(self.client.get(f"/api/trips/{trip.id}/plan/", params).status_code, 400)
+        trip.to_location = "Omaha"
+        trip.save()
+        self.assertEqual(self.client.get(f"/api/trips/{trip.id}/plan/").status_code, 400)
+
+    def test_degenerate_inputs_are_rejected_quickly(self):
+        started = time.perf_counter()
+        for options in ({"FUEL_EVERY_MILES": 1e-7}, {"AVERAGE_SPEED_MPH": 1e-6}):
+            with self.assertRaises(planner.PlanError):
+                planner.plan_route(500, self.fresh, "70/8", **options)
+        # Even when called directly, the simulation gives up past MAX_STOPS
+        with self.assertRaises(planner.PlanError):
+            planner._simulate(500, 0.0, 11, 14, 8, 70, 70, 55, 1e-7, 0.5)
+        with self.assertRaises(planner.PlanError):
+            planner._simulate(500, 0.0, 11, 14, 8, 70, 70, 1e-6, 1000, 0.5)
+        self.assertLess(time.perf_counter() - started, 2)
+
+
+class LogSheetTests(TriplogTestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = tmp.name
+        settings_override = override_settings(LOG_SHEETS={"CACHE_DIR": self.cache_dir, "PNG_SCALE": 1.0})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        generate_fleet(drivers=1, days=2, max_entry_minutes=240, seed=5)
+        self.log = TripLog.objects.select_related("trip").order_by("log_date").first()
+        self.log.remarks = "Pre-trip inspection <ok>"
+        self.log.save()
+
+    def sheet(self, output, **headers):
+        return self.client.get(f"/api/logs/{self.log.id}/sheet/", {"output": output}, **headers)
+
+    def test_svg_sheet_has_header_grid_and_remarks(self):
+        response = self.sheet("svg")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        svg = response.content.decode()
+        for text in (self.log.trip.carrier_name, self.log.trip.truck_number, "3. Driving", "Noon",
+                     "Pre-trip inspection &lt;ok&gt;", str(self.log.total_driving_hours)):
+            self.assertIn(text, svg)
+        # The duty line is drawn with the thick stroke, at least one bar per status change
+        changes = sum(1 for a, b in zip(self.log.log_entries.order_by("start_time"), self.log.log_entries.order_by("start_time")[1:])
+                      if a.status != b.status)
+        self.assertGreaterEqual(svg.count('stroke-width="2.2"'), changes + 1)
+
+        self.assertEqual(self.sheet("svg", HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.assertEqual(self.sheet("docx").status_code, 400)
+
+    def test_pdf_and_png(self):
+        pdf = self.sheet("pdf").content
+        self.assertTrue(pdf.startswith(b"%PDF-1.4") and pdf.rstrip().endswith(b"%%EOF"))
+        self.assertIn(b"(DRIVER'S DAILY LOG \\(24 HOURS\\))".replace(b"\\\\", b"\\"), pdf)
+
+        png = self.sheet("png").content
+        self.assertEqual(png[:8], b"\x89PNG\r\n\x1a\n")
+        width, height = struct.unpack(">II", png[16:24])
+        self.assertEqual((width, height), (792, 612))
+
+    def test_sheets_are_cached_by_content(self):
+        with mock.patch.object(logsheet, "render_sheet", wraps=logsheet.render_sheet) as render:
+            first = self.sheet("svg")
+            self.sheet("svg")
+            self.assertEqual(render.call_count, 1)
+
+            entry = self.log.log_entries.order_by("start_time").first()
+            entry.remarks = "Fuel"
+            entry.save()
+            second = self.sheet("svg")
+            self.assertEqual(render.call_count, 2)
+        self.assertNotEqual(first["ETag"], second["ETag"])
+
+    def test_live_sheets_are_not_cached(self):
+        today = TripLog.objects.order_by("log_date").last()
+        LogEntry.objects.create(log=today, status="driving", start_time=timezone.now() - timedelta(minutes=5))
+
+        with mock.patch.object(logsheet, "render_sheet", wraps=logsheet.render_sheet) as render:
+            first = self.client.get(f"/api/logs/{today.id}/sheet/", {"output": "svg"})
+            with mock.patch("triplog.logsheet.timezone.now", return_value=timezone.now() + timedelta(minutes=1)):
+                second = self.client.get(f"/api/logs/{today.id}/sheet/", {"output": "svg"})
+            self.assertEqual(render.call_count, 2)
+        self.assertNotEqual(first["ETag"], second["ETag"])
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+        # Closed days are still cached
+        self.sheet("svg")
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_batch_command_writes_a_zip(self):
+        path = os.path.join(self.cache_dir, "sheets.zip")
+        call_command("render_log_sheets", path, "--format", "svg", "--workers", "1", stderr=io.StringIO())
+        with zipfile.ZipFile(path) as archive:
+            names = sorted(archive.namelist())
+        self.assertEqual(len(names), 2)
+        self.assertTrue(names[0].endswith(f"_{self.log.log_date}_{self.log.id}.svg"))
+
+
+class EventTests(TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(
+            driver_id="driver", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+            total_mileage=Decimal("980.00"),  # ~17 miles of pings away from the fuel warning
+        )
+        cls.log = TripLog.objects.create(trip=cls.trip, log_date=timezone.now().date())
+
+    def setUp(self):
+        super().setUp()
+        previous = set_distance_service(StubDistanceService())
+        self.addCleanup(set_distance_service, previous)
+        self.broker = LocalBroker(queue_size=10)
+        previous_broker = set_broker(self.broker)
+        self.addCleanup(set_broker, previous_broker)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def received(self, subscription):
+        self.loop.run_until_complete(asyncio.sleep(0))
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+        return events
+
+    def test_ingest_publishes_after_commit(self):
+        trip_events = self.broker.subscribe([trip_scope(self.trip.id)], loop=self.loop)
+        log_events = self.broker.subscribe([log_scope(self.log.id)], loop=self.loop)
+        start = timezone.now().replace(microsecond=0)
+        pings = [
+            {"log_id": self.log.id, "status": "driving", "timestamp": start + timedelta(minutes=minute),
+             "gps": {"lat": 40.0 + minute / 10, "lon": -90.0}}
+            for minute in range(3)
+        ]
+        pings.append({**pings[-1], "status": "on_duty", "timestamp": start + timedelta(minutes=3)})
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            ingest_pings(pings)
+        self.assertEqual(self.received(trip_events), [])  # Nothing before the commit
+        for callback in callbacks:
+            callback()
+
+        events = self.received(trip_events)
+        self.assertEqual([event["type"] for event in events], ["totals", "entries", "fuel_warning"])
+        self.assertEqual([event["id"] for event in events], sorted(event["id"] for event in events))
+        totals, entries, fuel = events
+        self.assertEqual(totals["log"], self.log.id)
+        self.assertEqual(totals["data"]["total_driving_hours"], Decimal("0.05"))
+        self.assertEqual([entry["status"] for entry in entries["data"]["entries"]], ["driving", "on_duty"])
+        self.assertIn("Fuel station", fuel["data"]["message"])
+        # Log subscribers get the log's events, not trip-wide ones
+        self.assertEqual([event["type"] for event in self.received(log_events)], ["totals", "entries"])
+
+    def test_end_endpoints_publish_and_idle_writes_cost_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.client.post("/api/logs/log-end", {"log": self.log.id, "remarks": "Done"}, content_type="application/json")
+        self.assertEqual(len(callbacks), 1)  # Only the cache invalidation
+
+        subscription = self.broker.subscribe([trip_scope(self.trip.id)], loop=self.loop)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/logs/log-end", {"log": self.log.id, "remarks": "Done"}, content_type="application/json")
+            self.client.post(f"/api/trip-completion/{self.trip.id}/")
+        ended, trip_ended = self.received(subscription)
+        self.assertEqual((ended["type"], ended["data"]["remarks"]), ("log_ended", "Done"))
+        self.assertEqual((trip_ended["type"], trip_ended["data"]["status"]), ("trip_ended", "completed"))
+
+        subscription.close()
+        self.assertFalse(self.broker.listening([trip_scope(self.trip.id)]))
+
+    def test_slow_subscriber_is_told_to_resync(self):
+        broker = LocalBroker(queue_size=2)
+        subscription = broker.subscribe(["trip:1"], loop=self.loop)
+        for _ in range(3):
+            broker.publish(["trip:1"], {"type": "totals", "trip": 1, "log": None, "data": {}})
+        self.assertEqual([event["type"] for event in self.received(subscription)], ["resync"])
+
+    async def test_sse_stream(self):
+        response = await self.async_client.get(f"/api/trips/{self.trip.id}/events/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = response.streaming_content
+        self.assertEqual(await anext(stream), b"retry: 3000\n\n")
+
+        self.broker.publish([trip_scope(self.trip.id)], {"type": "totals", "trip": self.trip.id, "log": 5, "data": {}})
+        message = (await asyncio.wait_for(anext(stream), 1)).decode()
+        self.assertTrue(message.startswith("id: 1\nevent: totals\ndata: "))
+        self.assertEqual(json.loads(message.split("data: ", 1)[1])["log"], 5)
+
+        # The ASGI handler cancels the response task when the client disconnects
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertFalse(self.broker.listening([trip_scope(self.trip.id)]))
+        self.assertEqual((await self.async_client.get("/api/logs/999999/events/")).status_code, 404)
+
+    def test_sse_needs_asgi(self):
+        self.assertEqual(self.client.get(f"/api/trips/{self.trip.id}/events/").status_code, 501)
+
+    async def test_websocket(self):
+        from backend.asgi import application
+
+        async def connect(path):
+            inbox, outbox = asyncio.Queue(), asyncio.Queue()
+            await inbox.put({"type": "websocket.connect"})
+            task = asyncio.ensure_future(application({"type": "websocket", "path": path}, inbox.get, outbox.put))
+            return inbox, outbox, task
+
+        _, outbox, task = await connect("/ws/logs/999999/")
+        self.assertEqual(await asyncio.wait_for(outbox.get(), 1), {"type": "websocket.close", "code": 4404})
+        await task
+
+        inbox, outbox, task = await connect(f"/ws/logs/{self.log.id}/")
+        self.assertEqual((await asyncio.wait_for(outbox.get(), 1))["type"], "websocket.accept")
+        self.broker.publish([log_scope(self.log.id)], {"type": "entries", "trip": self.trip.id, "log": self.log.id,
+                                                       "data": {"entries": []}})
+        frame = await asyncio.wait_for(outbox.get(), 1)
+        self.assertEqual(json.loads(frame["text"])["type"], "entries")
+
+        await inbox.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(task, 1)
+        self.assertFalse(self.broker.listening([log_scope(self.log.id)]))
+
+
+class AsyncIngestTests(StubOSRMServerMixin, TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(
+            driver_id="driver", from_location="A", to_location="B", carrier_name="Carrier",
+            main_office_address="Office", truck_number="1", home_terminal_address="Terminal",
+        )
+        cls.log = TripLog.objects.create(trip=cls.trip, log_date=timezone.now().date())
+
+    def setUp(self):
+        super().setUp()
+        self.service = DistanceService(OSRM_URL=self.url)
+        previous = set_distance_service(self.service)
+        self.addCleanup(set_distance_service, previous)
+
+    def pings(self, count, status="driving"):
+        start = timezone.now().replace(microsecond=0)
+        return [
+            {"logId": self.log.id, "status": status, "timestamp": (start + timedelta(minutes=i)).isoformat(),
+             "gps": {"latitude": 40.0 + i * 0.01, "longitude": -74.0}}
+            for i in range(count)
+        ]
+
+    async def test_batch_routes_concurrently(self):
+        StubOSRMHandler.delay = 0.2
+        queries = ("triplog_db_queries_total", (("endpoint", "update-log-entries-batch-async"),))
+        queries_before = metrics.registry.samples.get(queries, 0)
+
+        started = time.perf_counter()
+        response = await self.async_client.post("/api/async/update-log-entries/", self.pings(5),
+                                                content_type="application/json")
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["processed"], 5)
+        self.assertEqual(StubOSRMHandler.hits, 4)
+        self.assertLess(elapsed, 0.6)  # Four 0.2 s routing calls in sequence would take 0.8 s
+        entry = await LogEntry.objects.aget(log=self.log)
+        self.assertAlmostEqual(entry.mileage, 40.0, places=3)  # The stub answers 10 miles per hop
+        self.assertGreater(metrics.registry.samples[queries], queries_before)
+
+        # Cached pairs are answered without the backend
+        await self.service.adistances([(ping["gps"], later["gps"]) for ping, later in zip(self.pings(5), self.pings(5)[1:])])
+        self.assertEqual(StubOSRMHandler.hits, 4)
+
+    async def test_single_ping_and_errors(self):
+        ping = self.pings(1)[0]
+        response = await self.async_client.post("/api/async/update-log-entry/", ping, content_type="application/json")
+        self.assertEqual(response.json(), {"message": "Log entry updated successfully!"})
+
+        missing = await self.async_client.post("/api/async/update-log-entry/", {**ping, "logId": 999999},
+                                               content_type="application/json")
+        self.assertEqual((missing.status_code, missing.json()), (404, {"error": "TripLog not found"}))
+        invalid = await self.async_client.post("/api/async/update-log-entry/", "{", content_type="application/json")
+        self.assertEqual(invalid.status_code, 400)
+        empty = await self.async_client.post("/api/async/update-log-entries/", [], content_type="application/json")
+        self.assertEqual(empty.json(), {"error": "Expected a non-empty list of pings"})
+        self.assertEqual((await self.async_client.get("/api/async/update-log-entry/")).status_code, 405)
+
+    async def test_trip_end(self):
+        response = await self.async_client.post(f"/api/async/trip-completion/{self.trip.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await Trip.objects.aget(id=self.trip.id)).status, "completed")
+        self.assertEqual((await self.async_client.post("/api/async/trip-completion/999999/")).status_code, 404)
+
+    async def test_backend_failure_falls_back_to_estimate(self):
+        service = DistanceService(OSRM_URL="http://127.0.0.1:1")  # Nothing listens there
+        start, end = {"lat": 40.0, "lon": -74.0}, {"lat": 40.1, "lon": -74.0}
+        miles = await service.adistance(start, end)
+        self.assertAlmostEqual(miles, service.estimate((40.0, -74.0), (40.1, -74.0)))
+        self.assertIsNone(await service.aroute_track([(40.0, -74.0), (40.1, -74.0)]))  # Backing off
+
+    async def test_keep_alive_and_chunked_responses(self):
+        class KeepAliveHandler(StubOSRMHandler):
+            protocol_version = "HTTP/1.1"
+            connections = set()
+
+            def do_GET(self):
+                type(self).connections.add(self.client_address)
+                body = json.dumps({"code": "Ok", "routes": [{"distance": 1609.34}]}).encode()
+                self.send_response(200)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for part in (body[:10], body[10:]):
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(part), part))
+                self.wfile.write(b"0\r\n\r\n")
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        server.block_on_close = False
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        service = DistanceService(OSRM_URL=f"http://127.0.0.1:{server.server_address[1]}")
+
+        for i in range(3):
+            self.assertAlmostEqual(await service.aroute((40.0, -74.0), (40.0 + i, -75.0)), 1.0)
+        self.assertEqual(len(KeepAliveHandler.connections), 1)
+        await service.async_pool.aclose()
+
+
+class AuthTests(TriplogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("driver", "driver@example.com", "secret-pass-1")
+        # Someone whose email is the first user's username
+        CustomUser.objects.create_user("other", "driver", "secret-pass-2")
+
+    def setUp(self):
+        super().setUp()
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+
+    def login(self, username, password):
+        return self.client.post("/api/login/", {"username": username, "password": password}, content_type="application/json")
+
+    def user_queries(self, ctx):
+        return [query["sql"] for query in ctx.captured_queries
+                if query["sql"].startswith("SELECT") and "triplog_customuser" in query["sql"]]
+
+    def test_login_resolves_username_or_email_in_one_query(self):
+        for identifier in ("driver", "driver@example.com"):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.login(identifier, "secret-pass-1")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["user"]["username"], "driver")
+            self.assertEqual(len(self.user_queries(ctx)), 1)
+
+        self.assertEqual(self.login("driver", "wrong").json(), {"error": "Invalid credentials."})
+        self.assertEqual(self.login("nobody", "secret-pass-1").json(), {"error": "Invalid credentials no user."})
+        self.assertEqual(self.login("driver", "").status_code, 400)
+
+        CustomUser.objects.filter(id=self.user.id).update(is_active=False)
+        self.assertEqual(self.login("driver", "secret-pass-1").status_code, 401)
+
+    def test_user_cache(self):
+        access = self.login("driver", "secret-pass-1").json()["access"]
+
+        def me():
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get("/api/user/", HTTP_AUTHORIZATION=f"Bearer {access}")
+            return response, len(self.user_queries(ctx))
+
+        # Off by default: every request loads the user
+        self.assertEqual(me()[1], 1)
+        self.assertEqual(me()[1], 1)
+
+        with override_settings(AUTH_USER_CACHE={"SECONDS": 60}):
+            self.assertEqual(me()[1], 1)
+            response, queries = me()
+            self.assertEqual((response.status_code, response.json()["username"], queries), (200, "driver", 0))
+
+            # Saving the user drops it from this process's cache
+            self.user.is_active = False
+            self.user.save()
+            self.assertEqual(me()[0].status_code, 401)
+
+            self.user.is_active = True
+            self.user.save()
+            self.assertEqual(me()[0].status_code, 200)
+            with mock.patch("triplog.authentication.time.monotonic", return_value=time.monotonic() + 61):
+                self.assertEqual(me()[1], 1)  # Expired
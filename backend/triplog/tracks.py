@@ -0,0 +1,199 @@
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from django.db import transaction
+from django.db.models import Max, Q
+from .distance import gps_coordinates
+from .models import LogEntry, TrackSegment
+
+
+# Points per TrackSegment; bounds the bytes decoded to serve any range
+SEGMENT_POINTS = 256
+
+# Coordinates are stored as integer millionths of a degree (~0.1 m)
+COORD_SCALE = 1_000_000
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def encode_points(points, previous=(0, 0, 0)):
+    """Packs (timestamp_ms, lat_e6, lon_e6) points as zigzag varint deltas from `previous`
+
+    A segment's first point is encoded against (0, 0, 0), i.e. absolutely;
+    later points only cost the few bytes their change needs.
+    """
+    buffer = bytearray()
+    prev_t, prev_lat, prev_lon = previous
+    for t, lat, lon in points:
+        _write_varint(buffer, _zigzag(t - prev_t))
+        _write_varint(buffer, _zigzag(lat - prev_lat))
+        _write_varint(buffer, _zigzag(lon - prev_lon))
+        prev_t, prev_lat, prev_lon = t, lat, lon
+    return bytes(buffer)
+
+
+def decode_points(data):
+    """Inverse of encode_points for a whole segment, yields (timestamp_ms, lat_e6, lon_e6)"""
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(_unzigzag(value))
+        value = shift = 0
+
+    t = lat = lon = 0
+    for i in range(0, len(values) - 2, 3):
+        t += values[i]
+        lat += values[i + 1]
+        lon += values[i + 2]
+        yield t, lat, lon
+
+
+def to_point(timestamp, gps):
+    """(timestamp_ms, lat_e6, lon_e6) for an aware datetime and a GPS dict, None without coordinates"""
+    coordinates = gps_coordinates(gps)
+    if not coordinates:
+        return None
+    lat, lon = coordinates
+    return (
+        int(timestamp.timestamp() * 1000),
+        round(lat * COORD_SCALE),
+        round(lon * COORD_SCALE),
+    )
+
+
+def _datetime(timestamp_ms):
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=dt_timezone.utc)
+
+
+def _fill(segment, points):
+    """Appends points to a segment in place, only touching the encoded tail"""
+    previous = (segment.last_timestamp_ms, segment.last_lat_e6, segment.last_lon_e6) if segment.point_count else (0, 0, 0)
+    segment.data = bytes(segment.data) + encode_points(points, previous)
+    segment.point_count += len(points)
+    segment.last_timestamp_ms, segment.last_lat_e6, segment.last_lon_e6 = points[-1]
+
+    earliest = _datetime(min(t for t, _, _ in points))
+    latest = _datetime(max(t for t, _, _ in points))
+    segment.start_time = min(segment.start_time, earliest) if segment.start_time else earliest
+    segment.end_time = max(segment.end_time, latest) if segment.end_time else latest
+
+
+def _last_segments(entry_ids):
+    """The highest-seq segment of each entry, in two queries"""
+    last_seqs = (
+        TrackSegment.objects
+        .filter(entry_id__in=entry_ids)
+        .values("entry_id")
+        .annotate(last_seq=Max("seq"))
+        .values_list("entry_id", "last_seq")
+    )
+    lookup = Q()
+    for entry_id, seq in last_seqs:
+        lookup |= Q(entry_id=entry_id, seq=seq)
+    if not lookup:
+        return {}
+    return {segment.entry_id: segment for segment in TrackSegment.objects.filter(lookup)}
+
+
+def append_tracks(points_by_entry):
+    """Appends (timestamp_ms, lat_e6, lon_e6) points to the tracks of several LogEntries
+
+    Only the last segment of each entry is read and extended; points beyond
+    SEGMENT_POINTS open new segments. Call inside the transaction that
+    writes the entries. The entries' rows are locked first (in id order),
+    so concurrent appends to one entry queue up instead of losing points
+    or colliding on a new segment's seq.
+    """
+    points_by_entry = {entry_id: points for entry_id, points in points_by_entry.items() if points}
+    if not points_by_entry:
+        return
+
+    with transaction.atomic():
+        list(LogEntry.objects.select_for_update().filter(id__in=list(points_by_entry)).order_by("id").values_list("id"))
+        _append_tracks(points_by_entry)
+
+
+def _append_tracks(points_by_entry):
+    last_segments = _last_segments(list(points_by_entry))
+    to_update = []
+    to_create = []
+
+    for entry_id, points in points_by_entry.items():
+        segment = last_segments.get(entry_id)
+        start = 0
+        if segment is not None and segment.point_count < SEGMENT_POINTS:
+            start = SEGMENT_POINTS - segment.point_count
+            _fill(segment, points[:start])
+            to_update.append(segment)
+
+        next_seq = segment.seq + 1 if segment is not None else 0
+        for offset in range(start, len(points), SEGMENT_POINTS):
+            new_segment = TrackSegment(entry_id=entry_id, seq=next_seq, data=b"")
+            _fill(new_segment, points[offset:offset + SEGMENT_POINTS])
+            to_create.append(new_segment)
+            next_seq += 1
+
+    if to_update:
+        TrackSegment.objects.bulk_update(
+            to_update,
+            ["data", "point_count", "start_time", "end_time", "last_timestamp_ms", "last_lat_e6", "last_lon_e6"],
+        )
+    if to_create:
+        TrackSegment.objects.bulk_create(to_create)
+
+
+def append_track(entry_id, points):
+    append_tracks({entry_id: points})
+
+
+def fetch_track(entry_id, start=None, end=None):
+    """Points of one entry between two aware datetimes (inclusive), oldest segment first
+
+    Only the segments overlapping the range are read and decoded.
+    """
+    segments = TrackSegment.objects.filter(entry_id=entry_id)
+    if start is not None:
+        segments = segments.filter(end_time__gte=start)
+    if end is not None:
+        segments = segments.filter(start_time__lte=end)
+
+    start_ms = int(start.timestamp() * 1000) if start is not None else None
+    end_ms = int(end.timestamp() * 1000) if end is not None else None
+
+    points = []
+    for data in segments.order_by("seq").values_list("data", flat=True):
+        for t, lat, lon in decode_points(bytes(data)):
+            if (start_ms is None or t >= start_ms) and (end_ms is None or t <= end_ms):
+                points.append((t, lat / COORD_SCALE, lon / COORD_SCALE))
+    return points
+
+
+def track_points_by_entry(entry_ids):
+    """Decoded points of several entries, {entry_id: [(timestamp_ms, lat, lon), ...]}"""
+    tracks = defaultdict(list)
+    rows = (
+        TrackSegment.objects.filter(entry_id__in=entry_ids)
+        .order_by("entry_id", "seq")
+        .values_list("entry_id", "data")
+    )
+    for entry_id, data in rows:
+        tracks[entry_id].extend(
+            (t, lat / COORD_SCALE, lon / COORD_SCALE) for t, lat, lon in decode_points(bytes(data))
+        )
+    return dict(tracks)
@@ -1,10 +1,11 @@
 from django.urls import path
 from .views import (
     RegisterView, LoginView, UserDetailView, LogoutView,
-    TripListCreateView, TripRetrieveUpdateDeleteView,
+    TripListCreateView, TripRetrieveUpdateDeleteView, TripTreeView, TripGeometryView, TripLogGeometryView,
     LogEntryListCreateView, LogEntryRetrieveUpdateDeleteView, LogEntriesByTripLogView,
-    TripCompletionCreateView, TripCompletionRetrieveView,
-    TripLogListCreateView, TripLogRetrieveUpdateDeleteView, run_script, TripLogByTripView, update_log_entry, trip_end, log_end,
+    TripCompletionCreateView, TripCompletionRetrieveView, HosViolationListView,
+    TripLogListCreateView, TripLogRetrieveUpdateDeleteView, run_script, TripLogByTripView, update_log_entry, update_log_entries_batch, trip_end, log_end, export_view, metrics_view, log_entry_track, trip_plan, log_sheet,
+    trip_events, log_events, update_log_entry_async, update_log_entries_batch_async, trip_end_async,
 )
 
 urlpatterns = [
@@ -17,10 +18,17 @@ urlpatterns = [
     #  Trip Routes
     path('trips/', TripListCreateView.as_view(), name='trip-list-create'),
     path('trips/<int:pk>/', TripRetrieveUpdateDeleteView.as_view(), name='trip-detail'),
+    path('trips/<int:pk>/tree/', TripTreeView.as_view(), name='trip-tree'),
+    path('trips/<int:pk>/geometry/', TripGeometryView.as_view(), name='trip-geometry'),
+    path('trips/<int:pk>/plan/', trip_plan, name='trip-plan'),
+    path('trips/<int:pk>/events/', trip_events, name='trip-events'),
     
     #  Trip Logs Routes
     path('logs/', TripLogListCreateView.as_view(), name='trip-log-list-create'),
     path('logs/<int:pk>/', TripLogRetrieveUpdateDeleteView.as_view(), name='trip-log-detail'),
+    path('logs/<int:pk>/geometry/', TripLogGeometryView.as_view(), name='trip-log-geometry'),
+    path('logs/<int:pk>/sheet/', log_sheet, name='trip-log-sheet'),
+    path('logs/<int:pk>/events/', log_events, name='trip-log-events'),
     path('trip/logs/<int:tripId>/', TripLogByTripView.as_view(), name='trip-log-by-trips'),
     path("logs/log-end", log_end, name="log-end"),
     path('run-script/<int:trip_id>/', run_script, name='run_script'),
@@ -30,11 +38,26 @@ urlpatterns = [
     path('log-entries/', LogEntryListCreateView.as_view(), name='log-entry-list-create'),
     path('log-entries/<int:pk>/', LogEntryRetrieveUpdateDeleteView.as_view(), name='log-entry-detail'),
     path('logs/log-entries/<int:logId>/', LogEntriesByTripLogView.as_view(), name='log-entries-by-log'),
+    path('log-entries/<int:pk>/track/', log_entry_track, name='log-entry-track'),
     path("update-log-entry/", update_log_entry, name="update-log-entry"),
+    path("update-log-entries/", update_log_entries_batch, name="update-log-entries-batch"),
+    # Async variants for the ASGI server: routing calls do not hold a thread
+    path("async/update-log-entry/", update_log_entry_async, name="update-log-entry-async"),
+    path("async/update-log-entries/", update_log_entries_batch_async, name="update-log-entries-batch-async"),
 
 
     #  Trip Completion Routes
     #path('trip-completions/', TripCompletionCreateView.as_view(), name='trip-completion-create'),
     path('trip-completion/<int:trip_id>/', trip_end, name="trip_end"),
+    path('async/trip-completion/<int:trip_id>/', trip_end_async, name="trip_end_async"),
+
+    #  Compliance Routes
+    path('compliance/violations/', HosViolationListView.as_view(), name='hos-violations'),
+
+    #  Bulk Export Routes
+    path('export/<str:kind>/', export_view, name='export'),
+
+    #  Monitoring Routes
+    path('metrics/', metrics_view, name='metrics'),
     #log entry automation
 ]
@@ -1,24 +1,47 @@
-from django.db.models import Sum, F, ExpressionWrapper, fields
 from rest_framework.decorators import api_view
-from django.contrib.auth import authenticate, get_user_model
-from .models import Trip, LogEntry, TripLog, TripCompletion
-from rest_framework import status, viewsets, generics
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.signals import user_login_failed
+from .models import Trip, LogEntry, TripLog, TripCompletion, HosViolation
+from rest_framework import status, generics
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from django.db.models import F, Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
 from .serializers import (
     UserSerializer, RegisterSerializer, TripSerializer, 
-    LogEntrySerializer, TripCompletionSerializer, TripLogSerializer
+    LogEntrySerializer, TripCompletionSerializer, TripLogSerializer, TripTreeSerializer, HosViolationSerializer
 )
+import hmac
 import logging
-from datetime import datetime, timedelta
-from decimal import Decimal, ROUND_DOWN
-import requests
 import json
-from django.http import JsonResponse
+import math
+from datetime import datetime, time, timedelta
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from triplog.scripts import create_trip_log_and_entries
+from .distance import get_distance_service
+from .ingest import IngestError, parse_ping, parse_batch, parse_timestamp, ingest_pings, aingest_pings
+from .ingest_queue import ingest_mode, enqueue_pings
+from .pagination import KeysetPagination
+from .conditional import ConditionalGetMixin, make_etag, queryset_state
+from .response_cache import CachedResponseMixin, invalidate, trip_scope, log_scope
+from .export import EXPORTS, FORMATS, iter_export
+from .aggregation import update_trip_log, rebuild_driver_days, remove_log_from_rollup
+from .metrics import collect as collect_metrics, metrics_options, render as render_metrics
+from .tracks import fetch_track
+from .geometry import DEFAULT_TOLERANCE_METERS, zoom_tolerance, trip_geometry, log_geometry
+from .planner import PlanError, parse_location, plan_trip, SPEED_RANGE_MPH, MIN_FUEL_EVERY_MILES
+from .logsheet import FORMATS as SHEET_FORMATS, render_log_sheet
+from .events import notify, sse_stream
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 
 
 
@@ -62,18 +85,23 @@ class LoginView(APIView):
         if not identifier or not password:
             return Response({'error': 'Username and password are required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Retrieve the user (by username OR email)
-        try:
-            user = User.objects.get(username=identifier) if User.objects.filter(username=identifier).exists() else User.objects.get(email=identifier)
-        except User.DoesNotExist:
+        # Retrieve the user (by username OR email) in one query; a username match wins over an email match
+        candidates = list(User.objects.filter(Q(username=identifier) | Q(email=identifier))[:2])
+        if not candidates:
+            # Hash anyway so a missing user answers as slowly as a wrong password
+            User().set_password(password)
+            user_login_failed.send(sender=__name__, credentials={'username': identifier}, request=request)
             return Response({'error': 'Invalid credentials no user.'}, status=status.HTTP_401_UNAUTHORIZED)
+        user = next((candidate for candidate in candidates if candidate.username == identifier), candidates[0])
 
-        # Authenticate user (always using username for Django's default backend)
-        user = authenticate(request, username=user.username, password=password)
+        # The ModelBackend checks on the row already loaded, instead of authenticate() loading it again
+        if not (user.check_password(password) and ModelBackend().user_can_authenticate(user)):
+            user = None
 
         logger.info(f"Authenticated User: {user}")
 
         if user is None:
+            user_login_failed.send(sender=__name__, credentials={'username': identifier}, request=request)
             return Response({'error': 'Invalid credentials.'}, status=status.HTTP_401_UNAUTHORIZED)
 
         # Generate JWT tokens (using a custom utility function)
@@ -117,13 +145,119 @@ class LogoutView(APIView):
 
 
  # Trip CRUD
-class TripListCreateView(generics.ListCreateAPIView):
+class TripListCreateView(ConditionalGetMixin, generics.ListCreateAPIView):
     queryset = Trip.objects.all().order_by('-created_at')
     serializer_class = TripSerializer
+    pagination_class = KeysetPagination
+    pagination_ordering = ("-created_at", "-id")
 
-class TripRetrieveUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
+class TripRetrieveUpdateDeleteView(CachedResponseMixin, ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Trip.objects.all()
     serializer_class = TripSerializer
+    cache_scope = (trip_scope, "pk")
+
+    def perform_update(self, serializer):
+        old_driver_id = serializer.instance.driver_id
+        trip = serializer.save()
+        invalidate(trip_ids=[trip.id])
+        if trip.driver_id != old_driver_id:
+            # Move the trip's days between the two drivers' rollups
+            days = list(trip.logs.values_list("log_date", flat=True))
+            rebuild_driver_days(old_driver_id, days)
+            rebuild_driver_days(trip.driver_id, days)
+
+    def perform_destroy(self, instance):
+        driver_id = instance.driver_id
+        logs = list(instance.logs.values_list("id", "log_date"))
+        invalidate(trip_ids=[instance.id], log_ids=[log_id for log_id, _ in logs])
+        instance.delete()
+        rebuild_driver_days(driver_id, [day for _, day in logs])
+
+def date_query_param(request, name):
+    """Optional YYYY-MM-DD query parameter as a date"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({"error": f"{name} must be a YYYY-MM-DD date"})
+    return parsed
+
+# Trip with its TripLogs and their LogEntries in one response
+class TripTreeView(CachedResponseMixin, ConditionalGetMixin, generics.RetrieveAPIView):
+    serializer_class = TripTreeSerializer
+    cache_scope = (trip_scope, "pk")
+
+    def get_log_filter(self):
+        log_filter = {}
+        start = date_query_param(self.request, "start")
+        end = date_query_param(self.request, "end")
+        if start:
+            log_filter["log_date__gte"] = start
+        if end:
+            log_filter["log_date__lte"] = end
+        return log_filter
+
+    def get_queryset(self):
+        logs = TripLog.objects.filter(**self.get_log_filter()).order_by("log_date", "id")
+
+        # Three queries in total, whatever the number of days
+        return Trip.objects.prefetch_related(
+            Prefetch("logs", queryset=logs.prefetch_related(
+                Prefetch("log_entries", queryset=LogEntry.objects.order_by("start_time", "id"))
+            ))
+        )
+
+    def get_validators(self):
+        trip = Trip.objects.filter(pk=self.kwargs["pk"]).values_list("id", "updated_at").first()
+        if trip is None:
+            return None, None
+
+        log_filter = self.get_log_filter()
+        logs = queryset_state(TripLog.objects.filter(trip=trip[0], **log_filter))
+        entries = queryset_state(LogEntry.objects.filter(
+            log__trip=trip[0], **{f"log__{lookup}": value for lookup, value in log_filter.items()}
+        ))
+        return make_etag("trip-tree", self.request.get_full_path(), *trip, *logs, *entries), None
+
+def tolerance_query_param(request):
+    """Simplification tolerance in meters from ?tolerance= or a map ?zoom= level"""
+    tolerance = request.query_params.get("tolerance")
+    zoom = request.query_params.get("zoom")
+    try:
+        if tolerance:
+            value = float(tolerance)
+            if not value > 0:
+                raise ValueError
+            return value
+        if zoom:
+            return zoom_tolerance(int(zoom))
+    except ValueError:
+        raise ValidationError({"error": "tolerance must be a positive number of meters and zoom an integer"})
+    return DEFAULT_TOLERANCE_METERS
+
+# Simplified GPS tracks for the map, per ?zoom= or ?tolerance=; subclasses set
+# `geometry` to the builder taking (pk, tolerance)
+class GeometryView(generics.GenericAPIView):
+    geometry = None
+
+    def get(self, request, *args, **kwargs):
+        if not self.get_queryset().filter(pk=self.kwargs["pk"]).exists():
+            return Response({"error": "Not found"}, status=404)
+        return Response(self.geometry(self.kwargs["pk"], tolerance_query_param(request)))
+
+class TripGeometryView(CachedResponseMixin, GeometryView):
+    queryset = Trip.objects.all()
+    geometry = staticmethod(trip_geometry)
+    cache_scope = (trip_scope, "pk")
+
+class TripLogGeometryView(CachedResponseMixin, GeometryView):
+    queryset = TripLog.objects.all()
+    geometry = staticmethod(log_geometry)
+    cache_scope = (log_scope, "pk")
 
 # Trip Completion CRUD
 class TripCompletionCreateView(generics.CreateAPIView):
@@ -135,242 +269,295 @@ class TripCompletionRetrieveView(generics.RetrieveAPIView):
     serializer_class = TripCompletionSerializer
 
 
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+# HOS violations stored by the check_compliance command, for drivers (?driver=a,b) and a day range
+class HosViolationListView(generics.ListAPIView):
+    serializer_class = HosViolationSerializer
+    pagination_class = KeysetPagination
+    pagination_ordering = ("occurred_at", "id")
+
+    def get_queryset(self):
+        violations = HosViolation.objects.all()
+        drivers = [driver for driver in self.request.query_params.get("driver", "").split(",") if driver]
+        if drivers:
+            violations = violations.filter(driver_id__in=drivers)
+        rule = self.request.query_params.get("rule")
+        if rule:
+            violations = violations.filter(rule=rule)
+        start = date_query_param(self.request, "start")
+        end = date_query_param(self.request, "end")
+        # Datetime bounds rather than __date, so the occurred_at index is used
+        if start:
+            violations = violations.filter(occurred_at__gte=day_start(start))
+        if end:
+            violations = violations.filter(occurred_at__lt=day_start(end + timedelta(days=1)))
+        return violations
+
+
 # Log Entry Create/Update/Delete
-class LogEntryListCreateView(generics.ListCreateAPIView):
+class LogEntryListCreateView(ConditionalGetMixin, generics.ListCreateAPIView):
     queryset = LogEntry.objects.all()
     serializer_class = LogEntrySerializer
+    pagination_class = KeysetPagination
+    pagination_ordering = ("start_time", "id")
 
     def perform_create(self, serializer):
         log_entry = serializer.save()
         update_trip_log(log_entry.log.id)  # Update TripLog
 
 
-class LogEntryRetrieveUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
+class LogEntryRetrieveUpdateDeleteView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = LogEntry.objects.all()
     serializer_class = LogEntrySerializer
 
     def perform_update(self, serializer):
+        old_log_id = serializer.instance.log_id
         log_entry = serializer.save()
         update_trip_log(log_entry.log.id)  # Update TripLog
+        if old_log_id != log_entry.log_id:
+            update_trip_log(old_log_id)  # Entry moved out of this log
 
     def perform_destroy(self, instance):
         log_id = instance.log
         instance.delete()
         update_trip_log(log_id.id)  # Recalculate TripLog after deletion
 
-class LogEntriesByTripLogView(generics.ListAPIView):
+class LogEntriesByTripLogView(CachedResponseMixin, ConditionalGetMixin, generics.ListAPIView):
+    """All entries of one TripLog as a plain array; a day's log is small enough not to page"""
     serializer_class = LogEntrySerializer
+    cache_scope = (log_scope, "logId")
 
     def get_queryset(self):
         log_id = self.kwargs.get('logId')
-        result = LogEntry.objects.filter(log=log_id)
-        return LogEntry.objects.filter(log=log_id)
+        return LogEntry.objects.filter(log=log_id).order_by(F("start_time").asc(nulls_first=True), "id")
 
-class TripLogListCreateView(generics.ListCreateAPIView):
+class TripLogListCreateView(ConditionalGetMixin, generics.ListCreateAPIView):
     queryset = TripLog.objects.all()
     serializer_class = TripLogSerializer
+    pagination_class = KeysetPagination
+    pagination_ordering = ("log_date", "id")
+
+    def perform_create(self, serializer):
+        trip_log = serializer.save()
+        invalidate(trip_ids=[trip_log.trip_id], log_ids=[trip_log.id])
+        rebuild_driver_days(trip_log.trip.driver_id, [trip_log.log_date])
 
 #  Delete TripLog and its related LogEntries
-class TripLogRetrieveUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
+class TripLogRetrieveUpdateDeleteView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = TripLog.objects.all().order_by('-created_at')
     serializer_class = TripLogSerializer
 
+    def perform_update(self, serializer):
+        old_driver_id = serializer.instance.trip.driver_id
+        old_trip_id = serializer.instance.trip_id
+        old_date = serializer.instance.log_date
+        trip_log = serializer.save()
+        invalidate(trip_ids=[old_trip_id, trip_log.trip_id], log_ids=[trip_log.id])
+        rebuild_driver_days(old_driver_id, [old_date])
+        rebuild_driver_days(trip_log.trip.driver_id, [trip_log.log_date])
+
     def perform_destroy(self, instance):
-        LogEntry.objects.filter(log_id=instance.trip_id).delete()
+        invalidate(trip_ids=[instance.trip_id], log_ids=[instance.id])
+        remove_log_from_rollup(instance)
+        LogEntry.objects.filter(log_id=instance.id).delete()
         instance.delete()
 
-class TripLogByTripView(generics.ListAPIView):
+class TripLogByTripView(CachedResponseMixin, ConditionalGetMixin, generics.ListAPIView):
+    """All TripLogs of one trip as a plain array"""
     serializer_class = TripLogSerializer
+    cache_scope = (trip_scope, "tripId")
 
     def get_queryset(self):
         trip_id = self.kwargs.get('tripId')
-        result = TripLog.objects.filter(trip=trip_id)
-        return TripLog.objects.filter(trip=trip_id)
-
-# Helper function: Update Trip Log when log entries change
-def update_trip_log(log_id):
-    log_entries = LogEntry.objects.filter(log=log_id)
-    log = TripLog.objects.filter(id=log_id).first()
-
-   # if not log_entries.exists():
-        # No log entries left for this date, delete the TripLog
-        #TripLog.objects.filter(trip=log).delete()
-        #return
-
-    duration_expr = ExpressionWrapper(
-        F("end_time") - F("start_time"), output_field=fields.DurationField()
-    )
-
-    # Calculate total hours per status
-    total_off_duty_hours = (
-        log_entries.filter(status="off_duty")
-        .annotate(duration=duration_expr)
-        .aggregate(Sum("duration"))["duration__sum"]
-        or timedelta()
-    )
+        return TripLog.objects.filter(trip=trip_id).order_by("log_date", "id")
 
-    total_sleeper_hours = (
-        log_entries.filter(status="sleeper")
-        .annotate(duration=duration_expr)
-        .aggregate(Sum("duration"))["duration__sum"]
-        or timedelta()
-    )
-
-    total_driving_hours = (
-        log_entries.filter(status="driving")
-        .annotate(duration=duration_expr)
-        .aggregate(Sum("duration"))["duration__sum"]
-        or timedelta()
-    )
-
-    total_on_duty_hours = (
-        log_entries.filter(status="on_duty")
-        .annotate(duration=duration_expr)
-        .aggregate(Sum("duration"))["duration__sum"]
-        or timedelta()
-    )
-    # Calculate miles driven today
-    total_miles_driving_today = log_entries.filter(status="driving").aggregate(Sum("mileage"))["mileage__sum"] or 0
-    total_miles_today = log_entries.aggregate(Sum("mileage"))["mileage__sum"] or 0
-
-    # Get latest GPS location
-    latest_entry = log_entries.order_by("-id").first()
-    #gps_location = {
-     #   "latitude": latest_entry.latitude if latest_entry else None,
-      #  "longitude": latest_entry.longitude if latest_entry else None
-    #}
-    gps_location = latest_entry.end_gps
-    #  Compliance Tracking (Check past logs)
-    start_date = log.log_date - timedelta(days=7)
-    on_duty_last_7_days = TripLog.objects.filter(trip=log.trip, log_date__gte=start_date) \
-        .aggregate(Sum("total_on_duty_hours"))["total_on_duty_hours__sum"] or 0
-
-    start_date_8_days = log.log_date - timedelta(days=8)
-    on_duty_last_8_days = TripLog.objects.filter(trip=log.trip, log_date__gte=start_date_8_days) \
-        .aggregate(Sum("total_on_duty_hours"))["total_on_duty_hours__sum"] or 0
-
-    start_date_6_days = log.log_date - timedelta(days=6)
-    on_duty_last_6_days = TripLog.objects.filter(trip=log.trip, log_date__gte=start_date_6_days) \
-        .aggregate(Sum("total_on_duty_hours"))["total_on_duty_hours__sum"] or 0
-
-    start_date_7_days_60 = log.log_date - timedelta(days=7)
-    on_duty_last_7_days_60 = TripLog.objects.filter(trip=log.trip, log_date__gte=start_date_7_days_60) \
-        .aggregate(Sum("total_on_duty_hours"))["total_on_duty_hours__sum"] or 0
-
-    #  Available Hours Tomorrow (Assuming 70-hour max rule)
-    max_hours_per_week = 70
-    available_hours_tomorrow = max(0, max_hours_per_week - on_duty_last_7_days)
-    
-
-    #  Update or create TripLog
-    trip_log, created = TripLog.objects.update_or_create(
-        id=log_id,
-        defaults={
-            "total_off_duty_hours": timedelta_to_decimal(total_off_duty_hours),
-            "total_sleeper_hours": timedelta_to_decimal(total_sleeper_hours),
-            "total_driving_hours": timedelta_to_decimal(total_driving_hours),
-            "total_on_duty_hours": timedelta_to_decimal(total_on_duty_hours),
-            "total_miles_driving_today": total_miles_driving_today,
-            "total_miles_today": total_miles_today,
-            "total_on_duty_hours_last_7_days": on_duty_last_7_days,
-            "total_on_duty_hours_last_8_days": on_duty_last_8_days,
-            "total_on_duty_hours_last_6_days": on_duty_last_6_days,
-            "total_on_duty_hours_last_7_days_60": on_duty_last_7_days_60,
-            "available_hours_tomorrow": available_hours_tomorrow,
-            "gps_location": gps_location
-    
-        }
-    )
 def get_road_distance(start_gps, end_gps):
-    """Calculate real-world road distance using OSRM API"""
-    if not start_gps or not end_gps:
-        return 0
+    """Calculate real-world road distance (miles) through the shared distance service"""
+    return get_distance_service().distance(start_gps, end_gps)
 
-    coords = f"{start_gps['longitude']},{start_gps['latitude']};{end_gps['longitude']},{end_gps['latitude']}"
-    url = f"http://router.project-osrm.org/route/v1/driving/{coords}?overview=false"
+def ping_response_data(result, ping):
+    response_data = {"message": "Log entry updated successfully!"}
+    fuel_message = result["fuel_warnings"].get(result["trip_ids"][ping["log_id"]])
+    if fuel_message:
+        response_data["fuel_warning"] = fuel_message
+    return response_data
 
-    logger.info(f"Log  entries: {coords}")
-    response = requests.get(url)
-    data = response.json()
+def batch_response_data(result):
+    return {
+        "message": "Log entries updated successfully!",
+        "processed": result["processed"],
+        "entries_created": result["entries_created"],
+        "fuel_warnings": result["fuel_warnings"],
+    }
 
-    if "routes" in data and data["routes"]:
-        return data["routes"][0]["distance"] / 1609.34  # Convert meters to miles
-    return 0
+def json_body(request):
+    try:
+        return json.loads(request.body or b"null")
+    except ValueError:
+        raise IngestError("Invalid JSON")
 
 @api_view(["POST"])
 def update_log_entry(request):
-    log_id = request.data.get("logId")
-    new_status = request.data.get("status")
-    timestamp = request.data.get("timestamp")
-    gps = request.data.get("gps")
-
     try:
-        log = TripLog.objects.get(id=log_id)
-    except TripLog.DoesNotExist:
-        return Response({"error": "TripLog not found"}, status=404)
+        ping = parse_ping(request.data)
+        if ingest_mode() == "queued":
+            # Write-behind: persisted by drain_ingest_queue workers
+            enqueue_pings([ping])
+            return Response({"message": "Log entry queued"}, status=202)
+        result = ingest_pings([ping])
+    except IngestError as e:
+        return Response(e.as_response_data(), status=e.status)
 
-    try:
-        # Ensure timestamp is a string before converting
-        if isinstance(timestamp, int):  # If it's an integer (UNIX timestamp)
-            timestamp = datetime.utcfromtimestamp(timestamp / 1000)  # Convert ms to seconds
+    return Response(ping_response_data(result, ping), status=200)
 
-        elif isinstance(timestamp, str):
-            timestamp = datetime.fromisoformat(timestamp)  # Convert ISO string to datetime
+@api_view(["POST"])
+def update_log_entries_batch(request):
+    """Ingest an ordered array of pings (optionally under "pings"), possibly for several logs"""
+    try:
+        pings = parse_batch(request.data)
+        if ingest_mode() == "queued":
+            queued = enqueue_pings(pings)
+            return Response({"message": "Log entries queued", "queued": queued}, status=202)
+        result = ingest_pings(pings)
+    except IngestError as e:
+        return Response(e.as_response_data(), status=e.status)
+
+    return Response(batch_response_data(result), status=200)
+
+@csrf_exempt
+@require_POST
+async def update_log_entry_async(request):
+    """update_log_entry for the ASGI server: routing calls are awaited instead of holding a thread"""
+    try:
+        ping = parse_ping(json_body(request))
+        if ingest_mode() == "queued":
+            await sync_to_async(enqueue_pings)([ping])
+            return JsonResponse({"message": "Log entry queued"}, status=202)
+        result = await aingest_pings([ping])
+    except IngestError as e:
+        return JsonResponse(e.as_response_data(), status=e.status)
+
+    return JsonResponse(ping_response_data(result, ping), status=200)
+
+@csrf_exempt
+@require_POST
+async def update_log_entries_batch_async(request):
+    """update_log_entries_batch for the ASGI server; a batch's routing calls run concurrently"""
+    try:
+        pings = parse_batch(json_body(request))
+        if ingest_mode() == "queued":
+            queued = await sync_to_async(enqueue_pings)(pings)
+            return JsonResponse({"message": "Log entries queued", "queued": queued}, status=202)
+        result = await aingest_pings(pings)
+    except IngestError as e:
+        return JsonResponse(e.as_response_data(), status=e.status)
+
+    return JsonResponse(batch_response_data(result), status=200)
+
+def timestamp_query_param(request, name):
+    """Optional ms-since-epoch or ISO 8601 query parameter as an aware datetime"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        return parse_timestamp(int(value) if value.isdigit() else value)
+    except (ValueError, OverflowError, OSError):
+        raise ValidationError({"error": f"{name} must be a timestamp in ms or ISO 8601"})
 
+@api_view(["GET"])
+def log_entry_track(request, pk):
+    """Stored GPS track of a LogEntry as [timestamp_ms, lat, lon] points, optionally within ?start=&end="""
+    if not LogEntry.objects.filter(id=pk).exists():
+        return Response({"error": "LogEntry not found"}, status=404)
+
+    points = fetch_track(pk, timestamp_query_param(request, "start"), timestamp_query_param(request, "end"))
+    return Response({"entry": pk, "points": points})
+
+def bounded_query_param(request, name, low, high=math.inf):
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        parsed = float(value)
     except ValueError:
-        return Response({"error": "Invalid timestamp format"}, status=400)
-
-    trip = log.trip
-    log_entries = LogEntry.objects.filter(log=log)
-    last_entry = log_entries.last()
-    fuel_message = None
-
-    if last_entry:
-        distance = get_road_distance(last_entry.end_gps, gps)
-        #Update the Trip (not TripLog) total_mileage
-        trip.total_mileage += Decimal(str(distance))
-        trip.save()            
-
-        if last_entry.status == new_status:
-            # Status unchanged → Update GPS and mileage
-            last_entry.mileage += distance
-            last_entry.end_gps = gps
-            last_entry.save()
-        else:
-            # Status changed → Close previous entry
-            last_entry.end_time = timestamp
-            last_entry.end_gps = gps
-            last_entry.save()
-
-            # Start a new log entry
-            LogEntry.objects.create(
-                log=log,
-                status=new_status,
-                start_time=timestamp,
-                start_gps=gps,
-                mileage=0.0
-            )
-    else:
-        # First log entry
-        LogEntry.objects.create(
-            log=log,
-            status=new_status,
-            start_time=timestamp,
-            start_gps=gps,
-            mileage=0.0
-        )
-    update_trip_log(log_id)
-    remainder = float(trip.total_mileage % 1000)
-    if remainder >= 995:
-        next_station = (int(trip.total_mileage / 1000) + 1) * 1000
-        fuel_message = f"Fuel station in the next {next_station - float(trip.total_mileage):.1f} km"
+        parsed = math.nan
+    if not low <= parsed <= high:
+        bounds = f"between {low} and {high}" if high != math.inf else f"at least {low}"
+        raise ValidationError({"error": f"{name} must be a number {bounds}"})
+    return parsed
 
-    response_data = {"message": "Log entry updated successfully!"}
+@api_view(["GET"])
+def trip_plan(request, pk):
+    """Stop schedule (breaks, rests, restarts, fuel) from the trip's position to its destination (?to=lat,lon)"""
+    trip = get_object_or_404(Trip.objects.only("id", "driver_id", "from_location", "to_location", "cycle_type", "total_mileage"), pk=pk)
+    destination = None
+    if request.query_params.get("to"):
+        destination = parse_location(request.query_params["to"])
+        if destination is None:
+            raise ValidationError({"error": "to must be a lat,lon pair"})
+
+    options = {}
+    for param, option, bounds in (
+        ("speed", "AVERAGE_SPEED_MPH", SPEED_RANGE_MPH),
+        ("fuel_every", "FUEL_EVERY_MILES", (MIN_FUEL_EVERY_MILES,)),
+    ):
+        value = bounded_query_param(request, param, *bounds)
+        if value is not None:
+            options[option] = value
 
-    if fuel_message:
-        response_data["fuel_warning"] = fuel_message
+    try:
+        plan = plan_trip(trip, destination, **options)
+    except PlanError as e:
+        return Response({"error": str(e)}, status=400)
+    return Response(plan)
 
-    return Response(response_data, status=200)
+@api_view(["GET"])
+def log_sheet(request, pk):
+    """The TripLog's printable daily log grid as ?output=svg|png|pdf, ETag'd by its content hash"""
+    fmt = request.query_params.get("output", "svg")
+    if fmt not in SHEET_FORMATS:
+        return JsonResponse({"error": f"output must be one of {', '.join(SHEET_FORMATS)}"}, status=400)
+
+    rendered = render_log_sheet(pk, fmt)
+    if rendered is None:
+        return JsonResponse({"error": "TripLog not found"}, status=404)
+    data, digest = rendered
+
+    etag = f'"{digest}"'
+    if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(data, content_type=SHEET_FORMATS[fmt])
+        response["Content-Disposition"] = f'inline; filename="log-{pk}.{fmt}"'
+    response["ETag"] = etag
+    return response
+
+async def event_stream_response(request, queryset, channels):
+    """Server-sent events for `channels`, if the row behind them exists
+
+    Streams only under the ASGI server: a WSGI worker would be tied up for
+    as long as the client stays connected.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Event streams are only served by the ASGI application"}, status=501)
+    if not await queryset.aexists():
+        return JsonResponse({"error": "Not found"}, status=404)
+    response = StreamingHttpResponse(sse_stream(channels), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # Keep nginx from buffering the stream
+    return response
+
+@require_GET
+async def trip_events(request, pk):
+    """Entries, totals and fuel warnings of a trip and all its logs, as they are written"""
+    return await event_stream_response(request, Trip.objects.filter(pk=pk), [trip_scope(pk)])
+
+@require_GET
+async def log_events(request, pk):
+    """Entries and totals of one TripLog, as they are written"""
+    return await event_stream_response(request, TripLog.objects.filter(pk=pk), [log_scope(pk)])
 
 @api_view(["POST"])
 def log_end(request):
@@ -381,11 +568,15 @@ def log_end(request):
             new_remarks = data.get("remarks")
 
             # Update the Trip model
-            updated_rows = TripLog.objects.filter(id=log_id).update(remarks=new_remarks)
+            updated_rows = TripLog.objects.filter(id=log_id).update(remarks=new_remarks, updated_at=timezone.now())
 
             if updated_rows == 0:
                 return JsonResponse({"error": "Log not found"}, status=404)
 
+            trip_id = TripLog.objects.filter(id=log_id).values_list("trip_id", flat=True).first()
+            invalidate(trip_ids=[trip_id], log_ids=[log_id])
+            notify("log_ended", trip_id, log_id, remarks=new_remarks)
+
             return JsonResponse({"message": "Log remarks updated successfully"}, status=200)
 
         except json.JSONDecodeError:
@@ -393,34 +584,84 @@ def log_end(request):
 
     return JsonResponse({"error": "Invalid request method"}, status=405)
 
+def end_trip(trip_id):
+    """Mark the trip completed, returning it, or None if it does not exist"""
+    try:
+        trip = Trip.objects.get(id=trip_id)
+    except Trip.DoesNotExist:
+        return None
+
+    # Get the previous completed trip and accumulate mileage
+    previous_trip = (
+        Trip.objects
+        .filter(status="completed")
+        .exclude(id=trip.id)  # Ensure we're not referencing the current trip
+        .order_by("-created_at")  # Use end_time or any other field that signifies trip end
+        .first()  # Get the most recent completed trip
+    )
+
+    # Add previous trip mileage to the current trip's total_mileage
+    if previous_trip:
+        trip.total_mileage += previous_trip.total_mileage
+
+    # Mark the trip as completed
+    trip.status = "completed"
+    trip.save()
+    invalidate(trip_ids=[trip.id])
+    notify("trip_ended", trip.id, status=trip.status, total_mileage=trip.total_mileage)
+    return trip
+
 @api_view(["POST"])
 def trip_end(request, trip_id):
     if request.method == "POST":
-        try:
-            trip = Trip.objects.get(id=trip_id)
-        except Trip.DoesNotExist:
+        if end_trip(trip_id) is None:
             return JsonResponse({"error": "Trip not found"}, status=404)
+        return JsonResponse({"message": "Trip ended successfully"}, status=200)
 
-        # Get the previous completed trip and accumulate mileage
-        previous_trip = (
-            Trip.objects
-            .filter(status="completed")
-            .exclude(id=trip.id)  # Ensure we're not referencing the current trip
-            .order_by("-created_at")  # Use end_time or any other field that signifies trip end
-            .first()  # Get the most recent completed trip
-        )
-
-        # Add previous trip mileage to the current trip's total_mileage
-        if previous_trip:
-            trip.total_mileage += previous_trip.total_mileage
+    return JsonResponse({"error": "Invalid request method"}, status=405)
 
-        # Mark the trip as completed
-        trip.status = "completed"
-        trip.save()
+@csrf_exempt
+@require_POST
+async def trip_end_async(request, trip_id):
+    """trip_end for the ASGI server"""
+    if await sync_to_async(end_trip)(trip_id) is None:
+        return JsonResponse({"error": "Trip not found"}, status=404)
+    return JsonResponse({"message": "Trip ended successfully"}, status=200)
 
-        return JsonResponse({"message": "Trip ended successfully"}, status=200)
+@api_view(["GET"])
+def export_view(request, kind):
+    """Stream LogEntries or TripLogs as CSV / NDJSON (?output=) for drivers (?driver=a,b) and a date range"""
+    if kind not in EXPORTS:
+        return JsonResponse({"error": f"Unknown export {kind}"}, status=404)
+
+    # Not ?format=, which DRF reserves for renderer selection
+    fmt = request.query_params.get("output", "csv")
+    if fmt not in FORMATS:
+        return JsonResponse({"error": "output must be csv or ndjson"}, status=400)
+
+    drivers = [driver for driver in request.query_params.get("driver", "").split(",") if driver]
+    start = date_query_param(request, "start")
+    end = date_query_param(request, "end")
+
+    response = StreamingHttpResponse(iter_export(kind, fmt, drivers, start, end), content_type=FORMATS[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+def metrics_view(request):
+    """Per-endpoint metrics of every worker in Prometheus text format
+
+    Served only when METRICS["TOKEN"] is set, to requests presenting it as
+    a bearer token (Prometheus' `authorization` scrape option).
+    """
+    token = metrics_options()["TOKEN"]
+    if not token:
+        return HttpResponse(status=404)
+    if not hmac.compare_digest(request.META.get("HTTP_AUTHORIZATION", "").encode(), f"Bearer {token}".encode()):
+        response = HttpResponse(status=401)
+        response["WWW-Authenticate"] = 'Bearer realm="metrics"'
+        return response
+    return HttpResponse(render_metrics(collect_metrics()), content_type="text/plain; version=0.0.4; charset=utf-8")
 
-    return JsonResponse({"error": "Invalid request method"}, status=405)
 @api_view(["GET"])
 def run_script(request, trip_id):
     
@@ -431,12 +672,3 @@ def run_script(request, trip_id):
 
     return JsonResponse({'message': f'Logs added successfully for trip {trip_id}'}, status=200)
 
-
-def timedelta_to_decimal(td):
-    """Converts timedelta to total hours as Decimal (5,2 format)"""
-    
-
-    total_seconds = td.total_seconds()  # Convert timedelta to seconds
-    total_hours = total_seconds / 3600  # Convert seconds to hours
-    return Decimal(total_hours).quantize(Decimal("0.00"), rounding=ROUND_DOWN)
-
@@ -1,11 +1,11 @@
 import { createContext, ReactNode, useContext } from "react";
 import { useQuery, useMutation, UseMutationResult } from "@tanstack/react-query";
-import { getQueryFn, apiRequest, queryClient } from "../lib/queryClient";
+import { getQueryFn, apiRequest, queryClient, allPages } from "../lib/queryClient";
 
 // Fetch all trips
 const fetchTrips = async () => {
   const response = await fetch("/api/trips");
-  return response.json();
+  return allPages(await response.json());
 };
 
 // Fetch a single trip by ID
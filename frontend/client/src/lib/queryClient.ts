@@ -33,6 +33,24 @@ export async function apiRequest(
 
 
 
+// Whole-table list endpoints (/api/trips/, /api/logs/, /api/log-entries/) are
+// cursor-paginated as { next, previous, results }; follow `next` so callers get every row
+export async function allPages(data: any, init: RequestInit = {}) {
+  if (!(data && Array.isArray(data.results) && "next" in data)) {
+    return data;
+  }
+  const rows = [...data.results];
+  let next = data.next;
+  while (next) {
+    const res = await fetch(next, init);
+    await throwIfResNotOk(res);
+    const page = await res.json();
+    rows.push(...page.results);
+    next = page.next;
+  }
+  return rows;
+}
+
 type UnauthorizedBehavior = "returnNull" | "throw";
 export const getQueryFn: <T>(options: {
   on401: UnauthorizedBehavior;
@@ -48,7 +66,7 @@ export const getQueryFn: <T>(options: {
     }
 
     await throwIfResNotOk(res);
-    return await res.json();
+    return allPages(await res.json(), { credentials: "include" });
   };
 
 export const queryClient = new QueryClient({